@@ -0,0 +1,132 @@
+"""
+Archivo de semestres cerrados.
+
+Al cerrar un semestre, sus asignaciones y reseñas salen de los archivos que
+usan los handlers (estudiantes.json, reseñas.json) y pasan a una partición
+comprimida de solo lectura, archivo/<semestre>.json.gz, que nunca se
+reescribe. Junto a las particiones se mantiene resumen.json con los
+agregados de reseñas por optativa y semestre (cantidad, suma y cantidad por
+puntuación), que es lo único que se carga en memoria para consultar el
+histórico.
+
+Las funciones que tocan archivos son bloqueantes: se llaman desde el hilo
+del almacén o antes de iniciar el bucle de eventos.
+"""
+
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+
+from records import como_json
+from storage import escribir_json_atomico, leer_json
+
+PATRON_SEMESTRE = re.compile(r"[\w-]{1,40}")
+
+
+class ResumenHistorico:
+    """Agregados de reseñas archivadas de una optativa, sumando todos sus semestres."""
+
+    def __init__(self):
+        self.cantidad = 0
+        self.suma = 0
+        self.por_puntuacion = [0] * 6
+        self.semestres = []
+
+    def agregar(self, semestre, datos):
+        self.cantidad += datos["cantidad"]
+        self.suma += datos["suma"]
+        for puntuacion, cantidad in enumerate(datos["por_puntuacion"]):
+            self.por_puntuacion[puntuacion] += cantidad
+        self.semestres.append(semestre)
+
+    @property
+    def promedio(self):
+        return self.suma / self.cantidad if self.cantidad else 0.0
+
+
+class ArchivoSemestres:
+    """
+    Particiones de una carpeta de archivo y su índice de resúmenes.
+    'version' cambia con cada semestre archivado, para invalidar cachés.
+    """
+
+    def __init__(self, carpeta):
+        self.carpeta = carpeta
+        self.ruta_resumen = os.path.join(carpeta, "resumen.json")
+        self.version = 0
+        # semestre → {"fecha", "estudiantes", "resenas", "optativas": {nombre: agregados}}
+        self._semestres = {}
+        self._por_optativa = {}
+
+    def cargar(self):
+        self._semestres = leer_json(self.ruta_resumen, {})
+        self._reindexar()
+
+    def _reindexar(self):
+        # Se arma aparte y se reemplaza de una vez: archivar() corre en otro hilo que el bucle
+        por_optativa = {}
+        for semestre, datos in self._semestres.items():
+            for optativa, agregados in datos["optativas"].items():
+                por_optativa.setdefault(optativa, ResumenHistorico()).agregar(semestre, agregados)
+        self._por_optativa = por_optativa
+        self.version += 1
+
+    def semestres(self):
+        """Semestres archivados con su fecha y cantidades, en orden de archivo."""
+        return {
+            semestre: {clave: datos[clave] for clave in ("fecha", "estudiantes", "resenas")}
+            for semestre, datos in self._semestres.items()
+        }
+
+    def __contains__(self, semestre):
+        return semestre in self._semestres
+
+    def resumen(self, optativa):
+        """Agregados históricos de la optativa, o None si no tiene reseñas archivadas."""
+        return self._por_optativa.get(optativa)
+
+    def ruta_particion(self, semestre):
+        return os.path.join(self.carpeta, f"{semestre}.json.gz")
+
+    def archivar(self, semestre, estudiantes, resenas):
+        """
+        Escribe la partición del semestre y actualiza el resumen. Lanza
+        ValueError si el nombre no es válido o el semestre ya está archivado.
+        """
+        if not PATRON_SEMESTRE.fullmatch(semestre):
+            raise ValueError("El semestre solo puede tener letras, números, '_' y '-' (hasta 40 caracteres).")
+        ruta = self.ruta_particion(semestre)
+        if semestre in self._semestres or os.path.exists(ruta):
+            raise ValueError(f"El semestre '{semestre}' ya está archivado.")
+        os.makedirs(self.carpeta, exist_ok=True)
+
+        fecha = datetime.now().isoformat(timespec="seconds")
+        temporal = ruta + ".tmp"
+        with gzip.open(temporal, "wt", encoding="utf-8") as f:
+            json.dump(
+                {"semestre": semestre, "fecha": fecha, "estudiantes": estudiantes, "resenas": resenas},
+                f, ensure_ascii=False, separators=(",", ":"), default=como_json,
+            )
+        os.replace(temporal, ruta)
+        os.chmod(ruta, 0o444)
+
+        optativas = {}
+        for r in resenas:
+            agregados = optativas.setdefault(r["optativa"], {"cantidad": 0, "suma": 0, "por_puntuacion": [0] * 6})
+            agregados["cantidad"] += 1
+            agregados["suma"] += r["puntuacion"]
+            agregados["por_puntuacion"][r["puntuacion"]] += 1
+        semestres = dict(self._semestres)
+        semestres[semestre] = {
+            "fecha": fecha, "estudiantes": len(estudiantes), "resenas": len(resenas), "optativas": optativas,
+        }
+        escribir_json_atomico(self.ruta_resumen, semestres)
+        self._semestres = semestres
+        self._reindexar()
+
+    def leer_particion(self, semestre):
+        """Contenido completo de una partición (estudiantes y reseñas del semestre)."""
+        with gzip.open(self.ruta_particion(semestre), "rt", encoding="utf-8") as f:
+            return json.load(f)
@@ -0,0 +1,161 @@
+"""
+Asignación automática de optativas como flujo de costo mínimo.
+
+La red tiene un nodo por estudiante y uno por optativa. Cada estudiante
+aporta una unidad de flujo y tiene una arista hacia cada optativa de su
+lista de preferencias, con costo igual a su posición en ella (0 para la
+primera opción); las optativas que no eligió no tienen arista. Cada
+optativa llega al sumidero con capacidad igual a sus plazas libres
+(ilimitada si son -1). Además, cada estudiante puede ir directo al sumidero
+(quedar sin plaza) con una penalización mayor que cualquier suma de
+posiciones, así que el flujo de costo mínimo asigna primero a la mayor
+cantidad posible de estudiantes y, entre esas asignaciones, elige la que
+mejor respeta las preferencias. Para quien ya ocupa una plaza esa arista
+cuesta todavía más, de modo que nunca la pierde: a lo sumo cambia a una
+opción mejor.
+"""
+
+import heapq
+
+INFINITO = float("inf")
+
+def resolver_asignacion(preferencias, plazas, actuales=None):
+    """
+    Asigna estudiantes a optativas según sus preferencias respetando las plazas.
+
+    Parámetros:
+      - preferencias: dict clave_estudiante → lista de optativas en orden de preferencia
+      - plazas: dict optativa → plazas libres (-1 para ilimitadas)
+      - actuales: dict opcional clave_estudiante → optativa que ya ocupa. Su
+        plaza debe estar contada en 'plazas'; el estudiante puede cambiar a una
+        opción mejor pero nunca se queda sin plaza
+
+    Retorna:
+      - dict clave_estudiante → optativa asignada (o None si no obtuvo plaza)
+
+    Se resuelve como un flujo de costo mínimo: cada estudiante es una unidad de
+    flujo y el costo de una optativa es su posición en la lista (0 = primera
+    opción). Primero se maximiza la cantidad de estudiantes asignados y después
+    la satisfacción total (suma de posiciones mínima). Quedar sin plaza le
+    cuesta a quien ya tenía una más que cualquier otra combinación, así que la
+    conserva siempre que sigue existiendo (su plaza está contada).
+
+    Los estudiantes se agregan de uno en uno y para cada uno se busca el camino
+    de aumento más corto (Dijkstra con potenciales). El grafo residual se
+    comprime sobre las optativas: la arista j → k es el estudiante de j que
+    menos empeora al pasar a k, y se obtiene del tope de un montículo. Cada
+    estudiante cuesta O(m²) con m optativas, lo que permite miles de
+    estudiantes y decenas de optativas en pocos segundos.
+    """
+    optativas = list(plazas)
+    indice = {nombre: j for j, nombre in enumerate(optativas)}
+    m = len(optativas)
+    sumidero = m
+
+    # Costos por estudiante: optativa → posición, ignorando optativas desconocidas o repetidas
+    # (la optativa actual, si no está en la lista, pasa a ser la última opción)
+    actuales = actuales or {}
+    costos = {}
+    for clave, lista in preferencias.items():
+        costo = {}
+        for nombre in [*lista, actuales.get(clave)]:
+            j = indice.get(nombre)
+            if j is not None and j not in costo:
+                costo[j] = len(costo)
+        costos[clave] = costo
+
+    max_opciones = max((len(c) for c in costos.values()), default=0)
+    # Quedar sin plaza cuesta más que cualquier mejora posible en las posiciones, y
+    # a quien ya tenía plaza, más que dejar sin plaza a todos los demás
+    penalizacion = len(costos) * max_opciones + 1
+    penalizacion_titular = len(costos) * (penalizacion + max_opciones) + 1
+    sin_plaza = {
+        clave: penalizacion_titular if actuales.get(clave) in indice else penalizacion
+        for clave in costos
+    }
+
+    libres = [INFINITO if plazas[nombre] == -1 else max(plazas[nombre], 0) for nombre in optativas]
+    asignacion = {}
+    potencial = [0] * (m + 1)
+    # movimientos[j][k]: montículo de (costo de pasar de j a k, estudiante) para estudiantes en j
+    movimientos = [{} for _ in range(m)]
+    # expulsiones[j]: montículo de (costo de dejar sin plaza, estudiante) para estudiantes en j
+    expulsiones = [[] for _ in range(m)]
+
+    def tope(monticulo, j):
+        # Limpieza perezosa: descartar estudiantes que ya no están en j
+        while monticulo and asignacion.get(monticulo[0][1]) != j:
+            heapq.heappop(monticulo)
+        return monticulo[0] if monticulo else None
+
+    def ubicar(clave, j):
+        asignacion[clave] = j
+        costo = costos[clave]
+        for k, c in costo.items():
+            if k != j:
+                heapq.heappush(movimientos[j].setdefault(k, []), (c - costo[j], clave))
+        heapq.heappush(expulsiones[j], (sin_plaza[clave] - costo[j], clave))
+
+    for clave, costo in costos.items():
+        distancia = [INFINITO] * (m + 1)
+        previo = [None] * (m + 1)
+        visitado = [False] * (m + 1)
+
+        # Aristas desde el estudiante nuevo (Dijkstra con varios orígenes)
+        for j, c in costo.items():
+            distancia[j] = c - potencial[j]
+        distancia[sumidero] = sin_plaza[clave] - potencial[sumidero]
+
+        while True:
+            u = min((v for v in range(m + 1) if not visitado[v]), key=distancia.__getitem__, default=None)
+            if u is None or distancia[u] == INFINITO:
+                break
+            visitado[u] = True
+            if u == sumidero:
+                break
+
+            # u → sumidero: plaza libre o expulsión del estudiante más barato
+            if libres[u] > 0:
+                arista = (0, None)
+            else:
+                arista = tope(expulsiones[u], u)
+            if arista is not None:
+                d = distancia[u] + arista[0] + potencial[u] - potencial[sumidero]
+                if d < distancia[sumidero]:
+                    distancia[sumidero] = d
+                    previo[sumidero] = (u, arista[1])
+
+            # u → k: mover a un estudiante de u hacia k
+            for k, monticulo in movimientos[u].items():
+                if visitado[k]:
+                    continue
+                arista = tope(monticulo, u)
+                if arista is None:
+                    continue
+                d = distancia[u] + arista[0] + potencial[u] - potencial[k]
+                if d < distancia[k]:
+                    distancia[k] = d
+                    previo[k] = (u, arista[1])
+
+        # Actualizar potenciales para mantener costos reducidos no negativos
+        tope_distancia = distancia[sumidero]
+        for v in range(m + 1):
+            potencial[v] += min(distancia[v], tope_distancia)
+
+        # Aplicar el camino de aumento desde el sumidero hacia el estudiante nuevo
+        if previo[sumidero] is None:
+            asignacion[clave] = None
+            continue
+
+        u, expulsado = previo[sumidero]
+        if expulsado is None:
+            libres[u] -= 1
+        else:
+            asignacion[expulsado] = None
+        while previo[u] is not None:
+            origen, movido = previo[u]
+            ubicar(movido, u)
+            u = origen
+        ubicar(clave, u)
+
+    return {clave: (None if j is None else optativas[j]) for clave, j in asignacion.items()}
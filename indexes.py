@@ -0,0 +1,333 @@
+"""
+Índices en memoria sobre los datos del bot.
+
+Evitan recorrer listas completas en cada operación de los profesores: las
+búsquedas, altas y bajas de estudiantes son O(1) por línea procesada.
+"""
+
+import heapq
+from datetime import datetime
+
+from records import Estudiante, Optativa
+
+
+class Padron:
+    """
+    Padrón de estudiantes indexado por la clave (nombre, grupo).
+
+    Mantiene además dos índices secundarios (por grupo y por optativa) que se
+    actualizan en cada alta, baja o asignación. Los registros son Estudiante
+    (ver records) con los mismos campos que se guardan en estudiantes.json.
+    """
+
+    def __init__(self, estudiantes=None):
+        self._por_clave = {}
+        self._por_grupo = {}
+        self._por_optativa = {}
+        if estudiantes:
+            self.reconstruir(estudiantes)
+
+    def reconstruir(self, estudiantes):
+        """Reemplaza el contenido del padrón por la lista de estudiantes dada."""
+        self._por_clave.clear()
+        self._por_grupo.clear()
+        self._por_optativa.clear()
+        for est in estudiantes:
+            est = Estudiante.desde(est)
+            clave = (est["nombre"], est["grupo"])
+            if clave in self._por_clave:
+                continue  # Duplicado en el archivo: se conserva el primero
+            self._indexar(clave, est)
+
+    def _indexar(self, clave, est):
+        self._por_clave[clave] = est
+        self._por_grupo.setdefault(est["grupo"], {})[clave] = est
+        if est["optativa"]:
+            self._por_optativa.setdefault(est["optativa"], {})[clave] = est
+
+    def _desindexar_optativa(self, clave, optativa):
+        inscritos = self._por_optativa.get(optativa)
+        if inscritos is not None:
+            inscritos.pop(clave, None)
+            if not inscritos:
+                del self._por_optativa[optativa]
+
+    def __len__(self):
+        return len(self._por_clave)
+
+    def __iter__(self):
+        return iter(self._por_clave.values())
+
+    def __contains__(self, clave):
+        return clave in self._por_clave
+
+    def obtener(self, nombre, grupo):
+        return self._por_clave.get((nombre, grupo))
+
+    def agregar(self, nombre, grupo, optativa=""):
+        """Agrega un estudiante. Devuelve el registro creado o None si ya existía."""
+        clave = (nombre, grupo)
+        if clave in self._por_clave:
+            return None
+        est = Estudiante(nombre=nombre, grupo=grupo, optativa=optativa)
+        self._indexar(clave, est)
+        return est
+
+    def eliminar(self, nombre, grupo):
+        """Elimina un estudiante. Devuelve el registro eliminado o None si no existía."""
+        clave = (nombre, grupo)
+        est = self._por_clave.pop(clave, None)
+        if est is None:
+            return None
+        del self._por_grupo[est["grupo"]][clave]
+        if not self._por_grupo[est["grupo"]]:
+            del self._por_grupo[est["grupo"]]
+        if est["optativa"]:
+            self._desindexar_optativa(clave, est["optativa"])
+        return est
+
+    def asignar(self, est, optativa):
+        """Cambia la optativa de un estudiante (cadena vacía para desasignar). Devuelve la anterior."""
+        clave = (est["nombre"], est["grupo"])
+        anterior = est["optativa"]
+        if anterior == optativa:
+            return anterior
+        if anterior:
+            self._desindexar_optativa(clave, anterior)
+        est["optativa"] = optativa
+        if optativa:
+            self._por_optativa.setdefault(optativa, {})[clave] = est
+        return anterior
+
+    def vaciar(self):
+        self.reconstruir([])
+
+    def grupos(self):
+        """Devuelve los nombres de grupo existentes."""
+        return self._por_grupo.keys()
+
+    def de_grupo(self, grupo):
+        return list(self._por_grupo.get(grupo, {}).values())
+
+    def de_optativa(self, optativa):
+        return list(self._por_optativa.get(optativa, {}).values())
+
+    def cantidad_en(self, optativa):
+        return len(self._por_optativa.get(optativa, ()))
+
+    def desasignar_optativa(self, optativa):
+        """Desasigna a todos los inscritos en una optativa en O(inscritos). Devuelve la lista afectada."""
+        inscritos = list(self._por_optativa.pop(optativa, {}).values())
+        for est in inscritos:
+            est["optativa"] = ""
+        return inscritos
+
+    def como_lista(self):
+        return list(self._por_clave.values())
+
+
+class Catalogo:
+    """
+    Catálogo de optativas indexado por nombre.
+
+    Las búsquedas escritas por los usuarios no distinguen mayúsculas, por lo
+    que se mantiene un segundo índice por nombre en minúsculas.
+
+    La versión del catálogo cambia con cada modificación y cada optativa
+    guarda la versión en que se agregó por última vez, para invalidar cachés.
+    """
+
+    def __init__(self, optativas=None):
+        self._por_nombre = {}
+        self._por_minusculas = {}
+        self._versiones = {}
+        self.version = 0
+        if optativas:
+            self.reconstruir(optativas)
+
+    def reconstruir(self, optativas):
+        self.version += 1
+        optativas = [Optativa.desde(opt) for opt in optativas]
+        self._por_nombre = {opt["nombre"]: opt for opt in optativas}
+        self._por_minusculas = {opt["nombre"].lower(): opt for opt in optativas}
+        self._versiones = dict.fromkeys(self._por_nombre, self.version)
+
+    def __len__(self):
+        return len(self._por_nombre)
+
+    def __iter__(self):
+        return iter(self._por_nombre.values())
+
+    def __contains__(self, nombre):
+        return nombre in self._por_nombre
+
+    def obtener(self, nombre):
+        return self._por_nombre.get(nombre)
+
+    def buscar(self, nombre):
+        """Busca una optativa por nombre sin distinguir mayúsculas."""
+        return self._por_minusculas.get(nombre.strip().lower())
+
+    def version_de(self, nombre):
+        return self._versiones.get(nombre)
+
+    def agregar(self, optativa):
+        """Agrega o reemplaza una optativa. Devuelve el registro guardado en el catálogo."""
+        optativa = Optativa.desde(optativa)
+        self.version += 1
+        self._por_nombre[optativa["nombre"]] = optativa
+        self._por_minusculas[optativa["nombre"].lower()] = optativa
+        self._versiones[optativa["nombre"]] = self.version
+        return optativa
+
+    def eliminar(self, nombre):
+        optativa = self._por_nombre.pop(nombre, None)
+        if optativa is not None:
+            self.version += 1
+            self._por_minusculas.pop(nombre.lower(), None)
+            self._versiones.pop(nombre, None)
+        return optativa
+
+    def vaciar(self):
+        self.reconstruir([])
+
+    def como_lista(self):
+        return list(self._por_nombre.values())
+
+
+class ContadorPlazas:
+    """
+    Libro de plazas por optativa: capacidad y ocupación por separado.
+
+    La capacidad es el campo 'plazas' de la optativa (-1 si es ilimitada) y no
+    se modifica al asignar; la ocupación se actualiza en O(1) en cada
+    asignación o desasignación. La versión cambia con cada modificación.
+    """
+
+    def __init__(self):
+        self._capacidad = {}
+        self._ocupadas = {}
+        self.version = 0
+
+    def reconstruir(self, optativas, padron):
+        """Recalcula capacidades y ocupación a partir del catálogo y el padrón."""
+        self.version += 1
+        self._capacidad = {opt["nombre"]: opt["plazas"] for opt in optativas}
+        self._ocupadas = dict.fromkeys(self._capacidad, 0)
+        for est in padron:
+            if est["optativa"] in self._ocupadas:
+                self._ocupadas[est["optativa"]] += 1
+
+    def fijar_capacidad(self, nombre, plazas, ocupadas=None):
+        """'ocupadas' permite fijar también la ocupación (p. ej. si ya hay inscritos a una optativa nueva)."""
+        self.version += 1
+        self._capacidad[nombre] = plazas
+        if ocupadas is None:
+            self._ocupadas.setdefault(nombre, 0)
+        else:
+            self._ocupadas[nombre] = ocupadas
+
+    def quitar(self, nombre):
+        self.version += 1
+        self._capacidad.pop(nombre, None)
+        self._ocupadas.pop(nombre, None)
+
+    def capacidad(self, nombre):
+        return self._capacidad.get(nombre)
+
+    def ocupadas(self, nombre):
+        return self._ocupadas.get(nombre, 0)
+
+    def disponibles(self, nombre):
+        """Plazas libres, -1 si la optativa es ilimitada o None si no existe."""
+        capacidad = self._capacidad.get(nombre)
+        if capacidad is None or capacidad == -1:
+            return capacidad
+        return max(capacidad - self._ocupadas[nombre], 0)
+
+    def hay_plaza(self, nombre):
+        capacidad = self._capacidad.get(nombre)
+        if capacidad is None:
+            return False
+        return capacidad == -1 or self._ocupadas[nombre] < capacidad
+
+    def ocupar(self, nombre):
+        if nombre in self._ocupadas:
+            self._ocupadas[nombre] += 1
+            self.version += 1
+
+    def liberar(self, nombre):
+        if self._ocupadas.get(nombre, 0) > 0:
+            self._ocupadas[nombre] -= 1
+            self.version += 1
+
+
+class ListaEspera:
+    """
+    Listas de espera por optativa, ordenadas por prioridad y fecha de solicitud.
+
+    La solicitud se guarda en el propio registro del estudiante (campo
+    'espera'), de modo que se persiste junto al padrón. Cada optativa tiene un
+    montículo; las solicitudes retiradas se descartan de forma perezosa al
+    llegar al tope, así que agregar y promover cuestan O(log n).
+    """
+
+    def __init__(self):
+        self._colas = {}
+        self._cantidad = {}
+        self._turno = 0
+
+    def reconstruir(self, padron):
+        self._colas.clear()
+        self._cantidad.clear()
+        for est in padron:
+            if est.get("espera"):
+                self._encolar(est, est["espera"])
+
+    def _encolar(self, est, solicitud):
+        self._turno += 1
+        entrada = (solicitud.get("prioridad", 0), solicitud["solicitud"], self._turno, solicitud, est)
+        heapq.heappush(self._colas.setdefault(solicitud["optativa"], []), entrada)
+        self._cantidad[solicitud["optativa"]] = self._cantidad.get(solicitud["optativa"], 0) + 1
+
+    def agregar(self, est, optativa, prioridad=0):
+        """Pone al estudiante en espera para la optativa (reemplaza una solicitud anterior)."""
+        self.quitar(est)
+        solicitud = {"optativa": optativa, "prioridad": prioridad, "solicitud": datetime.now().isoformat()}
+        est["espera"] = solicitud
+        self._encolar(est, solicitud)
+        return self._cantidad[optativa]
+
+    def quitar(self, est):
+        """Retira la solicitud del estudiante, si tiene alguna."""
+        solicitud = est.pop("espera", None)
+        if solicitud:
+            self._cantidad[solicitud["optativa"]] -= 1
+        return solicitud
+
+    def siguiente(self, optativa):
+        """Saca al primer estudiante en espera de la optativa, o None si no hay nadie."""
+        cola = self._colas.get(optativa)
+        while cola:
+            *_, solicitud, est = heapq.heappop(cola)
+            if est.get("espera") is solicitud:
+                self.quitar(est)
+                return est
+        return None
+
+    def descartar_optativa(self, optativa):
+        """Elimina la lista de espera de una optativa. Devuelve los estudiantes que estaban en ella."""
+        afectados = []
+        for *_, solicitud, est in self._colas.pop(optativa, []):
+            if est.get("espera") is solicitud:
+                est.pop("espera")
+                afectados.append(est)
+        self._cantidad.pop(optativa, None)
+        return afectados
+
+    def en_espera(self, optativa):
+        return self._cantidad.get(optativa, 0)
+
+    def optativas(self):
+        """Optativas con al menos un estudiante en espera."""
+        return [nombre for nombre, cantidad in self._cantidad.items() if cantidad > 0]
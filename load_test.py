@@ -0,0 +1,381 @@
+"""
+Prueba de carga del bot sin conexión a Telegram.
+
+Construye la aplicación real de main.py (los mismos handlers, el mismo
+procesador concurrente y la misma cola de envíos) sobre una API de Telegram
+local y le envía updates sintéticos: búsquedas de estudiantes, reseñas con
+/rev, altas masivas y asignaciones de profesores. Las sesiones llegan a una
+tasa configurable durante un tiempo dado y al final se informa el
+rendimiento, la latencia por paso (p50/p95/p99) y la tasa de errores.
+
+Trabaja sobre una copia temporal de la carpeta data, así que no modifica los
+datos reales.
+
+Uso:
+    python load_test.py --duracion 30 --tasa 20 --usuarios 500
+    python load_test.py --mezcla busqueda=50,resena=30,alta=10,asignacion=10 --sin-limites
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+from monitor import percentil
+
+ID_BOT = 424242
+PALABRAS_BUSQUEDA = [
+    "programación", "web", "matemática", "datos", "python", "redes", "científica",
+    "comunicación", "grafos", "estadística", "práctico", "exigente", "inteligencia",
+    "algoritmos", "seguridad", "optimización", "bases", "sistemas",
+]
+COMENTARIOS = [
+    "Muy práctica y bien organizada",
+    "Exigente pero se aprende mucho",
+    "El profesor explica muy bien",
+    "Demasiada carga de trabajo",
+    "Interesante, con proyectos reales",
+]
+
+
+class ApiLocal(BaseRequest):
+    """
+    Sustituto local de la API de Bot de Telegram. Responde a los métodos que
+    usa el bot con objetos mínimos válidos, con una latencia opcional para
+    simular la red, y cuenta las llamadas por método.
+    """
+
+    def __init__(self, latencia=0.0):
+        self.latencia = latencia
+        self.llamadas = {}
+        self._mensaje_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _mensaje(self, parametros):
+        self._mensaje_id += 1
+        return {
+            "message_id": self._mensaje_id,
+            "date": int(time.time()),
+            "chat": {"id": int(parametros.get("chat_id", 0)), "type": "private"},
+            "from": {"id": ID_BOT, "is_bot": True, "first_name": "Bot"},
+            "text": parametros.get("text", ""),
+        }
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        metodo = url.rsplit("/", 1)[-1]
+        self.llamadas[metodo] = self.llamadas.get(metodo, 0) + 1
+        if self.latencia:
+            await asyncio.sleep(self.latencia)
+
+        parametros = request_data.parameters if request_data else {}
+        if metodo == "getMe":
+            resultado = {"id": ID_BOT, "is_bot": True, "first_name": "Bot", "username": "bot_prueba"}
+        elif metodo in ("sendMessage", "editMessageText", "sendDocument"):
+            resultado = self._mensaje(parametros)
+        else:
+            resultado = True
+        return 200, json.dumps({"ok": True, "result": resultado}).encode("utf-8")
+
+
+class GeneradorUpdates:
+    """Arma los JSON de updates de Telegram para un usuario sintético."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_id = 0
+        self._mensaje_id = 0
+
+    def texto(self, usuario, texto):
+        self._update_id += 1
+        self._mensaje_id += 1
+        mensaje = {
+            "message_id": self._mensaje_id,
+            "date": int(time.time()),
+            "chat": {"id": usuario, "type": "private"},
+            "from": {"id": usuario, "is_bot": False, "first_name": f"U{usuario}", "username": f"usuario{usuario}"},
+            "text": texto,
+        }
+        if texto.startswith("/"):
+            mensaje["entities"] = [{"type": "bot_command", "offset": 0, "length": len(texto.split()[0])}]
+        return Update.de_json({"update_id": self._update_id, "message": mensaje}, self.bot)
+
+    def callback(self, usuario, datos):
+        self._update_id += 1
+        self._mensaje_id += 1
+        consulta = {
+            "id": str(self._update_id),
+            "from": {"id": usuario, "is_bot": False, "first_name": f"U{usuario}", "username": f"usuario{usuario}"},
+            "chat_instance": str(usuario),
+            "data": datos,
+            "message": {
+                "message_id": self._mensaje_id,
+                "date": int(time.time()),
+                "chat": {"id": usuario, "type": "private"},
+                "from": {"id": ID_BOT, "is_bot": True, "first_name": "Bot"},
+                "text": "...",
+            },
+        }
+        return Update.de_json({"update_id": self._update_id, "callback_query": consulta}, self.bot)
+
+
+class PruebaCarga:
+    def __init__(self, main, app, api, args):
+        self.main = main
+        self.app = app
+        self.api = api
+        self.args = args
+        self.generador = GeneradorUpdates(app.bot)
+        self.aleatorio = random.Random(args.semilla)
+        self.latencias = {}      # paso → lista de segundos
+        self.errores = {}        # paso → cantidad
+        self.sesiones = {}       # escenario → sesiones completadas
+        self.descartadas = 0
+        self._ocupados = set()
+        self._logueados = set()
+        self._paso_actual = {}   # usuario → paso en curso (para atribuir errores)
+        self._altas = 0
+
+    # ---------- Datos sintéticos ----------
+
+    def sembrar(self):
+        """Agrega estudiantes con optativa (para /rev) y preferencias (para la asignación automática)."""
+        main = self.main
+        nombres = [opt["nombre"] for opt in main.catalogo]
+        self.estudiantes = []
+        for i in range(self.args.estudiantes):
+            est = main.padron.agregar(f"Carga{i} Prueba Sintetica", f"G{i % 20}")
+            if est is None:
+                continue
+            optativa = nombres[i % len(nombres)]
+            if main.libro_plazas.hay_plaza(optativa):
+                main.asignar_estudiante(est, optativa)
+            if i % 4 == 0:
+                main.preferencias[(est["nombre"], est["grupo"])] = self.aleatorio.sample(nombres, len(nombres))
+            self.estudiantes.append(est)
+        self.optativas = nombres
+
+    # ---------- Escenarios ----------
+
+    def escenario_busqueda(self, usuario):
+        palabras = self.aleatorio.sample(PALABRAS_BUSQUEDA, self.aleatorio.randint(1, 3))
+        return [("busqueda", " ".join(palabras))]
+
+    def escenario_resena(self, usuario):
+        con_optativa = [e for e in self.aleatorio.sample(self.estudiantes, min(20, len(self.estudiantes))) if e["optativa"]]
+        if not con_optativa:
+            return self.escenario_busqueda(usuario)
+        est = con_optativa[0]
+        return [
+            ("rev", "/rev"),
+            ("rev_identificacion", f"{est['nombre']} {est['grupo']}"),
+            ("rev_comentario", self.aleatorio.choice(COMENTARIOS)),
+            ("rev_puntuacion", str(self.aleatorio.randint(1, 5))),
+        ]
+
+    def _login(self, usuario):
+        if usuario in self._logueados:
+            return []
+        self._logueados.add(usuario)
+        return [("login", "/login"), ("login_usuario", "superadmin"), ("login_clave", self.main.SUPERADMIN_PASSWORD)]
+
+    def escenario_alta(self, usuario):
+        lineas = []
+        for _ in range(self.args.lote):
+            self._altas += 1
+            lineas.append(f"Alta{self._altas} Prueba Sintetica G{self._altas % 20}")
+        return self._login(usuario) + [("alta_menu", "➕ Agregar estudiantes"), ("alta_lote", "\n".join(lineas))]
+
+    def escenario_asignacion(self, usuario):
+        elegidos = self.aleatorio.sample(self.estudiantes, min(self.args.lote, len(self.estudiantes)))
+        texto = "\n".join(f"{e['nombre']} {e['grupo']}" for e in elegidos) + f"\n-{self.aleatorio.choice(self.optativas)}"
+        return self._login(usuario) + [("asignacion_menu", "📌 Asignar optativa"), ("asignacion_lote", texto)]
+
+    def escenario_automatica(self, usuario):
+        return self._login(usuario) + [("asignacion_automatica", "🧮 Asignación automática")]
+
+    ESCENARIOS_PROFESOR = ("alta", "asignacion", "automatica")
+
+    # ---------- Ejecución ----------
+
+    async def contar_error(self, update, context):
+        usuario = update.effective_user.id if isinstance(update, Update) and update.effective_user else None
+        paso = self._paso_actual.get(usuario, "desconocido")
+        self.errores[paso] = self.errores.get(paso, 0) + 1
+
+    async def enviar(self, usuario, paso, texto):
+        update = self.generador.texto(usuario, texto)
+        self._paso_actual[usuario] = paso
+        inicio = time.perf_counter()
+        try:
+            await self.app.update_processor.process_update(update, self.app.process_update(update))
+        except Exception:
+            self.errores[paso] = self.errores.get(paso, 0) + 1
+        self.latencias.setdefault(paso, []).append(time.perf_counter() - inicio)
+
+    def elegir_usuario(self, escenario):
+        if escenario in self.ESCENARIOS_PROFESOR:
+            candidatos = range(1, self.args.profesores + 1)
+        else:
+            candidatos = range(1000, 1000 + self.args.usuarios)
+        libres = [u for u in self.aleatorio.sample(candidatos, min(len(candidatos), 10)) if u not in self._ocupados]
+        return libres[0] if libres else None
+
+    async def sesion(self, escenario, usuario):
+        self._ocupados.add(usuario)
+        try:
+            for paso, texto in getattr(self, f"escenario_{escenario}")(usuario):
+                await self.enviar(usuario, paso, texto)
+                if self.args.pausa:
+                    await asyncio.sleep(self.aleatorio.expovariate(1 / self.args.pausa))
+            self.sesiones[escenario] = self.sesiones.get(escenario, 0) + 1
+        finally:
+            self._ocupados.discard(usuario)
+
+    async def ejecutar(self):
+        escenarios = list(self.args.mezcla)
+        pesos = [self.args.mezcla[e] for e in escenarios]
+        tareas = set()
+        inicio = time.perf_counter()
+        fin = inicio + self.args.duracion
+        while time.perf_counter() < fin:
+            await asyncio.sleep(self.aleatorio.expovariate(self.args.tasa))
+            escenario = self.aleatorio.choices(escenarios, pesos)[0]
+            usuario = self.elegir_usuario(escenario)
+            if usuario is None:
+                self.descartadas += 1  # Todos los usuarios de ese tipo están ocupados: el bot no da abasto
+                continue
+            tarea = asyncio.create_task(self.sesion(escenario, usuario))
+            tareas.add(tarea)
+            tarea.add_done_callback(tareas.discard)
+        if tareas:
+            await asyncio.gather(*tareas)
+        return time.perf_counter() - inicio
+
+    def informe(self, duracion):
+        total = sum(len(v) for v in self.latencias.values())
+        errores = sum(self.errores.values())
+        lineas = [
+            f"Duración: {duracion:.1f} s · updates: {total} · rendimiento: {total / duracion:.1f} updates/s",
+            f"Sesiones completadas: {sum(self.sesiones.values())} {dict(sorted(self.sesiones.items()))} · descartadas por saturación: {self.descartadas}",
+            f"Errores: {errores} ({errores / total * 100 if total else 0:.2f} %)",
+            f"Llamadas a la API: {dict(sorted(self.api.llamadas.items()))}",
+            "",
+            f"{'paso':<24}{'n':>7}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'máx ms':>10}",
+        ]
+        resumen = {}
+        for paso in sorted(self.latencias):
+            ordenadas = sorted(self.latencias[paso])
+            fila = {
+                "n": len(ordenadas),
+                "errores": self.errores.get(paso, 0),
+                "p50": percentil(ordenadas, 50),
+                "p95": percentil(ordenadas, 95),
+                "p99": percentil(ordenadas, 99),
+                "max": ordenadas[-1],
+            }
+            resumen[paso] = fila
+            lineas.append(
+                f"{paso:<24}{fila['n']:>7}{fila['errores']:>6}{fila['p50'] * 1000:>10.1f}"
+                f"{fila['p95'] * 1000:>10.1f}{fila['p99'] * 1000:>10.1f}{fila['max'] * 1000:>10.1f}"
+            )
+        p = self.main.monitor_bucle.percentiles()
+        lineas.append("")
+        lineas.append(f"Retraso del bucle: p50 {p['p50'] * 1000:.1f} ms · p99 {p['p99'] * 1000:.1f} ms · máx {p['max'] * 1000:.1f} ms")
+        return "\n".join(lineas), {
+            "duracion": duracion, "updates": total, "rendimiento": total / duracion,
+            "errores": errores, "descartadas": self.descartadas, "pasos": resumen,
+            "api": self.api.llamadas, "retraso_bucle": p,
+        }
+
+
+def leer_mezcla(texto):
+    mezcla = {}
+    for parte in texto.split(","):
+        nombre, _, peso = parte.partition("=")
+        nombre = nombre.strip()
+        if not hasattr(PruebaCarga, f"escenario_{nombre}"):
+            raise argparse.ArgumentTypeError(f"Escenario desconocido: {nombre}")
+        mezcla[nombre] = float(peso or 1)
+    return mezcla
+
+
+async def correr(args):
+    import main  # Se importa después de cambiar a la carpeta temporal: usa rutas relativas
+
+    if args.sin_limites:
+        main.LIMITE_MENSAJES_GLOBAL = main.LIMITE_MENSAJES_CHAT = 1_000_000
+    main.cargar_estado()
+
+    api = ApiLocal(args.latencia_api / 1000)
+    app = main.construir_aplicacion("1:prueba-de-carga", solicitud=api)
+    prueba = PruebaCarga(main, app, api, args)
+    app.add_error_handler(prueba.contar_error)
+    prueba.sembrar()
+
+    await app.initialize()
+    await main.post_init(app)
+    try:
+        duracion = await prueba.ejecutar()
+        texto, datos = prueba.informe(duracion)
+    finally:
+        # Mismo orden que run_polling: la aplicación guarda las sesiones antes de que se cierre el almacén
+        await app.shutdown()
+        await main.post_shutdown(app)
+
+    print(texto)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(datos, f, indent=4, ensure_ascii=False)
+
+
+def ejecutar_en_copia(datos, corrutina):
+    """Corre 'corrutina()' dentro de una copia temporal de la carpeta de datos."""
+    origen = os.path.abspath(datos)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    temporal = tempfile.mkdtemp(prefix="carga_optativas_")
+    directorio = os.getcwd()
+    try:
+        shutil.copytree(origen, os.path.join(temporal, "data"))
+        os.chdir(temporal)
+        asyncio.run(corrutina())
+    finally:
+        os.chdir(directorio)
+        shutil.rmtree(temporal, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga del bot de optativas con updates sintéticos")
+    parser.add_argument("--duracion", type=float, default=20, help="Segundos durante los que llegan sesiones nuevas")
+    parser.add_argument("--tasa", type=float, default=10, help="Sesiones nuevas por segundo (llegadas de Poisson)")
+    parser.add_argument("--usuarios", type=int, default=500, help="Estudiantes distintos que escriben al bot")
+    parser.add_argument("--profesores", type=int, default=3, help="Profesores distintos que escriben al bot")
+    parser.add_argument("--estudiantes", type=int, default=2000, help="Estudiantes sintéticos agregados al padrón")
+    parser.add_argument("--lote", type=int, default=20, help="Estudiantes por alta o asignación masiva")
+    parser.add_argument("--mezcla", type=leer_mezcla, default="busqueda=60,resena=25,alta=8,asignacion=6,automatica=1",
+                        help="Pesos de cada escenario: busqueda, resena, alta, asignacion, automatica")
+    parser.add_argument("--pausa", type=float, default=0.0, help="Pausa media (s) entre mensajes de una misma sesión")
+    parser.add_argument("--latencia-api", type=float, default=30, help="Latencia simulada de la API de Telegram (ms)")
+    parser.add_argument("--sin-limites", action="store_true", help="Desactiva los límites de la cola de envíos")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--datos", default="data", help="Carpeta de datos que se copia para la prueba")
+    parser.add_argument("--json", help="Además, guardar el informe en este archivo JSON")
+    args = parser.parse_args()
+
+    # La prueba corre sobre una copia de los datos
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    ejecutar_en_copia(args.datos, lambda: correr(args))
@@ -1,9 +1,20 @@
 # region Imports
 
+import time
+INICIO_ARRANQUE = time.perf_counter()  # Para el desglose del arranque (ver marcar_arranque)
 import json
+import asyncio
+import io
 import argparse
+import hashlib
 import os
-import subprocess
+# python-telegram-bot es el import más caro del arranque (0.25-0.30 s medidos con la 20.8
+# y httpx 0.26; unos 0.11 s son de trio, que httpcore importa si está instalado aunque el
+# bot no lo use). No se difiere a construir_aplicacion: el polling y los handlers lo
+# necesitan antes de atender el primer update, y importarlo en otro hilo mientras se
+# cargan los datos no acorta el arranque porque el GIL serializa ambos trabajos (0.39 s
+# en serie y en paralelo con 50 000 estudiantes). Su costo aparece aparte en el desglose.
+INICIO_TELEGRAM = time.perf_counter()
 from telegram import (
     Update, ReplyKeyboardMarkup, ReplyKeyboardRemove,
     KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
@@ -13,7 +24,23 @@ from telegram.ext import (
     CallbackQueryHandler, ContextTypes, ConversationHandler, filters,
 )
 from telegram import BotCommand, Document
+from telegram.error import BadRequest
+DURACION_TELEGRAM = time.perf_counter() - INICIO_TELEGRAM
 from datetime import datetime
+from assignment_solver import resolver_asignacion
+from records import Estudiante, Optativa, Resena
+from reviews import clave_resena
+from storage import AlmacenAsincrono, compactar_en_fondo, iterar_lista_json
+from search_engine import precargar as precargar_busqueda
+from send_queue import ColaEnvios
+from update_processor import ProcesadorPorChat
+from monitor import MonitorBucle, envolver_handlers
+from metrics import MetricasHandlers
+from profiler import SesionPerfilado
+from traffic_recorder import GrabadorUpdates
+from sessions import PersistenciaSesiones
+from shards import NOMBRE_PRINCIPAL, Fragmento, FragmentoNoDisponible, GestorFragmentos, VistaFragmento
+from spreadsheets import delimitador_de, escribir_planilla, leer_planilla
 
 # end region
 # region Constantes
@@ -24,15 +51,46 @@ ESTUDIANTES_FILE = "data/estudiantes.json"
 OPTATIVAS_FILE = "data/optativas.json"
 PROFESORES_FILE = "data/profesores.json"
 RESEÑAS_FILE = "data/reseñas.json"
+RESEÑAS_DIARIO_FILE = "data/reseñas.diario"
+PREFERENCIAS_FILE = "data/preferencias.json"
+SESIONES_FILE = "data/sesiones.json"
+SESIONES_DIARIO_FILE = "data/sesiones.diario"
+# Un subdirectorio por facultad o semestre, con los mismos archivos que data (ver shards)
+FRAGMENTOS_DIR = "data/fragmentos"
 LOG_PATH = "logs/registro_operaciones.txt"
+METRICAS_PATH = "logs/metricas.prom"
 SUPERADMIN_PASSWORD = "admin1234"
+# Peso de los comentarios de reseñas y de la puntuación previa en el ranking de búsqueda (0 los desactiva)
+PESO_RESENAS_BUSQUEDA = 0.5
+PESO_PUNTUACION_BUSQUEDA = 0.0
+# Handlers ejecutándose a la vez (los updates de un mismo chat siempre van en orden)
+TRABAJADORES_CONCURRENTES = 8
+# Límites de la cola de envíos (mensajes por segundo), según los límites de Telegram
+LIMITE_MENSAJES_GLOBAL = 30
+LIMITE_MENSAJES_CHAT = 1
+# Segundos que se espera al cerrar para entregar los mensajes pendientes
+PLAZO_VACIAR_COLA = 10
+# Un paso de handler (código entre dos await) que retiene el bucle más que esto se registra como lento
+UMBRAL_PASO_LENTO = 0.1
+# Cada cuántos segundos se reescribe el archivo de métricas
+INTERVALO_METRICAS = 15
+# Cada cuántos segundos se guardan las sesiones y conversaciones que cambiaron
+INTERVALO_SESIONES = 5
+# Segundos sin uso tras los que un fragmento (facultad o semestre) se descarga de memoria
+INACTIVIDAD_FRAGMENTOS = 15 * 60
+# Tamaño máximo de los archivos JSON que suben los profesores (bytes)
+MAX_TAMANO_ARCHIVO = 5 * 1024 * 1024
+# Duración por defecto y máxima de una sesión de /perfil (segundos)
+PERFIL_SEGUNDOS = 30
+PERFIL_SEGUNDOS_MAX = 300
 
 # ---------- TECLADO ESPECIAL PARA PROFESORES ----------
 menu_profesor = ReplyKeyboardMarkup([
     [KeyboardButton("👥 Ver estudiantes"), KeyboardButton("➕ Agregar estudiantes"), KeyboardButton("❌ Eliminar estudiante")],
     [KeyboardButton("📚 Ver optativas"), KeyboardButton("➕ Crear optativa"), KeyboardButton("🗑️ Eliminar optativas")],
     [KeyboardButton("👨‍🏫 Ver profesores"), KeyboardButton("➕ Agregar profesores"), KeyboardButton("❌ Eliminar profesores")],
-    [KeyboardButton("📌 Asignar optativa"), KeyboardButton("🔓 Cerrar sesión")]
+    [KeyboardButton("📌 Asignar optativa"), KeyboardButton("🧮 Asignación automática"), KeyboardButton("🎓 Ver inscritos")],
+    [KeyboardButton("🔓 Cerrar sesión")]
 ], resize_keyboard=True)
 
 # ---------- BOTONES DE CANCELAR INLINE ----------
@@ -48,11 +106,16 @@ cancelar_reseña_inline = InlineKeyboardMarkup([
     [InlineKeyboardButton("❎ Cancelar reseña", callback_data="cancelar_resena")]
 ])
 
+# Todo el acceso a disco de los handlers pasa por el hilo del almacén
+almacen = AlmacenAsincrono()
+
 # Función para registrar una operación realizada por algún profesor en el log
-def registrar_operacion(usuario, accion):
+async def registrar_operacion(usuario, accion):
     now = datetime.now().strftime("%Y-%m-%d %H:%M")
     linea = f"[{now}] Profesor '{usuario}' {accion}\n"
+    await almacen.ejecutar(escribir_log, linea)
 
+def escribir_log(linea):
     os.makedirs("logs", exist_ok=True)
     if os.path.exists(LOG_PATH):
         with open(LOG_PATH, "r", encoding="utf-8") as f:
@@ -68,174 +131,546 @@ def registrar_operacion(usuario, accion):
 # end region
 # region Carga de datos
 
-def cargar_estudiantes():
-    if not os.path.exists(ESTUDIANTES_FILE):
+# Lecturas síncronas: solo se usan en cargar_fragmento(), antes de iniciar el bucle de
+# eventos o en el hilo del almacén. En los handlers se lee y escribe a través del almacén.
+def cargar_estudiantes(ruta=ESTUDIANTES_FILE):
+    if not os.path.exists(ruta):
         return []
-    with open(ESTUDIANTES_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(ruta, "r", encoding="utf-8") as f:
+        return [Estudiante(est) for est in json.load(f)]
 
-def cargar_optativas():
-    if not os.path.exists(OPTATIVAS_FILE):
+def cargar_optativas(ruta=OPTATIVAS_FILE):
+    if not os.path.exists(ruta):
         return []
-    with open(OPTATIVAS_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(ruta, "r", encoding="utf-8") as f:
+        return [Optativa(opt) for opt in json.load(f)]
 
-def cargar_profesores():
-    try:
-        with open(PROFESORES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+async def cargar_profesores():
+    return await almacen.leer_json(PROFESORES_FILE, [])
 
-def cargar_resenas():
-    if not os.path.exists(RESEÑAS_FILE) or os.stat(RESEÑAS_FILE).st_size == 0:
+# Las reseñas se guardan como instantánea (reseñas.json) más un diario de solo anexado
+def cargar_resenas(diario):
+    return [Resena(r) for r in diario.cargar()]
+
+def cargar_preferencias(ruta=PREFERENCIAS_FILE):
+    if not os.path.exists(ruta):
         return []
-    with open(RESEÑAS_FILE, "r", encoding="utf-8") as f:
+    with open(ruta, "r", encoding="utf-8") as f:
         return json.load(f)
 
+# Cada facultad o semestre tiene su propio padrón, catálogo, reseñas e índice de
+# búsqueda (ver shards). El principal es la carpeta data; los demás se cargan al usarse.
+def nuevo_fragmento(nombre, carpeta):
+    return Fragmento(nombre, carpeta, RESEÑAS_FILE, RESEÑAS_DIARIO_FILE, (PESO_RESENAS_BUSQUEDA, PESO_PUNTUACION_BUSQUEDA))
+
+fragmentos = GestorFragmentos(
+    nuevo_fragmento(NOMBRE_PRINCIPAL, os.path.dirname(ESTUDIANTES_FILE)), FRAGMENTOS_DIR,
+    nuevo_fragmento, lambda fragmento: cargar_fragmento(fragmento), almacen,
+    al_cargar=lambda fragmento: lanzar_en_fondo(preparar_busqueda(fragmento)),
+    inactividad=INACTIVIDAD_FRAGMENTOS,
+)
+# Padrón, catálogo, plazas, reseñas y cachés del fragmento del update en curso
+padron = VistaFragmento(fragmentos, "padron")
+catalogo = VistaFragmento(fragmentos, "catalogo")
+libro_plazas = VistaFragmento(fragmentos, "libro_plazas")
+lista_espera = VistaFragmento(fragmentos, "lista_espera")
+indice_resenas = VistaFragmento(fragmentos, "indice_resenas")
+diario_resenas = VistaFragmento(fragmentos, "diario_resenas")
+archivo_semestres = VistaFragmento(fragmentos, "archivo")
+indice_busqueda = VistaFragmento(fragmentos, "indice_busqueda")
+# Preferencias de los estudiantes: (nombre, grupo) → optativas en orden
+preferencias = VistaFragmento(fragmentos, "preferencias")
+# Mensajes del catálogo y tarjetas de búsqueda ya renderizados (ver obtener_cacheado)
+mensajes_catalogo = VistaFragmento(fragmentos, "mensajes_catalogo")
+tarjetas_optativas = VistaFragmento(fragmentos, "tarjetas_optativas")
+# Cola de mensajes salientes, se crea al iniciar la aplicación (ver post_init)
+cola_envios = None
+# Los handlers comparten un solo bucle de eventos: solo hace falta cerrojo en las
+# operaciones que ceden el control a mitad de una modificación (ver update_processor).
+# Cada fragmento tiene el suyo.
+cerrojo_asignacion = VistaFragmento(fragmentos, "cerrojo_asignacion")
+# Retraso del bucle de eventos y handlers lentos, consultables con /lag
+monitor_bucle = MonitorBucle(umbral=UMBRAL_PASO_LENTO)
+# Llamadas, errores y latencia por handler, consultables con /stats y exportadas a METRICAS_PATH
+metricas = MetricasHandlers(METRICAS_PATH, INTERVALO_METRICAS, almacen)
+metricas.registrar_indicador("bot_cola_envios_pendientes", "Mensajes pendientes en la cola de envíos.",
+                             lambda: cola_envios.profundidad() if cola_envios else 0)
+metricas.registrar_indicador("bot_retraso_bucle_p99_segundos", "Percentil 99 del retraso del bucle de eventos.",
+                             lambda: monitor_bucle.percentiles()["p99"])
+metricas.registrar_indicador("bot_estudiantes", "Estudiantes en el padrón.", lambda: len(padron))
+metricas.registrar_indicador("bot_fragmentos_cargados", "Fragmentos de datos en memoria.", lambda: len(fragmentos.cargados()))
+# Sesión de /perfil en curso (solo una a la vez) y su tarea de fondo
+perfil_activo = None
+tareas_fondo = set()
+# Grabación anonimizada del tráfico (solo con --grabar, ver replay.py)
+grabador = None
+# El índice de búsqueda se ajusta en segundo plano al arrancar (ver preparar_busqueda)
+busqueda_lista = VistaFragmento(fragmentos, "busqueda_lista")
+# Desglose del arranque: fases hasta atender el primer update y tareas que terminan después
+tiempos_arranque = []
+tiempos_segundo_plano = []
+
+def marcar_arranque(fase):
+    anterior = INICIO_ARRANQUE + sum(segundos for _, segundos in tiempos_arranque)
+    tiempos_arranque.append((fase, time.perf_counter() - anterior))
+
+def resumen_arranque():
+    total = sum(segundos for _, segundos in tiempos_arranque)
+    fases = " · ".join(f"{fase} {segundos:.2f} s" for fase, segundos in tiempos_arranque)
+    texto = f"Listo en {total:.2f} s ({fases})"
+    if tiempos_segundo_plano:
+        texto += "; en segundo plano: " + " · ".join(f"{fase} {segundos:.2f} s" for fase, segundos in tiempos_segundo_plano)
+    return texto
+
+def lanzar_en_fondo(corrutina):
+    # Se guarda una referencia para que la tarea no se pierda antes de terminar
+    tarea = asyncio.create_task(corrutina)
+    tareas_fondo.add(tarea)
+    tarea.add_done_callback(tareas_fondo.discard)
+    return tarea
+
+def cargar_fragmento(fragmento):
+    fragmento.padron.reconstruir(cargar_estudiantes(fragmento.ruta(ESTUDIANTES_FILE)))
+    fragmento.catalogo.reconstruir(cargar_optativas(fragmento.ruta(OPTATIVAS_FILE)))
+    fragmento.libro_plazas.reconstruir(fragmento.catalogo, fragmento.padron)
+    fragmento.lista_espera.reconstruir(fragmento.padron)
+    fragmento.indice_resenas.reconstruir(cargar_resenas(fragmento.diario_resenas))
+    fragmento.archivo.cargar()
+    fragmento.preferencias.clear()
+    for p in cargar_preferencias(fragmento.ruta(PREFERENCIAS_FILE)):
+        fragmento.preferencias[(p["nombre"], p["grupo"])] = p["preferencias"]
+
+def cargar_estado():
+    cargar_fragmento(fragmentos.principal)
+
+# El índice de búsqueda se reajusta completo solo cuando cambia el catálogo. El ajuste
+# corre en otro hilo y se instala de una vez (ver IndiceBusqueda.reajustar); mientras
+# tanto las búsquedas usan el índice anterior. Si preparar_busqueda todavía no terminó,
+# el pedido se junta con el suyo.
+def reindexar_busqueda():
+    lanzar_en_fondo(reajustar_busqueda(fragmentos.actual()))
+
+async def reajustar_busqueda(fragmento, completo=True):
+    datos = lambda: (fragmento.catalogo.como_lista(), fragmento.indice_resenas.como_lista())
+    try:
+        await fragmento.indice_busqueda.reajustar(datos if completo else None)
+    except Exception as e:
+        print("⚠️ No se pudo reajustar el índice de búsqueda:", e)
+
+# Importa sklearn en otro hilo (lo más lento del arranque) y ajusta el índice sin
+# demorar el inicio del polling; las búsquedas que llegan antes esperan a busqueda_lista.
+# También ajusta el índice de cada fragmento que se carga después (sklearn ya está importado).
+async def preparar_busqueda(fragmento):
+    inicio = time.perf_counter()
+    try:
+        await asyncio.to_thread(precargar_busqueda)
+        await reajustar_busqueda(fragmento)
+    except Exception as e:
+        print("⚠️ No se pudo preparar el índice de búsqueda:", e)
+    finally:
+        fragmento.busqueda_lista.set()
+    if fragmento is fragmentos.principal:
+        tiempos_segundo_plano.append(("índice de búsqueda", time.perf_counter() - inicio))
+        print(f"🔎 Índice de búsqueda listo en {tiempos_segundo_plano[-1][1]:.2f} s")
+
+# Asigna (o desasigna con "") una optativa manteniendo el libro de plazas.
+# Si se pasa la lista 'promovidos', la plaza que queda libre se ofrece a la
+# lista de espera y los estudiantes promovidos se agregan a esa lista.
+def asignar_estudiante(est, optativa, promovidos=None):
+    anterior = padron.asignar(est, optativa)
+    if anterior == optativa:
+        return anterior
+    if optativa:
+        libro_plazas.ocupar(optativa)
+        if est.get("espera", {}).get("optativa") == optativa:
+            lista_espera.quitar(est)
+    if anterior:
+        libro_plazas.liberar(anterior)
+        if promovidos is not None:
+            promover_lista_espera(anterior, promovidos)
+    return anterior
+
+def eliminar_estudiante(nombre, grupo, promovidos=None):
+    est = padron.eliminar(nombre, grupo)
+    if est:
+        lista_espera.quitar(est)
+        if est["optativa"]:
+            libro_plazas.liberar(est["optativa"])
+            if promovidos is not None:
+                promover_lista_espera(est["optativa"], promovidos)
+    return est
+
+# Guarda el chat del estudiante para poder avisarle cuando salga de la lista de espera
+async def registrar_chat_estudiante(est, chat_id):
+    if est.get("chat_id") != chat_id:
+        est["chat_id"] = chat_id
+        await guardar_estudiantes(padron.como_lista())
+
+# Ocupa las plazas libres de una optativa con los primeros de su lista de espera
+def promover_lista_espera(optativa, promovidos):
+    while libro_plazas.hay_plaza(optativa):
+        est = lista_espera.siguiente(optativa)
+        if est is None:
+            break
+        promovidos.append((est, optativa))
+        asignar_estudiante(est, optativa, promovidos)
+    return promovidos
+
+async def notificar_promociones(update, context, promovidos):
+    if not promovidos:
+        return
+    usuario = context.user_data.get("usuario", "Desconocido")
+    lineas = []
+    avisos = []
+    for est, optativa in promovidos:
+        lineas.append(f"• {est['nombre']} ({est['grupo']}) → {optativa}")
+        await registrar_operacion(usuario, f"ha liberado una plaza y se promovió desde la lista de espera a {est['nombre']} ({est['grupo']}) en {optativa}")
+        if est.get("chat_id"):
+            avisos.append(cola_envios.encolar(
+                est["chat_id"],
+                f"🎉 Se liberó una plaza y has sido asignado a la optativa '{optativa}'."
+            ))
+    await enviar_mensaje_largo(update, context, "⏫ Promovidos desde lista de espera:\n" + "\n".join(lineas))
+    for resultado in await asyncio.gather(*avisos, return_exceptions=True):
+        if isinstance(resultado, Exception):
+            print("Error notificando promoción:", resultado)
+
 # end region
 # region Salva de datos
 
-def guardar_estudiantes(estudiantes):
-    with open(ESTUDIANTES_FILE, "w", encoding="utf-8") as f:
-        json.dump(estudiantes, f, indent=4, ensure_ascii=False)
+# Los archivos de estudiantes, optativas, reseñas y preferencias son los del fragmento en curso
+async def guardar_estudiantes(estudiantes):
+    await almacen.escribir_json(fragmentos.actual().ruta(ESTUDIANTES_FILE), estudiantes)
+
+async def guardar_optativas(optativas):
+    await almacen.escribir_json(fragmentos.actual().ruta(OPTATIVAS_FILE), optativas)
 
-def guardar_optativas(optativas):
-    with open(OPTATIVAS_FILE, "w", encoding="utf-8") as file:
-        json.dump(optativas, file, indent=4)
+async def guardar_profesores(profesores):
+    await almacen.escribir_json(PROFESORES_FILE, profesores)
 
-def guardar_profesores(profesores):
-    with open(PROFESORES_FILE, "w", encoding="utf-8") as f:
-        json.dump(profesores, f, indent=4, ensure_ascii=False)
+async def guardar_resenas(resenas):
+    await almacen.ejecutar(diario_resenas.reiniciar, list(resenas))
 
-def guardar_resenas(resenas):
-    with open(RESEÑAS_FILE, "w", encoding="utf-8") as f:
-        json.dump(resenas, f, indent=4, ensure_ascii=False)
+async def anexar_resena(resena):
+    await almacen.ejecutar(diario_resenas.anexar, resena)
+    if diario_resenas.reservar_compactacion():
+        # La nueva instantánea se escribe en segundo plano con las reseñas vigentes al rotar
+        generacion = await almacen.ejecutar(diario_resenas.rotar)
+        copias = [r.como_dict() for r in indice_resenas.como_lista()]
+        lanzar_en_fondo(compactar_en_fondo(fragmentos.actual().diario_resenas, copias, generacion))
+
+async def guardar_preferencias():
+    datos = [{"nombre": n, "grupo": g, "preferencias": p} for (n, g), p in preferencias.items()]
+    await almacen.escribir_json(fragmentos.actual().ruta(PREFERENCIAS_FILE), datos)
 
 # end region
 # region Validación de documentos
 
-def validar_estudiantes(data):
-    if not isinstance(data, list): return False
-    for est in data:
-        if not all(k in est for k in ("nombre", "grupo", "optativa")):
-            return False
-    return True
-
-def validar_optativas(data):
-    if not isinstance(data, list): return False
-    for opt in data:
-        if not all(k in opt for k in ("nombre", "profesor", "descripcion", "plazas", "relacionadas")):
-            return False
-    return True
-
-def validar_profesores(data):
-    if not isinstance(data, list): return False
-    for prof in data:
-        if not all(k in prof for k in ("usuario", "clave", "nombre")):
-            return False
-    return True
+# Campos obligatorios de cada registro, por archivo que se puede subir
+CAMPOS_ARCHIVOS = {
+    "estudiantes.json": ("nombre", "grupo", "optativa"),
+    "optativas.json": ("nombre", "profesor", "descripcion", "plazas", "relacionadas"),
+    "profesores.json": ("usuario", "clave", "nombre"),
+}
+
+# Decodifica y valida los registros uno a uno; se corta en el primero que falle.
+# Corre en el hilo del almacén. Devuelve (registros, None) o (None, mensaje de error).
+def leer_documento(contenido, campos):
+    registros = []
+    try:
+        flujo = io.TextIOWrapper(io.BytesIO(contenido), encoding="utf-8")
+        for registro in iterar_lista_json(flujo):
+            if not isinstance(registro, dict) or not all(k in registro for k in campos):
+                return None, f"El registro {len(registros) + 1} no tiene los campos {', '.join(campos)}."
+            registros.append(registro)
+    except ValueError:  # Incluye JSON mal formado y texto que no es UTF-8
+        return None, "El archivo no es una lista JSON válida."
+    return registros, None
+
+# Los archivos subidos se comparan con los datos en memoria y solo se aplican
+# las diferencias, manteniendo los índices al día sin reconstruirlos. Estas
+# funciones no ceden el control: el cambio completo es atómico para los handlers.
+
+def aplicar_estudiantes(nuevos):
+    """Devuelve (altas, bajas, cambios)."""
+    optativa_de = {}
+    for est in nuevos:
+        optativa_de.setdefault((est["nombre"], est["grupo"]), est["optativa"])  # Duplicados: vale el primero
+
+    bajas = [est for est in padron if (est["nombre"], est["grupo"]) not in optativa_de]
+    for est in bajas:
+        eliminar_estudiante(est["nombre"], est["grupo"])
+    altas = cambios = 0
+    for (nombre, grupo), optativa in optativa_de.items():
+        est = padron.obtener(nombre, grupo)
+        if est is None:
+            est = padron.agregar(nombre, grupo)
+            altas += 1
+        elif est["optativa"] != optativa:
+            cambios += 1
+        asignar_estudiante(est, optativa)
+    return altas, len(bajas), cambios
+
+def aplicar_optativas(nuevas):
+    """Devuelve (altas, bajas, cambios, estudiantes desasignados)."""
+    por_nombre = {}
+    for opt in nuevas:
+        por_nombre.setdefault(opt["nombre"], opt)
+
+    # Una optativa que ya no está se elimina como con "🗑️ Eliminar optativas"
+    bajas = [opt["nombre"] for opt in catalogo if opt["nombre"] not in por_nombre]
+    desasignados = 0
+    for nombre in bajas:
+        catalogo.eliminar(nombre)
+        desasignados += len(padron.desasignar_optativa(nombre))
+        lista_espera.descartar_optativa(nombre)
+        libro_plazas.quitar(nombre)
+    altas = cambios = 0
+    for nombre, opt in por_nombre.items():
+        actual = catalogo.obtener(nombre)
+        if actual == opt:
+            continue
+        catalogo.agregar(opt)
+        if actual is None:
+            altas += 1
+        else:
+            cambios += 1
+        if actual is None or actual["plazas"] != opt["plazas"]:
+            libro_plazas.fijar_capacidad(nombre, opt["plazas"], padron.cantidad_en(nombre))
+    if altas or bajas or cambios:
+        reindexar_busqueda()
+    return altas, len(bajas), cambios, desasignados
+
+def describir_cambios(altas, bajas, cambios):
+    return f"{altas} alta(s), {bajas} baja(s), {cambios} modificado(s)"
+
+# Descarga un documento respetando MAX_TAMANO_ARCHIVO (None si se rechazó)
+async def descargar_documento(update, documento):
+    limite_mb = MAX_TAMANO_ARCHIVO // (1024 * 1024)
+    # Telegram informa el tamaño: un archivo demasiado grande ni se descarga
+    if (documento.file_size or 0) > MAX_TAMANO_ARCHIVO:
+        await responder(update, f"⚠️ El archivo supera el máximo de {limite_mb} MB.")
+        return None
+    archivo = await documento.get_file()
+    contenido = await archivo.download_as_bytearray()
+    if len(contenido) > MAX_TAMANO_ARCHIVO:
+        await responder(update, f"⚠️ El archivo supera el máximo de {limite_mb} MB.")
+        return None
+    return contenido
+
+# Alta y asignación masiva desde una planilla CSV/TSV (nombre, grupo y optativa opcional).
+# Los estudiantes que ya están en el padrón no se duplican; si la fila trae una
+# optativa se asigna como en "📌 Asignar optativa", con lista de espera si no hay plaza.
+async def importar_planilla(update, context, documento):
+    contenido = await descargar_documento(update, documento)
+    if contenido is None:
+        return
+    delimitador = delimitador_de(documento.file_name, contenido)
+    try:
+        filas = await almacen.ejecutar(list, leer_planilla(contenido, delimitador))
+    except ValueError as e:
+        await responder(update, f"❌ No se pudo leer '{documento.file_name}'.\n{e}")
+        return
+    del contenido
+
+    altas = existentes = repetidos = asignados = en_espera = 0
+    errores = []
+    promovidos = []
+    vistos = set()
+    async with cerrojo_asignacion:
+        for numero, nombre, grupo, nombre_optativa in filas:
+            if not nombre or not grupo:
+                errores.append(f"Fila {numero}: falta el nombre o el grupo")
+                continue
+            if (nombre, grupo) in vistos:
+                repetidos += 1
+                continue
+            vistos.add((nombre, grupo))
+
+            est = padron.agregar(nombre, grupo)
+            if est is None:
+                est = padron.obtener(nombre, grupo)
+                existentes += 1
+            else:
+                altas += 1
+
+            if not nombre_optativa:
+                continue
+            optativa = catalogo.buscar(nombre_optativa)
+            if not optativa:
+                errores.append(f"Fila {numero}: optativa no encontrada: {nombre_optativa}")
+                continue
+            if est["optativa"] == optativa["nombre"] or (est.get("espera") or {}).get("optativa") == optativa["nombre"]:
+                continue  # Ya asignado o ya esperando (sin perder su lugar en la lista)
+            if not libro_plazas.hay_plaza(optativa["nombre"]):
+                lista_espera.agregar(est, optativa["nombre"])
+                en_espera += 1
+                continue
+            asignar_estudiante(est, optativa["nombre"], promovidos)
+            asignados += 1
+
+    if altas or asignados or en_espera:
+        await guardar_estudiantes(padron.como_lista())
+        usuario = context.user_data.get("usuario", "Desconocido")
+        await registrar_operacion(
+            usuario,
+            f"ha importado la planilla {documento.file_name}: {altas} alta(s), {asignados} asignación(es), {en_espera} en lista de espera"
+        )
+
+    respuesta = (
+        f"✅ Planilla procesada: {len(filas)} fila(s).\n"
+        f"➕ {altas} estudiante(s) agregado(s), {existentes} ya estaban en el padrón"
+        + (f", {repetidos} repetido(s) en la planilla" if repetidos else "") + ".\n"
+        f"📌 {asignados} asignado(s)"
+        + (f", ⏳ {en_espera} a la lista de espera por falta de plazas" if en_espera else "") + ".\n"
+    )
+    if errores:
+        respuesta += f"\n⚠️ {len(errores)} fila(s) con errores:\n" + "\n".join(errores[:20])
+        if len(errores) > 20:
+            respuesta += f"\n… y {len(errores) - 20} más."
+    await enviar_mensaje_largo(update, context, respuesta)
+    await notificar_promociones(update, context, promovidos)
 
 async def manejar_archivo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     es_profesor = user_id in usuarios_logueados
 
     if not es_profesor:
-        await update.message.reply_text("❌ Solo los profesores pueden subir archivos.")
+        await responder(update, "❌ Solo los profesores pueden subir archivos.")
         return
 
     documento: Document = update.message.document
     nombre_archivo = documento.file_name
 
-    if nombre_archivo not in ("estudiantes.json", "optativas.json", "profesores.json"):
-        await update.message.reply_text("⚠️ El archivo debe llamarse 'estudiantes.json', 'optativas.json' o 'profesores.json'.")
+    if nombre_archivo.lower().endswith((".csv", ".tsv")):
+        await importar_planilla(update, context, documento)
         return
 
-    archivo = await documento.get_file()
-    contenido = await archivo.download_as_bytearray()
-    try:
-        datos = json.loads(contenido.decode("utf-8"))
-    except Exception:
-        await update.message.reply_text("⚠️ El archivo no es un JSON válido.")
+    if nombre_archivo not in CAMPOS_ARCHIVOS:
+        await responder(
+            update,
+            "⚠️ El archivo debe llamarse 'estudiantes.json', 'optativas.json' o 'profesores.json', "
+            "o ser una planilla .csv o .tsv de estudiantes."
+        )
         return
 
-    ruta_archivo = f"data/{nombre_archivo}"
-    es_valido = False
-    mensaje_error = ""
-
-    if nombre_archivo == "estudiantes.json":
-        es_valido = validar_estudiantes(datos)
-        mensaje_error = "Formato esperado: lista de objetos con 'nombre', 'grupo' y 'optativa'."
-    elif nombre_archivo == "optativas.json":
-        es_valido = validar_optativas(datos)
-        mensaje_error = "Formato esperado: lista de objetos con 'nombre', 'profesor', 'descripcion', 'plazas' y 'relacionadas'."
-    elif nombre_archivo == "profesores.json":
-        es_valido = validar_profesores(datos)
-        mensaje_error = "Formato esperado: lista de objetos con 'usuario', 'clave' y 'nombre'."
-
-    if not es_valido:
-        await update.message.reply_text(f"❌ El contenido de {nombre_archivo} no es válido.\n{mensaje_error}")
+    contenido = await descargar_documento(update, documento)
+    if contenido is None:
         return
 
-    with open(ruta_archivo, "w", encoding="utf-8") as f:
-        json.dump(datos, f, indent=4, ensure_ascii=False)
-    
-    usuario = context.user_data.get("usuario", "Desconocido")
-    registrar_operacion(usuario, f"ha reemplazado el archivo: {nombre_archivo}")
+    datos, error = await almacen.ejecutar(leer_documento, contenido, CAMPOS_ARCHIVOS[nombre_archivo])
+    del contenido
+    if error:
+        await responder(update, f"❌ El contenido de {nombre_archivo} no es válido.\n{error}")
+        return
 
+    promovidos = []
+    if nombre_archivo == "profesores.json":
+        actuales = {p["usuario"]: p for p in await cargar_profesores()}
+        nuevos = {}
+        for prof in datos:
+            nuevos.setdefault(prof["usuario"], prof)
+        altas = len(nuevos.keys() - actuales.keys())
+        bajas = len(actuales.keys() - nuevos.keys())
+        cambios = sum(1 for u in nuevos.keys() & actuales.keys() if nuevos[u] != actuales[u])
+        if altas or bajas or cambios:
+            await guardar_profesores(list(nuevos.values()))
+    else:
+        # Los cambios masivos del padrón no se mezclan con una asignación automática en curso
+        async with cerrojo_asignacion:
+            desasignados = 0
+            if nombre_archivo == "estudiantes.json":
+                altas, bajas, cambios = aplicar_estudiantes(datos)
+            else:
+                altas, bajas, cambios, desasignados = aplicar_optativas(datos)
+            # Las bajas y los cambios de capacidad pueden liberar plazas para quienes esperan
+            for optativa in lista_espera.optativas():
+                promover_lista_espera(optativa, promovidos)
+        hubo_cambios = altas or bajas or cambios
+        if nombre_archivo == "optativas.json" and hubo_cambios:
+            await guardar_optativas(catalogo.como_lista())
+        if (nombre_archivo == "estudiantes.json" and hubo_cambios) or desasignados or promovidos:
+            await guardar_estudiantes(padron.como_lista())
+
+    resumen = describir_cambios(altas, bajas, cambios)
+    if not (altas or bajas or cambios or promovidos):
+        await responder(update, f"ℹ️ '{nombre_archivo}' no tiene cambios respecto a los datos actuales.")
+        return
+
+    usuario = context.user_data.get("usuario", "Desconocido")
+    await registrar_operacion(usuario, f"ha subido el archivo {nombre_archivo}: {resumen}")
 
-    await update.message.reply_text(f"✅ Archivo '{nombre_archivo}' reemplazado correctamente.")
+    await responder(update, f"✅ Archivo '{nombre_archivo}' aplicado: {resumen}.")
+    await notificar_promociones(update, context, promovidos)
 
 # end region
 # region Comandos principales
 
+def renderizar_inicio():
+    lineas = ["📚 *Cursos optativos disponibles:*\n\n"]
+    for curso in catalogo:
+        disponibles = libro_plazas.disponibles(curso['nombre'])
+        plazas_str = "ilimitadas" if disponibles == -1 else disponibles
+        lineas.append(f"• *{curso['nombre']}* (Prof: {curso['profesor']}, Plazas: {plazas_str})\n")
+    lineas.append("\nSi eres profesor, usa /login")
+    return "".join(lineas)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    optativos = cargar_optativas()  # Cargar las optativas desde el archivo
-    texto = "📚 *Cursos optativos disponibles:*\n\n"
-    for curso in optativos:
-        plazas = curso.get('plazas', 'No disponible')
-        plazas_str = "ilimitadas" if plazas == -1 else plazas
-        texto += f"• *{curso['nombre']}* (Prof: {curso['profesor']}, Plazas: {plazas_str})\n"
-    texto += "\nSi eres profesor, usa /login"
-    await update.message.reply_markdown(texto)
+    texto = obtener_cacheado(mensajes_catalogo, "inicio", (catalogo.version, libro_plazas.version), renderizar_inicio)
+    await responder(update, texto, parse_mode="Markdown")
 
 async def login(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("👤 Usuario:")
+    # Mientras dure el login los mensajes del usuario no se graban (ver esperando_credenciales)
+    context.user_data["credenciales"] = True
+    await responder(update, "👤 Usuario:")
     return LOGIN_USUARIO
 
 async def recibir_usuario(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["usuario"] = update.message.text
-    await update.message.reply_text("🔑 Contraseña:")
+    await responder(update, "🔑 Contraseña:")
     return LOGIN_CLAVE
 
 async def recibir_clave(update: Update, context: ContextTypes.DEFAULT_TYPE):
     clave = update.message.text.strip()
     usuario = context.user_data.get("usuario")
-    profesor = validar_credenciales(usuario, clave)
+    context.user_data.pop("credenciales", None)
+    profesor = await validar_credenciales(usuario, clave)
 
     if profesor:
         user_id = update.effective_user.id
         usuarios_logueados.add(user_id)
 
-        # Guardar datos útiles
+        # Guardar datos útiles ('sesion' permite recuperar la sesión tras un reinicio)
+        context.user_data["sesion"] = True
         context.user_data["usuario"] = profesor["usuario"]
         context.user_data["nombre"] = profesor["nombre"]
         context.user_data["es_superadmin"] = profesor["usuario"] == "superadmin"
 
-        await update.message.reply_text(
+        await responder(
+            update,
             f"🔓 Bienvenido, {profesor['nombre']}! Recuerde que puede ver el registro de operaciones usando el comando /log", 
             reply_markup=menu_profesor
         )
         return ConversationHandler.END
     else:
         context.user_data.pop("usuario", None)  # Limpiar el usuario
-        await update.message.reply_text("❌ Credenciales incorrectas. Vuelve a introducir tu usuario con /login.")
+        await responder(update, "❌ Credenciales incorrectas. Vuelve a introducir tu usuario con /login.")
         return ConversationHandler.END
 
-def validar_credenciales(usuario, clave):
+# Cierra la sesión de un profesor sin avisarle (p. ej. porque se lo eliminó), también
+# en la persistencia, para que no se recupere al reiniciar
+def cerrar_sesion(app, user_id):
+    usuarios_logueados.discard(user_id)
+    datos = app.user_data.get(user_id)
+    if datos:
+        for clave in ("sesion", "usuario", "nombre", "es_superadmin", "estado"):
+            datos.pop(clave, None)
+        app.mark_data_for_update_persistence(user_ids=[user_id])
+
+async def validar_credenciales(usuario, clave):
     if usuario == "superadmin" and clave == SUPERADMIN_PASSWORD:
         return {"usuario": "superadmin", "nombre": "SuperAdmin"}
-    profesores = cargar_profesores()
+    profesores = await cargar_profesores()
     for prof in profesores:
         if prof["usuario"] == usuario and prof["clave"] == clave:
             return prof  # Devuelve el objeto completo
@@ -247,11 +682,34 @@ def escapar_markdown(texto):
         texto = texto.replace(c, f"\\{c}")
     return texto
 
+# Caché de textos ya renderizados: clave → (versión de los datos, texto).
+# Si la versión cambió, el texto se vuelve a generar.
+def obtener_cacheado(cache, clave, version, generar):
+    guardado = cache.get(clave)
+    if guardado is None or guardado[0] != version:
+        guardado = (version, generar())
+        cache[clave] = guardado
+    return guardado[1]
+
+# Responde en el chat del update. Todas las respuestas pasan por la cola de envíos,
+# que respeta los límites de Telegram y divide los textos demasiado largos.
+async def responder(update, texto, parse_mode=None, reply_markup=None):
+    return await cola_envios.enviar(update.effective_chat.id, texto, parse_mode, reply_markup)
+
+# Encola varios mensajes al chat del update y espera a que se entreguen.
+# La cola fusiona los mensajes consecutivos y respeta los límites de Telegram.
+async def enviar_en_cola(update, textos, parse_mode=None):
+    chat_id = update.effective_chat.id
+    futuros = [cola_envios.encolar(chat_id, texto, parse_mode) for texto in textos]
+    resultados = await asyncio.gather(*futuros, return_exceptions=True)
+    for resultado in resultados:
+        if isinstance(resultado, Exception):
+            raise resultado
+
 async def enviar_mensaje_largo(update, context, texto, parse_mode=None):
     max_len = 4000  # un poco menos de 4096 para margen
     partes = [texto[i:i+max_len] for i in range(0, len(texto), max_len)]
-    for parte in partes:
-        await update.message.reply_text(parte, parse_mode=parse_mode)
+    await enviar_en_cola(update, partes, parse_mode=parse_mode)
 
 async def comando_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -262,10 +720,13 @@ async def comando_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto += "📚 *Estudiantes:*\n"
     texto += "• `/start` – Ver las optativas disponibles\n"
     texto += "• `/rev` – Dejar una reseña sobre tu optativa\n"
-    texto += "• `/vrev` – Ver reseñas de una optativa\n\n"
+    texto += "• `/vrev` – Ver reseñas de una optativa\n"
+    texto += "• `/pref` – Indicar tus optativas preferidas en orden\n"
+    texto += "• `/facultad [nombre]` – Ver las facultades o semestres y elegir con cuál trabajar\n\n"
 
     texto += "Para realizar una búsqueda en el chat respecto a una optativa:\n"
     texto += "• Puedes buscar optativas escribiendo texto libre (ej: `machine learning o ciberseguridad`)\n"
+    texto += "• La búsqueda también tiene en cuenta los comentarios de las reseñas (ej: `práctico` o `muy exigente`)\n"
     texto += "• Los caracteres especiales `*` detrás de una palabra representa el nivel de importancia que se le debe dar en la búsqueda. Se pueden concatenar hasta 5 `*`)\n"
     texto += "• Los caracteres especiales `!` delante de una palabra evita ese contenido en cualquier resultado mostrado.\n\n"
 
@@ -273,29 +734,203 @@ async def comando_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto += "• `/login` – Iniciar sesión como profesor\n"
     if es_profesor:
         texto += "• Enviar archivos `.json` para actualizar estudiantes, optativas o profesores. Estos archivos deben ser nombrados \n"
+        texto += "• Enviar una planilla `.csv` o `.tsv` (columnas nombre, grupo y optativa opcional) para agregar y asignar estudiantes en bloque\n"
+        texto += "• `/exportar [csv|tsv]` – Descargar el padrón con las asignaciones y listas de espera\n"
         texto += "• `/log` – Descargar el registro de operaciones recientes\n"
+        texto += "• `/stats` – Ver cuántas veces se usó cada función del bot y cuánto tarda\n"
         texto += "• `/delrev` – Eliminar todas las reseñas realizadas por estudiantes (solo superadmin)\n"
+        texto += "• `/archivar [semestre]` – Cerrar el semestre: guarda comprimidos el padrón y las reseñas, quita las reseñas y las asignaciones y conserva a los estudiantes (solo superadmin)\n"
+        texto += "• `/lag` – Ver el retraso del bot y los handlers lentos (solo superadmin)\n"
+        texto += "• `/facultad <nombre nuevo>` – Crear una facultad o semestre vacío (solo superadmin)\n"
+        texto += "• `/perfil [segundos]` o `/perfil <n> updates` – Perfilar el bot y recibir el resultado (solo superadmin)\n"
         texto += "• Menú con opciones de agregar/eliminar optativas, estudiantes y asignarlos\n"
+        texto += "• 🧮 Asignación automática – Asigna según las preferencias enviadas con `/pref`, respetando las plazas\n"
         texto += "ℹ️ Recuerde que al insertar TODO durante una eliminación de estudiantes u optativas, eliminará todos los datos referentes a estos campos."
 
-    await update.message.reply_markdown(texto)
+    await responder(update, texto, parse_mode="Markdown")
 
 async def eliminar_todas_las_resenas(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id not in usuarios_logueados:
-        await update.message.reply_text("❌ Solo usuarios logueados pueden ejecutar este comando.")
+        await responder(update, "❌ Solo usuarios logueados pueden ejecutar este comando.")
         return
 
     usuario_logueado = context.user_data.get("usuario")
     if usuario_logueado != "superadmin":
-        await update.message.reply_text("❌ Solo el superadmin puede eliminar todas las reseñas.")
+        await responder(update, "❌ Solo el superadmin puede eliminar todas las reseñas.")
+        return
+
+    indice_resenas.vaciar()
+    await guardar_resenas([])
+    reindexar_busqueda()
+
+    await registrar_operacion("superadmin", "ha eliminado todas las reseñas del sistema")
+    await responder(update, "🗑️ Todas las reseñas han sido eliminadas correctamente.")
+
+# Cierra el semestre: el padrón con sus asignaciones y las reseñas pasan a una partición
+# comprimida (ver archive) y salen de los archivos en uso. Sus promedios siguen visibles.
+async def archivar_semestre(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in usuarios_logueados or context.user_data.get("usuario") != "superadmin":
+        await responder(update, "❌ Solo el superadmin puede archivar semestres.")
         return
 
-    with open(RESEÑAS_FILE, "w", encoding="utf-8") as f:
-        json.dump([], f, indent=4, ensure_ascii=False)
+    if not context.args:
+        semestres = archivo_semestres.semestres()
+        lineas = [
+            f"• {semestre} ({datos['fecha'][:10]}): {datos['estudiantes']} estudiante(s), {datos['resenas']} reseña(s)"
+            for semestre, datos in semestres.items()
+        ]
+        await responder(
+            update,
+            ("🗄️ Semestres archivados:\n" + "\n".join(lineas) if lineas else "🗄️ No hay semestres archivados.")
+            + "\n\nUsa /archivar <semestre> para cerrar el semestre actual."
+        )
+        return
 
-    registrar_operacion("superadmin", "ha eliminado todas las reseñas del sistema")
-    await update.message.reply_text("🗑️ Todas las reseñas han sido eliminadas correctamente.")
+    semestre = context.args[0].strip()
+    if cerrojo_asignacion.locked():
+        await responder(update, "⏳ Hay una asignación automática en curso, espera a que termine.")
+        return
+    async with cerrojo_asignacion:
+        estudiantes = padron.como_lista()
+        resenas = indice_resenas.como_lista()
+        # Copias: los handlers pueden seguir modificando los registros mientras se escribe la partición
+        copias = ([est.como_dict() for est in estudiantes], [r.como_dict() for r in resenas])
+        try:
+            await almacen.ejecutar(archivo_semestres.archivar, semestre, *copias)
+        except (ValueError, OSError) as e:
+            await responder(update, f"❌ No se pudo archivar: {e}")
+            return
+
+        # Solo salen los registros archivados: lo que llegó mientras se escribía se queda
+        for r in resenas:
+            clave = clave_resena(r)
+            if indice_resenas.obtener(*clave) is r:
+                indice_resenas.eliminar(*clave)
+        # El padrón se conserva: solo se quitan las asignaciones y solicitudes de espera archivadas
+        for est, copia in zip(estudiantes, copias[0]):
+            if copia.get("espera") and est.get("espera") is copia["espera"]:
+                lista_espera.quitar(est)
+            if copia["optativa"] and est["optativa"] == copia["optativa"]:
+                asignar_estudiante(est, "")
+        reindexar_busqueda()
+        await guardar_estudiantes(padron.como_lista())
+        await guardar_resenas(indice_resenas.como_lista())
+
+    await registrar_operacion("superadmin", f"archivó el semestre '{semestre}'")
+    await responder(
+        update,
+        f"🗄️ Semestre '{semestre}' archivado: {len(estudiantes)} estudiante(s) con sus asignaciones "
+        f"y {len(resenas)} reseña(s). El padrón se conserva sin asignaciones ni listas de espera, "
+        f"listo para el semestre siguiente."
+    )
+
+async def ver_estadisticas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in usuarios_logueados:
+        await responder(update, "❌ Este comando es solo para profesores.")
+        return
+
+    usados = sorted(metricas.handlers.items(), key=lambda x: x[1].llamadas, reverse=True)
+    usados = [(nombre, m) for nombre, m in usados if m.llamadas]
+    if not usados:
+        await responder(update, "📭 Todavía no se ha atendido ninguna solicitud.")
+        return
+
+    def ms(segundos):
+        return "+10 s" if segundos == float("inf") else f"≤{segundos * 1000:.0f} ms"
+
+    mensaje = "📈 Estadísticas por handler (llamadas, errores, media, p50, p95):\n\n"
+    for nombre, m in usados:
+        media = m.suma / m.llamadas * 1000
+        mensaje += f"• {nombre}: {m.llamadas} · ❌ {m.errores} · {media:.0f} ms · {ms(m.percentil(50))} · {ms(m.percentil(95))}\n"
+    await enviar_mensaje_largo(update, context, mensaje)
+
+async def perfilar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global perfil_activo
+    if update.effective_user.id not in usuarios_logueados or context.user_data.get("usuario") != "superadmin":
+        await responder(update, "❌ Solo el superadmin puede perfilar el bot.")
+        return
+
+    if perfil_activo is not None:
+        await responder(update, "⏳ Ya hay un perfilado en curso.")
+        return
+
+    # /perfil [segundos] o /perfil <n> updates
+    args = context.args or []
+    try:
+        cantidad = int(args[0]) if args else PERFIL_SEGUNDOS
+    except ValueError:
+        await responder(update, "⚠️ Uso: /perfil [segundos] o /perfil <n> updates")
+        return
+    por_updates = len(args) > 1 and args[1].lower().startswith("update")
+    if cantidad <= 0:
+        await responder(update, "⚠️ La cantidad debe ser positiva.")
+        return
+
+    perfil_activo = SesionPerfilado()
+    perfil_activo.iniciar()
+    # La espera va en una tarea aparte para no retener el chat del superadmin. Se lanza antes
+    # de responder: si el aviso falla, el perfilador igual se detiene al cumplirse el plazo.
+    lanzar_en_fondo(terminar_perfilado(context.bot, update.effective_chat.id, cantidad, por_updates))
+    limite = f"{cantidad} updates (máx. {PERFIL_SEGUNDOS_MAX} s)" if por_updates else f"{min(cantidad, PERFIL_SEGUNDOS_MAX)} s"
+    await responder(update, f"🔬 Perfilando durante {limite}...")
+
+async def terminar_perfilado(bot, chat_id, cantidad, por_updates):
+    global perfil_activo
+    sesion = perfil_activo
+    try:
+        if por_updates:
+            # Las métricas ya cuentan las llamadas a handlers: se consulta solo mientras se perfila
+            inicial = sum(m.llamadas for m in metricas.handlers.values())
+            fin = time.monotonic() + PERFIL_SEGUNDOS_MAX
+            while sum(m.llamadas for m in metricas.handlers.values()) - inicial < cantidad and time.monotonic() < fin:
+                await asyncio.sleep(0.5)
+        else:
+            await asyncio.sleep(min(cantidad, PERFIL_SEGUNDOS_MAX))
+    finally:
+        sesion.detener()
+        perfil_activo = None
+
+    contenido, resumen = await almacen.ejecutar(sesion.exportar)
+    sello = datetime.now().strftime("%Y%m%d_%H%M%S")
+    try:
+        await bot.send_document(
+            chat_id=chat_id,
+            document=contenido,
+            filename=f"perfil_{sello}.prof",
+            caption=f"🔬 Perfil de {sesion.duracion:.1f} s (ábrelo con pstats o snakeviz)."
+        )
+        await bot.send_document(
+            chat_id=chat_id,
+            document=resumen.encode("utf-8"),
+            filename=f"perfil_{sello}.txt",
+            caption="📄 Funciones con más tiempo propio y acumulado."
+        )
+    except Exception as e:
+        print("Error enviando el perfil:", e)
+
+async def ver_lag(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in usuarios_logueados or context.user_data.get("usuario") != "superadmin":
+        await responder(update, "❌ Solo el superadmin puede consultar el monitor del bucle.")
+        return
+
+    p = monitor_bucle.percentiles()
+    mensaje = (
+        f"🚀 Arranque: {resumen_arranque()}\n"
+        f"🗂️ Fragmentos en memoria: {', '.join(fragmentos.cargados())} "
+        f"({fragmentos.cargas} cargas, {fragmentos.descargas} descargas)\n\n"
+        f"⏱️ Retraso del bucle ({p['muestras']} muestras):\n"
+        f"p50 {p['p50'] * 1000:.1f} ms · p95 {p['p95'] * 1000:.1f} ms · "
+        f"p99 {p['p99'] * 1000:.1f} ms · máx {p['max'] * 1000:.1f} ms\n\n"
+    )
+    lentos = list(monitor_bucle.lentos)[-15:]
+    if not lentos:
+        mensaje += f"✅ Ningún paso superó {monitor_bucle.umbral * 1000:.0f} ms."
+    else:
+        mensaje += f"🐢 Pasos lentos recientes (> {monitor_bucle.umbral * 1000:.0f} ms):\n"
+        for nombre, duracion, _, momento in reversed(lentos):
+            mensaje += f"• {momento.strftime('%H:%M:%S')} {nombre}: {duracion * 1000:.0f} ms\n"
+    await enviar_mensaje_largo(update, context, mensaje)
 
 # end region
 # region Funciones de cancelación
@@ -323,16 +958,13 @@ async def cancelar_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
 
     # Restaurar los datos importantes
+    context.user_data["sesion"] = True
     context.user_data["usuario"] = usuario
     context.user_data["nombre"] = nombre
     context.user_data["es_superadmin"] = es_superadmin
 
     # Enviar mensaje de cancelación
-    await context.bot.send_message(
-        chat_id=query.message.chat_id,
-        text="✅ Acción cancelada.\n📋 Menú principal:",
-        reply_markup=menu_profesor
-    )
+    await cola_envios.enviar(query.message.chat_id, "✅ Acción cancelada.\n📋 Menú principal:", reply_markup=menu_profesor)
 
     # Terminar la conversación completamente
     return ConversationHandler.END
@@ -350,10 +982,9 @@ async def cancelar_creacion_optativa_callback(update: Update, context: ContextTy
     await query.message.delete()
 
     # Enviar mensaje confirmando la cancelación
-    await context.bot.send_message(
-        chat_id=query.message.chat_id,
-        text="✅ La creación de la optativa ha sido cancelada.\n📋 Menú principal:",
-        reply_markup=menu_profesor  # Reemplaza esto con el menú que deseas mostrar después de cancelar
+    await cola_envios.enviar(
+        query.message.chat_id, "✅ La creación de la optativa ha sido cancelada.\n📋 Menú principal:",
+        reply_markup=menu_profesor,
     )
 
     return ConversationHandler.END  # Terminar la conversación de creación de optativa
@@ -364,7 +995,7 @@ async def cancelar_resena_callback(update: Update, context: ContextTypes.DEFAULT
     query = update.callback_query
     await query.answer()
     await query.message.delete()
-    await context.bot.send_message(chat_id=query.message.chat_id, text="❎ Reseña cancelada.")
+    await cola_envios.enviar(query.message.chat_id, "❎ Reseña cancelada.")
     context.user_data.pop("resena", None)
     return ConversationHandler.END
 
@@ -375,7 +1006,8 @@ async def cancelar_resena_callback(update: Update, context: ContextTypes.DEFAULT
 RESEÑA_IDENTIFICACION, RESEÑA_COMENTARIO, RESEÑA_PUNTUACION = range(10, 13)
 
 async def iniciar_resena(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await responder(
+        update,
         "📝 Para dejar una reseña, escribe tu nombre completo y grupo:\n"
         "`Nombre Apellido1 Apellido2 Grupo`",
         parse_mode="Markdown",
@@ -387,19 +1019,21 @@ async def recibir_identificacion_resena(update: Update, context: ContextTypes.DE
     entrada = update.message.text.strip()
     partes = entrada.split()
     if len(partes) < 4:
-        await update.message.reply_text("⚠️ Formato inválido. Intenta de nuevo.")
+        await responder(update, "⚠️ Formato inválido. Intenta de nuevo.")
         return RESEÑA_IDENTIFICACION
 
     nombre = " ".join(partes[:-1])
     grupo = partes[-1]
-    estudiante = next((e for e in cargar_estudiantes() if e["nombre"] == nombre and e["grupo"] == grupo), None)
+    estudiante = padron.obtener(nombre, grupo)
 
     if not estudiante:
-        await update.message.reply_text("❌ Estudiante no encontrado.")
+        await responder(update, "❌ Estudiante no encontrado.")
         return ConversationHandler.END
 
+    await registrar_chat_estudiante(estudiante, update.effective_chat.id)
+
     if not estudiante["optativa"]:
-        await update.message.reply_text("⚠️ No tienes ninguna optativa asignada.")
+        await responder(update, "⚠️ No tienes ninguna optativa asignada.")
         return ConversationHandler.END
 
     context.user_data["resena"] = {
@@ -409,12 +1043,12 @@ async def recibir_identificacion_resena(update: Update, context: ContextTypes.DE
         "optativa": estudiante["optativa"]
     }
 
-    await update.message.reply_text("🗨️ Escribe tu reseña:")
+    await responder(update, "🗨️ Escribe tu reseña:")
     return RESEÑA_COMENTARIO
 
 async def recibir_comentario_resena(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["resena"]["comentario"] = update.message.text.strip()
-    await update.message.reply_text("⭐ Del 1 al 5, ¿qué puntuación le das a la optativa?")
+    await responder(update, "⭐ Del 1 al 5, ¿qué puntuación le das a la optativa?")
     return RESEÑA_PUNTUACION
 
 async def recibir_puntuacion_resena(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -423,52 +1057,121 @@ async def recibir_puntuacion_resena(update: Update, context: ContextTypes.DEFAUL
         if not 1 <= puntuacion <= 5:
             raise ValueError
     except ValueError:
-        await update.message.reply_text("⚠️ Debes ingresar un número del 1 al 5.")
+        await responder(update, "⚠️ Debes ingresar un número del 1 al 5.")
         return RESEÑA_PUNTUACION
 
     context.user_data["resena"]["puntuacion"] = puntuacion
-    resenas = cargar_resenas()
     nueva = context.user_data["resena"]
 
-    # Verificar si ya existía reseña para esa optativa por el mismo estudiante
-    ya_existia = any(
-        r["nombre"] == nueva["nombre"] and
-        r["grupo"] == nueva["grupo"] and
-        r["optativa"] == nueva["optativa"]
-        for r in resenas
-    )
-
-    # Eliminar la reseña antigua si existe
-    resenas = [
-        r for r in resenas
-        if not (
-            r["nombre"] == nueva["nombre"] and
-            r["grupo"] == nueva["grupo"] and
-            r["optativa"] == nueva["optativa"]
-        )
-    ]
-
-    # Añadir la nueva reseña
-    resenas.append(nueva)
-    guardar_resenas(resenas)
+    # El índice reemplaza la reseña anterior del estudiante para esa optativa, si existía
+    ya_existia = indice_resenas.insertar(nueva) is not None
+    await anexar_resena(nueva)
+    # Con palabras nuevas los comentarios se reajustan en otro hilo (ver reajustar_busqueda)
+    if indice_busqueda.actualizar_resenas(nueva["optativa"], indice_resenas.de_optativa(nueva["optativa"])):
+        lanzar_en_fondo(reajustar_busqueda(fragmentos.actual(), completo=False))
 
     # Notificar
     if ya_existia:
-        await update.message.reply_text("♻️ Tu reseña anterior ha sido reemplazada por la nueva.")
+        await responder(update, "♻️ Tu reseña anterior ha sido reemplazada por la nueva.")
     else:
-        await update.message.reply_text("✅ ¡Gracias por tu reseña!")
+        await responder(update, "✅ ¡Gracias por tu reseña!")
 
     context.user_data.pop("resena", None)
     return ConversationHandler.END
 
 
+# end region
+# region Preferencias de estudiantes
+
+PREFERENCIA_IDENTIFICACION, PREFERENCIA_LISTA = range(30, 32)
+
+cancelar_preferencias_inline = InlineKeyboardMarkup([
+    [InlineKeyboardButton("❎ Cancelar", callback_data="cancelar_preferencias")]
+])
+
+async def iniciar_preferencias(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await responder(
+        update,
+        "🧮 Para indicar tus preferencias, escribe tu nombre completo y grupo:\n"
+        "`Nombre Apellido1 Apellido2 Grupo`",
+        parse_mode="Markdown",
+        reply_markup=cancelar_preferencias_inline
+    )
+    return PREFERENCIA_IDENTIFICACION
+
+async def recibir_identificacion_preferencias(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    partes = update.message.text.strip().split()
+    if len(partes) < 4:
+        await responder(update, "⚠️ Formato inválido. Intenta de nuevo.")
+        return PREFERENCIA_IDENTIFICACION
+
+    nombre = " ".join(partes[:-1])
+    grupo = partes[-1]
+    estudiante = padron.obtener(nombre, grupo)
+    if not estudiante:
+        await responder(update, "❌ Estudiante no encontrado.")
+        return ConversationHandler.END
+
+    await registrar_chat_estudiante(estudiante, update.effective_chat.id)
+
+    context.user_data["preferencias"] = (nombre, grupo)
+    await responder(
+        update,
+        "📋 Escribe las optativas que prefieres, una por línea y en orden (la primera es la que más te interesa):"
+    )
+    return PREFERENCIA_LISTA
+
+async def recibir_lista_preferencias(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    elegidas = []
+    no_encontradas = []
+    for linea in update.message.text.splitlines():
+        if not linea.strip():
+            continue
+        optativa = catalogo.buscar(linea)
+        if not optativa:
+            no_encontradas.append(linea.strip())
+        elif optativa["nombre"] not in elegidas:
+            elegidas.append(optativa["nombre"])
+
+    if no_encontradas:
+        await responder(
+            update,
+            "⚠️ No se encontraron estas optativas, revisa los nombres y envía la lista de nuevo:\n"
+            + "\n".join(f"• {n}" for n in no_encontradas)
+        )
+        return PREFERENCIA_LISTA
+
+    clave = tuple(context.user_data.pop("preferencias"))  # Tras un reinicio vuelve como lista
+    preferencias[clave] = elegidas
+    await guardar_preferencias()
+
+    await responder(
+        update,
+        "✅ Preferencias guardadas:\n" + "\n".join(f"{i}. {n}" for i, n in enumerate(elegidas, 1))
+    )
+    return ConversationHandler.END
+
+async def cancelar_preferencias_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    await query.message.delete()
+    await cola_envios.enviar(query.message.chat_id, "❎ Preferencias canceladas.")
+    context.user_data.pop("preferencias", None)
+    return ConversationHandler.END
+
 # end region
 # region Visualización de reseñas
 
 VER_RESEÑA_NOMBRE = range(20, 21)
+RESEÑAS_POR_PAGINA = 10
+MAX_LARGO_PAGINA = 3500
+
+# Páginas de reseñas ya escapadas por optativa, invalidadas por la versión del índice de reseñas
+paginas_resenas = VistaFragmento(fragmentos, "paginas_resenas")
 
 async def iniciar_ver_resenas(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await responder(
+        update,
         "📚 Escribe el *nombre exacto* de la optativa que quieres consultar:",
         parse_mode="Markdown",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❎ Cancelar", callback_data="cancelar_verresena")]])
@@ -477,34 +1180,104 @@ async def iniciar_ver_resenas(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def mostrar_resenas_optativa(update: Update, context: ContextTypes.DEFAULT_TYPE):
     nombre_opt = update.message.text.strip()
-    optativas = cargar_optativas()
-    reseñas = cargar_resenas()
-
-    optativa = next((o for o in optativas if o["nombre"].lower() == nombre_opt.lower()), None)
+    optativa = catalogo.buscar(nombre_opt)
 
     if not optativa:
-        await update.message.reply_text("❌ No se encontró la optativa.")
+        await responder(update, "❌ No se encontró la optativa.")
         return ConversationHandler.END
 
-    reseñas_opt = [r for r in reseñas if r["optativa"].lower() == nombre_opt.lower()]
-    mensaje = f"📘 *{optativa['nombre']}* — Profesor: {optativa['profesor']}\n\n"
+    texto, teclado = pagina_resenas(optativa, 0)
+    await responder(update, texto, parse_mode="Markdown", reply_markup=teclado)
+    return ConversationHandler.END
 
-    if not reseñas_opt:
-        mensaje += "No hay reseñas aún."
-    else:
-        for r in reseñas_opt:
-            usuario = escapar_markdown(r["usuario_telegram"])
-            comentario = escapar_markdown(r["comentario"])
-            mensaje += f"⭐ {r['puntuacion']}/5 — @{usuario}\n_{comentario}_\n\n"
+def texto_historico(historico):
+    return (
+        f"Semestres anteriores: {historico.promedio:.1f}/5 "
+        f"({historico.cantidad} reseña(s) en {len(historico.semestres)} semestre(s))"
+    )
 
-    await enviar_mensaje_largo(update, context, mensaje, parse_mode="Markdown")
-    return ConversationHandler.END
+def renderizar_paginas_resenas(optativa):
+    resumen = indice_resenas.resumen(optativa["nombre"])
+    encabezado = f"📘 *{optativa['nombre']}* — Profesor: {optativa['profesor']}\n"
+    if resumen.cantidad:
+        encabezado += f"⭐ Promedio: {resumen.promedio:.1f}/5 ({resumen.cantidad} reseña(s))\n"
+    historico = archivo_semestres.resumen(optativa["nombre"])
+    if historico:
+        encabezado += f"🗄️ {texto_historico(historico)}\n"
+    encabezado += "\n"
+
+    if not resumen.cantidad:
+        return [encabezado + "No hay reseñas aún."]
+
+    paginas = []
+    actual = []
+    largo = 0
+    for r in resumen.resenas.values():
+        usuario = escapar_markdown(r["usuario_telegram"])
+        comentario = escapar_markdown(r["comentario"])
+        entrada = f"⭐ {r['puntuacion']}/5 — @{usuario}\n_{comentario}_\n\n"
+        if actual and (len(actual) == RESEÑAS_POR_PAGINA or largo + len(entrada) > MAX_LARGO_PAGINA):
+            paginas.append("".join(actual))
+            actual = []
+            largo = 0
+        actual.append(entrada)
+        largo += len(entrada)
+    paginas.append("".join(actual))
+
+    if len(paginas) == 1:
+        return [encabezado + paginas[0]]
+    return [encabezado + pagina + f"📄 Página {i}/{len(paginas)}" for i, pagina in enumerate(paginas, 1)]
+
+# Clave corta de la optativa para el callback_data de los botones (límite de 64 bytes).
+# Sale del nombre, así que los botones siguen valiendo tras un reinicio y en cualquier fragmento.
+def clave_paginacion(nombre):
+    return hashlib.blake2s(nombre.encode("utf-8"), digest_size=8).hexdigest()
+
+def optativa_de_clave(clave):
+    return next((o for o in catalogo.como_lista() if clave_paginacion(o["nombre"]) == clave), None)
+
+# Devuelve el texto de la página y su teclado de navegación
+def pagina_resenas(optativa, numero):
+    nombre = optativa["nombre"]
+    version = (indice_resenas.resumen(nombre).version, archivo_semestres.version, optativa["profesor"])
+    paginas = obtener_cacheado(paginas_resenas, nombre, version, lambda: renderizar_paginas_resenas(optativa))
+    numero = max(0, min(numero, len(paginas) - 1))
+
+    if len(paginas) == 1:
+        return paginas[0], None
+
+    id_opt = clave_paginacion(nombre)
+
+    botones = []
+    if numero > 0:
+        botones.append(InlineKeyboardButton("◀️ Anterior", callback_data=f"vrev:{id_opt}:{numero - 1}"))
+    if numero < len(paginas) - 1:
+        botones.append(InlineKeyboardButton("Siguiente ▶️", callback_data=f"vrev:{id_opt}:{numero + 1}"))
+    return paginas[numero], InlineKeyboardMarkup([botones])
+
+async def paginar_resenas_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    _, id_opt, numero = query.data.split(":")
+    optativa = optativa_de_clave(id_opt)
+
+    if not optativa:
+        await query.answer("Esta consulta ya no está disponible, usa /vrev de nuevo.")
+        return
+
+    await query.answer()
+    texto, teclado = pagina_resenas(optativa, int(numero))
+    try:
+        await query.edit_message_text(texto, parse_mode="Markdown", reply_markup=teclado)
+    except BadRequest as e:
+        # Dos toques seguidos al mismo botón piden la página que ya se muestra
+        if "not modified" not in str(e).lower():
+            raise
 
 async def cancelar_verresena_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     await query.message.delete()
-    await context.bot.send_message(chat_id=query.message.chat_id, text="❎ Consulta cancelada.")
+    await cola_envios.enviar(query.message.chat_id, "❎ Consulta cancelada.")
     return ConversationHandler.END
 
 # end region
@@ -517,7 +1290,8 @@ CREAR_NOMBRE, CREAR_PROFESOR, CREAR_DESCRIPCION, CREAR_PLAZAS, CREAR_RELACIONADA
 
 # Función para iniciar la creación de optativa
 async def iniciar_crear_optativa(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await responder(
+        update,
         "📝 Vamos a crear una nueva optativa.\n\nPor favor, ingresa el nombre de la optativa:",
         reply_markup=cancelar_creacion_optativa_inline  # Usar el nuevo botón de cancelación
     )
@@ -527,29 +1301,25 @@ async def iniciar_crear_optativa(update: Update, context: ContextTypes.DEFAULT_T
 async def recibir_nombre_optativa(update: Update, context: ContextTypes.DEFAULT_TYPE):
     nombre = update.message.text.strip()
     
-    # Cargar optativas existentes
-    with open(OPTATIVAS_FILE, "r", encoding="utf-8") as f:
-        optativas = json.load(f)
-    
     # Verificar si ya existe una optativa con ese nombre
-    if any(optativa["nombre"].lower() == nombre.lower() for optativa in optativas):
-        await update.message.reply_text("⚠️ Ya existe una optativa con ese nombre. Por favor, elige uno diferente.")
+    if catalogo.buscar(nombre):
+        await responder(update, "⚠️ Ya existe una optativa con ese nombre. Por favor, elige uno diferente.")
         return CREAR_NOMBRE
 
     # Guardar nombre temporalmente
     context.user_data["optativa"] = {"nombre": nombre}
-    await update.message.reply_text("✏️ Ahora ingresa el nombre del profesor que impartirá la optativa:")
+    await responder(update, "✏️ Ahora ingresa el nombre del profesor que impartirá la optativa:")
     return CREAR_PROFESOR
 
 async def recibir_profesor_optativa(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['optativa']['profesor'] = update.message.text
-    await update.message.reply_text("✏️ Escribe una descripción para la optativa:")
+    await responder(update, "✏️ Escribe una descripción para la optativa:")
     return CREAR_DESCRIPCION
 
 async def recibir_descripcion_optativa(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto = update.message.text.strip()
     context.user_data["optativa"]["descripcion"] = texto  # Guardamos la descripción
-    await update.message.reply_text("🔢 Ingresa el número de plazas disponibles (puedes poner -1 para un número infinito):")
+    await responder(update, "🔢 Ingresa el número de plazas disponibles (puedes poner -1 para un número infinito):")
     return CREAR_PLAZAS  # Estado para recibir el número de plazas
 
 async def recibir_plazas_optativa(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -560,10 +1330,11 @@ async def recibir_plazas_optativa(update: Update, context: ContextTypes.DEFAULT_
             plazas = -1  # Capacidad ilimitada
         context.user_data["optativa"]["plazas"] = plazas
     except ValueError:
-        await update.message.reply_text("⚠️ Por favor, ingresa un número válido para las plazas.")
+        await responder(update, "⚠️ Por favor, ingresa un número válido para las plazas.")
         return CREAR_PLAZAS
 
-    await update.message.reply_text(
+    await responder(
+        update,
         "📘 Escribe las asignaturas relacionadas (una por línea).\n"
         "Si no hay ninguna, escribe un punto (`.`):",
         parse_mode="Markdown"
@@ -580,9 +1351,18 @@ async def recibir_relacionadas_optativa(update: Update, context: ContextTypes.DE
     context.user_data["optativa"]["relacionadas"] = relacionadas
 
     # Guardamos la nueva optativa
-    optativas = cargar_optativas()
-    optativas.append(context.user_data["optativa"])
-    guardar_optativas(optativas)
+    catalogo.agregar(context.user_data["optativa"])
+    await guardar_optativas(catalogo.como_lista())
+    reindexar_busqueda()
+    # El padrón puede tener ya estudiantes asignados a ese nombre (p. ej. subidos con estudiantes.json)
+    libro_plazas.fijar_capacidad(
+        context.user_data["optativa"]["nombre"], context.user_data["optativa"]["plazas"],
+        padron.cantidad_en(context.user_data["optativa"]["nombre"]),
+    )
+    # Quienes esperaban una optativa con este nombre ocupan las plazas nuevas
+    promovidos = promover_lista_espera(context.user_data["optativa"]["nombre"], [])
+    if promovidos:
+        await guardar_estudiantes(padron.como_lista())
 
     nombre = context.user_data["optativa"]["nombre"]
     profesor = context.user_data["optativa"]["profesor"]
@@ -598,14 +1378,15 @@ async def recibir_relacionadas_optativa(update: Update, context: ContextTypes.DE
     )
 
     usuario = context.user_data.get("usuario", "Desconocido")
-    registrar_operacion(usuario, f"ha creado la optativa: {nombre}")
+    await registrar_operacion(usuario, f"ha creado la optativa: {nombre}")
 
     if relacionadas:
         texto_resumen += "📘 Asignaturas relacionadas:\n" + "\n".join(f"• {a}" for a in relacionadas)
     else:
         texto_resumen += "📘 Asignaturas relacionadas: (ninguna)"
 
-    await update.message.reply_text(texto_resumen)
+    await responder(update, texto_resumen)
+    await notificar_promociones(update, context, promovidos)
     context.user_data.pop("optativa", None)
     return ConversationHandler.END
 
@@ -615,7 +1396,8 @@ async def recibir_relacionadas_optativa(update: Update, context: ContextTypes.DE
 ELIMINAR_OPTATIVAS = range(1)
 
 async def iniciar_eliminar_optativas(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await responder(
+        update,
         "🗑️ Envía los nombres de las optativas que deseas eliminar, uno por línea:",
         reply_markup=cancelar_inline
     )
@@ -625,76 +1407,84 @@ async def procesar_eliminar_optativas(update: Update, context: ContextTypes.DEFA
     texto = update.message.text.strip()
     nombres_a_eliminar = [line.strip() for line in texto.splitlines() if line.strip()]
 
-    optativas = cargar_optativas()
-    nombres_existentes = {opt["nombre"] for opt in optativas}
-
     if texto == "TODO":
-        guardar_optativas([])
-
-        estudiantes = cargar_estudiantes()
-        for est in estudiantes:
-            est["optativa"] = ""
-        guardar_estudiantes(estudiantes)
-
-        await update.message.reply_text("🗑️ Todas las optativas han sido eliminadas y los estudiantes desasignados.")
+        for opt in catalogo:
+            padron.desasignar_optativa(opt["nombre"])
+            lista_espera.descartar_optativa(opt["nombre"])
+        catalogo.vaciar()
+        libro_plazas.reconstruir(catalogo, padron)
+        reindexar_busqueda()
+        await guardar_optativas([])
+        await guardar_estudiantes(padron.como_lista())
+
+        await responder(update, "🗑️ Todas las optativas han sido eliminadas y los estudiantes desasignados.")
         return ConversationHandler.END
 
     eliminadas = []
     no_encontradas = []
 
+    desasignados = 0
+    fuera_de_espera = 0
+
     for nombre in nombres_a_eliminar:
-        if nombre in nombres_existentes:
-            optativas = [opt for opt in optativas if opt["nombre"] != nombre]
+        if catalogo.eliminar(nombre) is not None:
+            # El índice inverso da directamente los estudiantes afectados
+            desasignados += len(padron.desasignar_optativa(nombre))
+            fuera_de_espera += len(lista_espera.descartar_optativa(nombre))
+            libro_plazas.quitar(nombre)
             eliminadas.append(nombre)
         else:
             no_encontradas.append(nombre)
 
-    guardar_optativas(optativas)
+    await guardar_optativas(catalogo.como_lista())
+    if eliminadas:
+        reindexar_busqueda()
 
     usuario = context.user_data.get("usuario", "Desconocido")
-    registrar_operacion(usuario, f"ha eliminado las siguientes optativas: {', '.join(eliminadas)}")
+    await registrar_operacion(usuario, f"ha eliminado las siguientes optativas: {', '.join(eliminadas)}")
 
-    # Desasignar estudiantes que tenían alguna optativa eliminada
-    if eliminadas:
-        estudiantes = cargar_estudiantes()
-        for est in estudiantes:
-            if est["optativa"] in eliminadas:
-                est["optativa"] = ""
-        guardar_estudiantes(estudiantes)
+    if desasignados or fuera_de_espera:
+        await guardar_estudiantes(padron.como_lista())
 
     mensaje = ""
     if eliminadas:
         mensaje += "✅ Optativas eliminadas:\n" + "\n".join(f"• {n}" for n in eliminadas) + "\n"
+        if desasignados:
+            mensaje += f"👥 {desasignados} estudiante(s) desasignado(s).\n"
+        if fuera_de_espera:
+            mensaje += f"⏳ {fuera_de_espera} estudiante(s) retirado(s) de listas de espera.\n"
     if no_encontradas:
         mensaje += "\n⚠️ No se encontraron:\n" + "\n".join(f"• {n}" for n in no_encontradas)
 
     if not mensaje:
         mensaje = "⚠️ No se procesó ninguna entrada válida."
 
-    await update.message.reply_text(mensaje, reply_markup=menu_profesor)
+    await responder(update, mensaje, reply_markup=menu_profesor)
     return ConversationHandler.END
 
 
 # ---------- VISUALIZACIÓN DE OPTATIVAS ----------
 
-async def ver_optativas(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    optativas = cargar_optativas()
-
-    if not optativas:
-        await update.message.reply_text("📭 No hay optativas registradas.")
-        return
-
-    mensaje = "📚 *Listado de Optativas:*\n\n"
-    for i, opt in enumerate(optativas, 1):
+def renderizar_listado_optativas():
+    partes = ["📚 *Listado de Optativas:*\n\n"]
+    for i, opt in enumerate(catalogo, 1):
         plazas = "Ilimitadas" if opt.get("plazas") == -1 else opt.get("plazas")
-        mensaje += (
+        partes.append(
             f"🔹 *{i}. {opt.get('nombre')}*\n"
             f"   👨‍🏫 Profesor: {opt.get('profesor')}\n"
             f"   📝 Descripción: {opt.get('descripcion')}\n"
             f"   👥 Plazas: {plazas}\n\n"
         )
+    return "".join(partes)
 
-    await update.message.reply_text(mensaje, parse_mode="Markdown")
+async def ver_optativas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not len(catalogo):
+        await responder(update, "📭 No hay optativas registradas.")
+        return
+
+    # El listado solo muestra la capacidad, así que depende únicamente del catálogo
+    mensaje = obtener_cacheado(mensajes_catalogo, "listado", catalogo.version, renderizar_listado_optativas)
+    await responder(update, mensaje, parse_mode="Markdown")
 
 # end region
 # region Funciones de profesor
@@ -702,7 +1492,6 @@ async def ver_optativas(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def recibir_estudiantes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto = update.message.text
     lineas = texto.strip().split("\n")
-    estudiantes = cargar_estudiantes()
     nuevos = 0
     duplicados = []
     est_nuevos = []
@@ -714,43 +1503,44 @@ async def recibir_estudiantes(update: Update, context: ContextTypes.DEFAULT_TYPE
         nombre = " ".join(partes[:-1])
         grupo = partes[-1]
 
-        ya_existe = any(e["nombre"] == nombre and e["grupo"] == grupo for e in estudiantes)
-        if ya_existe:
+        if padron.agregar(nombre, grupo) is None:
             duplicados.append(f"{nombre} ({grupo})")
             continue
         else:
             est_nuevos.append(f"{nombre} ({grupo})")
 
-        estudiantes.append({"nombre": nombre, "grupo": grupo, "optativa": ""})
         nuevos += 1
 
-    guardar_estudiantes(estudiantes)
+    await guardar_estudiantes(padron.como_lista())
 
     usuario = context.user_data.get("usuario", "Desconocido")
-    registrar_operacion(usuario, f"ha agregado los siguientes estudiantes: {', '.join(est_nuevos)}")
+    await registrar_operacion(usuario, f"ha agregado los siguientes estudiantes: {', '.join(est_nuevos)}")
 
     respuesta = f"✅ {nuevos} estudiante(s) agregado(s).\n"
     if duplicados:
         respuesta += "\n⚠️ *No se agregaron por estar duplicados:*\n"
         respuesta += "\n".join(duplicados)
-    await update.message.reply_markdown(respuesta)
+    await responder(update, respuesta, parse_mode="Markdown")
     context.user_data.pop("estado", None)
     return ConversationHandler.END
 
 async def recibir_nombre_eliminar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto = update.message.text.strip()
     lineas = texto.split("\n")
-    estudiantes = cargar_estudiantes()
     elim = []
 
     if texto == "TODO":
-        guardar_estudiantes([])
-        await update.message.reply_text("🗑️ Todos los estudiantes han sido eliminados.")
+        padron.vaciar()
+        libro_plazas.reconstruir(catalogo, padron)
+        lista_espera.reconstruir(padron)
+        await guardar_estudiantes([])
+        await responder(update, "🗑️ Todos los estudiantes han sido eliminados.")
         context.user_data.pop("estado", None)
         return ConversationHandler.END
 
     no_encontrados = []
     eliminados = 0
+    promovidos = []
 
     for linea in lineas:
         partes = linea.strip().split()
@@ -760,25 +1550,23 @@ async def recibir_nombre_eliminar(update: Update, context: ContextTypes.DEFAULT_
         nombre = " ".join(partes[:-1])
         grupo = partes[-1]
 
-        original_len = len(estudiantes)
-        estudiantes = [e for e in estudiantes if not (e["nombre"] == nombre and e["grupo"] == grupo)]
-
-        if len(estudiantes) == original_len:
+        if eliminar_estudiante(nombre, grupo, promovidos) is None:
             no_encontrados.append(linea)
         else:
             eliminados += 1
             elim.append(f"{nombre} ({grupo})")
 
-    guardar_estudiantes(estudiantes)
+    await guardar_estudiantes(padron.como_lista())
 
     usuario = context.user_data.get("usuario", "Desconocido")
-    registrar_operacion(usuario, f"ha eliminado los siguientes estudiantes: {', '.join(elim)}")
+    await registrar_operacion(usuario, f"ha eliminado los siguientes estudiantes: {', '.join(elim)}")
 
     respuesta = f"✅ {eliminados} estudiante(s) eliminado(s).\n"
     if no_encontrados:
         respuesta += "\n⚠️ *Estudiantes no eliminados por error de escritura:*\n"
         respuesta += "\n".join(no_encontrados)
-    await update.message.reply_markdown(respuesta)
+    await responder(update, respuesta, parse_mode="Markdown")
+    await notificar_promociones(update, context, promovidos)
     context.user_data.pop("estado", None)
     return ConversationHandler.END
 
@@ -786,10 +1574,10 @@ async def recibir_asignar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto = update.message.text.strip()
     lineas = texto.split("\n")
 
-    estudiantes = cargar_estudiantes()
-    optativas = cargar_optativas()
     asignados = 0
     errores = []
+    en_espera = []
+    promovidos = []
 
     bloque_actual = []
     optativa_actual = None
@@ -801,7 +1589,7 @@ async def recibir_asignar(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if linea.startswith("-"):
             nombre_optativa = linea[1:].strip()
-            optativa = next((o for o in optativas if o["nombre"].lower() == nombre_optativa.lower()), None)
+            optativa = catalogo.buscar(nombre_optativa)
 
             if not optativa:
                 errores.append(f"❌ Optativa no encontrada: {nombre_optativa}")
@@ -819,29 +1607,24 @@ async def recibir_asignar(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 nombre = " ".join(est_partes[:-1])
                 grupo = est_partes[-1]
 
-                estudiante = next((e for e in estudiantes if e["nombre"] == nombre and e["grupo"] == grupo), None)
+                estudiante = padron.obtener(nombre, grupo)
                 if not estudiante:
                     errores.append(f"❌ Estudiante no encontrado: {nombre} ({grupo})")
                     continue
 
                 if estudiante["optativa"] == optativa["nombre"]:
                     continue  # Ya asignado a esta optativa
+                if not libro_plazas.hay_plaza(optativa["nombre"]) and (estudiante.get("espera") or {}).get("optativa") == optativa["nombre"]:
+                    continue  # Ya esperando esta optativa (sin perder su lugar en la lista)
+
+                # Sin plazas disponibles: el estudiante pasa a la lista de espera
+                if not libro_plazas.hay_plaza(optativa["nombre"]):
+                    cantidad = lista_espera.agregar(estudiante, optativa["nombre"])
+                    en_espera.append(f"⏳ {nombre} → {optativa['nombre']} ({cantidad} en espera)")
+                    continue
 
-                # Verificar plazas disponibles
-                if optativa["plazas"] != -1:
-                    asignados_actuales = sum(1 for e in estudiantes if e["optativa"] == optativa["nombre"])
-                    if asignados_actuales >= optativa["plazas"]:
-                        errores.append(f"🚫 Sin plazas: {nombre} → {optativa['nombre']}")
-                        continue
-                    optativa["plazas"] -= 1
-
-                # Liberar plaza de optativa anterior si corresponde
-                if estudiante["optativa"]:
-                    opt_anterior = next((o for o in optativas if o["nombre"] == estudiante["optativa"]), None)
-                    if opt_anterior and opt_anterior["plazas"] != -1:
-                        opt_anterior["plazas"] += 1
-
-                estudiante["optativa"] = optativa["nombre"]
+                # La plaza de la optativa anterior se libera y se ofrece a su lista de espera
+                asignar_estudiante(estudiante, optativa["nombre"], promovidos)
                 asignados += 1
 
             bloque_actual = []
@@ -849,22 +1632,142 @@ async def recibir_asignar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             bloque_actual.append(linea)
 
-    guardar_estudiantes(estudiantes)
-    guardar_optativas(optativas)
+    await guardar_estudiantes(padron.como_lista())
 
     respuesta = f"✅ {asignados} estudiante(s) asignado(s).\n"
+    if en_espera:
+        respuesta += "\n🚫 Sin plazas, agregados a la lista de espera:\n" + "\n".join(en_espera) + "\n"
     if errores:
         respuesta += "\n⚠️ Errores:\n" + "\n".join(errores)
-    await update.message.reply_text(respuesta)
+    await responder(update, respuesta)
+    await notificar_promociones(update, context, promovidos)
     context.user_data.pop("estado", None)
     return ConversationHandler.END
 
+async def recibir_ver_inscritos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    optativa = catalogo.buscar(update.message.text)
+    context.user_data.pop("estado", None)
+
+    if not optativa:
+        await responder(update, "❌ No se encontró la optativa.", reply_markup=menu_profesor)
+        return ConversationHandler.END
+
+    inscritos = padron.de_optativa(optativa["nombre"])
+    capacidad = libro_plazas.capacidad(optativa["nombre"])
+    capacidad_str = "ilimitadas" if capacidad == -1 else capacidad
+
+    mensaje = (
+        f"🎓 *{optativa['nombre']}* — {len(inscritos)} inscrito(s), plazas: {capacidad_str}, "
+        f"en espera: {lista_espera.en_espera(optativa['nombre'])}\n\n"
+    )
+    if inscritos:
+        for est in sorted(inscritos, key=lambda e: (e["grupo"], e["nombre"])):
+            mensaje += f"• {est['nombre']} ({est['grupo']})\n"
+    else:
+        mensaje += "(ningún estudiante inscrito)"
+    await enviar_mensaje_largo(update, context, mensaje, parse_mode="Markdown")
+    return ConversationHandler.END
+
+async def asignar_por_preferencias(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if cerrojo_asignacion.locked():
+        await responder(update, "⏳ Ya hay una asignación automática en curso, espera a que termine.")
+        return
+    async with cerrojo_asignacion:
+        await ejecutar_asignacion(update, context)
+
+async def ejecutar_asignacion(update, context):
+    participantes = {}
+    actuales = {}
+    liberadas = {}
+    for clave, lista in preferencias.items():
+        est = padron.obtener(*clave)
+        if not est:
+            continue
+        lista = [n for n in lista if n in catalogo]
+        # Quien ya tiene optativa la conserva como última opción: el solver nunca lo deja sin plaza
+        if est["optativa"]:
+            actuales[clave] = est["optativa"]
+            liberadas[est["optativa"]] = liberadas.get(est["optativa"], 0) + 1
+            if est["optativa"] not in lista:
+                lista.append(est["optativa"])
+        participantes[clave] = lista
+
+    if not participantes:
+        await responder(update, "📭 No hay preferencias registradas de estudiantes existentes.")
+        return
+
+    libres = {}
+    for opt in catalogo:
+        nombre = opt["nombre"]
+        disponibles = libro_plazas.disponibles(nombre)
+        libres[nombre] = -1 if disponibles == -1 else disponibles + liberadas.get(nombre, 0)
+
+    resultado = await asyncio.to_thread(resolver_asignacion, participantes, libres, actuales)
+
+    # Mientras se resolvía pudieron atenderse otros updates (bajas, asignaciones manuales,
+    # promociones): solo se cambia a quien sigue donde estaba y hacia optativas que existen.
+    # Ninguna plaza se libera por adelantado: cada estudiante deja la suya al pasar a la nueva.
+    cambios = {}
+    for clave, optativa in resultado.items():
+        est = padron.obtener(*clave)
+        if est and optativa and optativa in catalogo and est["optativa"] == actuales.get(clave, "") != optativa:
+            cambios[clave] = (est, optativa)
+
+    # Los cambios se aplican de una vez (sin awaits de por medio), así que basta con que
+    # quepan al final. Si alguna optativa perdió plazas mientras tanto, se deshacen sus
+    # últimos cambios hasta que quepan: el estudiante se queda donde estaba.
+    while True:
+        saldo = {}
+        for est, optativa in cambios.values():
+            saldo[optativa] = saldo.get(optativa, 0) + 1
+            if est["optativa"]:
+                saldo[est["optativa"]] = saldo.get(est["optativa"], 0) - 1
+        excedidas = [
+            optativa for optativa, llegan in saldo.items()
+            if llegan > 0 and libro_plazas.disponibles(optativa) != -1 and llegan > libro_plazas.disponibles(optativa)
+        ]
+        if not excedidas:
+            break
+        for optativa in excedidas:
+            clave = next(c for c in reversed(cambios) if cambios[c][1] == optativa)
+            del cambios[clave]
+    for est, optativa in cambios.values():
+        asignar_estudiante(est, optativa)
+
+    por_opcion = {}
+    sin_plaza = []
+    for clave in resultado:
+        est = padron.obtener(*clave)
+        if est and est["optativa"] in participantes[clave]:
+            posicion = participantes[clave].index(est["optativa"]) + 1
+            por_opcion[posicion] = por_opcion.get(posicion, 0) + 1
+        elif est and not est["optativa"]:
+            sin_plaza.append(f"{clave[0]} ({clave[1]})")
+
+    # Las plazas que hayan quedado libres se ofrecen a las listas de espera
+    promovidos = []
+    for optativa in lista_espera.optativas():
+        promover_lista_espera(optativa, promovidos)
+
+    await guardar_estudiantes(padron.como_lista())
+
+    usuario = context.user_data.get("usuario", "Desconocido")
+    await registrar_operacion(usuario, f"ha ejecutado la asignación automática de {len(participantes)} estudiantes")
+
+    respuesta = f"🧮 Asignación automática de {len(participantes)} estudiante(s):\n"
+    for posicion in sorted(por_opcion):
+        respuesta += f"• {posicion}ª opción: {por_opcion[posicion]}\n"
+    if sin_plaza:
+        respuesta += f"\n🚫 Sin plaza ({len(sin_plaza)}):\n" + "\n".join(sin_plaza)
+    await enviar_mensaje_largo(update, context, respuesta)
+    await notificar_promociones(update, context, promovidos)
+
 async def ver_profesores(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    profesores = cargar_profesores()
+    profesores = await cargar_profesores()
     profesores = [p for p in profesores if p["usuario"] != "admin"]
 
     if not profesores:
-        await update.message.reply_text("📭 No hay profesores registrados.")
+        await responder(update, "📭 No hay profesores registrados.")
         return
 
     mensaje = "👨‍🏫 *Lista de profesores:*\n\n"
@@ -874,12 +1777,12 @@ async def ver_profesores(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def recibir_agregar_profesores(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get("usuario") != "superadmin":
-        await update.message.reply_text("❌ Solo el superadmin puede agregar profesores.")
+        await responder(update, "❌ Solo el superadmin puede agregar profesores.")
         return ConversationHandler.END
 
     texto = update.message.text.strip()
     lineas = texto.split("\n")
-    profesores = cargar_profesores()
+    profesores = await cargar_profesores()
     nuevos = 0
     duplicados = []
 
@@ -898,26 +1801,27 @@ async def recibir_agregar_profesores(update: Update, context: ContextTypes.DEFAU
         profesores.append({"usuario": usuario, "clave": clave, "nombre": nombre})
         nuevos += 1
 
-    guardar_profesores(profesores)
+    await guardar_profesores(profesores)
 
     respuesta = f"✅ {nuevos} profesor(es) agregado(s).\n"
     if duplicados:
         respuesta += "\n⚠️ Usuarios duplicados (no agregados):\n" + "\n".join(duplicados)
-    await update.message.reply_markdown(respuesta)
+    await responder(update, respuesta, parse_mode="Markdown")
     context.user_data.pop("estado", None)
     return ConversationHandler.END
 
 async def recibir_eliminar_profesores(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get("usuario") != "superadmin":
-        await update.message.reply_text("❌ Solo el superadmin puede eliminar profesores.")
+        await responder(update, "❌ Solo el superadmin puede eliminar profesores.")
         return ConversationHandler.END
 
     texto = update.message.text.strip()
     lineas = texto.split("\n")
-    profesores = cargar_profesores()
+    profesores = await cargar_profesores()
     eliminados = 0
     no_encontrados = []
 
+    quitados = set()
     for usuario in lineas:
         usuario = usuario.strip()
         if usuario == "admin":
@@ -928,13 +1832,18 @@ async def recibir_eliminar_profesores(update: Update, context: ContextTypes.DEFA
             no_encontrados.append(usuario)
         else:
             eliminados += 1
+            quitados.add(usuario)
 
-    guardar_profesores(profesores)
+    await guardar_profesores(profesores)
+    # Los eliminados pierden la sesión que tuvieran abierta
+    for user_id, datos in list(context.application.user_data.items()):
+        if datos.get("sesion") and datos.get("usuario") in quitados:
+            cerrar_sesion(context.application, user_id)
 
     respuesta = f"✅ {eliminados} profesor(es) eliminado(s).\n"
     if no_encontrados:
         respuesta += "\n⚠️ No encontrados:\n" + "\n".join(no_encontrados)
-    await update.message.reply_markdown(respuesta)
+    await responder(update, respuesta, parse_mode="Markdown")
     context.user_data.pop("estado", None)
     return ConversationHandler.END
 
@@ -952,6 +1861,8 @@ async def manejar_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return await recibir_nombre_eliminar(update, context)
         elif estado == "esperando_asignar":
             return await recibir_asignar(update, context)
+        elif estado == "esperando_inscritos":
+            return await recibir_ver_inscritos(update, context)
         elif estado == "esperando_agregar_profesores":
             return await recibir_agregar_profesores(update, context)
         elif estado == "esperando_eliminar_profesores":
@@ -959,27 +1870,22 @@ async def manejar_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # ---------- PROFESOR EN MENÚ ----------
         if texto == "👥 Ver estudiantes":
-            estudiantes = cargar_estudiantes()
-            if not estudiantes:
-                await update.message.reply_text("📂 Lista vacía.")
+            if not len(padron):
+                await responder(update, "📂 Lista vacía.")
                 return
 
-            grupos = {}
-            for est in estudiantes:
-                grupo = est["grupo"]
-                grupos.setdefault(grupo, []).append(est)
-
             respuesta = "👥 *Estudiantes por grupo:*\n\n"
-            for grupo in sorted(grupos.keys()):
+            for grupo in sorted(padron.grupos()):
                 respuesta += f"*Grupo {grupo}:*\n"
-                for est in grupos[grupo]:
+                for est in padron.de_grupo(grupo):
                     opt = est["optativa"] if est["optativa"] else "Ninguna"
                     respuesta += f"• {est['nombre']} - Optativa: {opt}\n"
                 respuesta += "\n"
-            await update.message.reply_markdown(respuesta)
+            await responder(update, respuesta, parse_mode="Markdown")
 
         elif texto == "➕ Agregar estudiantes":
-            await update.message.reply_text(
+            await responder(
+                update,
                 "📨 Envía los estudiantes en el formato:\n\n`Nombre Apellido1 Apellido2 Grupo`\nUno por línea.",
                 parse_mode="Markdown",
                 reply_markup=cancelar_inline
@@ -987,33 +1893,47 @@ async def manejar_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data["estado"] = "esperando_estudiantes"
 
         elif texto == "❌ Eliminar estudiante":
-            await update.message.reply_text(
+            await responder(
+                update,
                 "✂️ Escribe los estudiantes a eliminar en el formato:\n\n`Nombre Apellido1 Apellido2 Grupo`\nUno por línea.:",
                 reply_markup=cancelar_inline
             )
             context.user_data["estado"] = "esperando_eliminar"
 
         elif texto == "📌 Asignar optativa":
-            await update.message.reply_text(
+            await responder(
+                update,
                 "📥 Envía los estudiantes a asignar en el formato:\n\n`Nombre Apellido1 Apellido2 Grupo\nNombre Apellido1 Apellido2 Grupo\n...\n-Optativa`\n",
                 parse_mode="Markdown",
                 reply_markup=cancelar_inline
             )
             context.user_data["estado"] = "esperando_asignar"
 
+        elif texto == "🧮 Asignación automática":
+            return await asignar_por_preferencias(update, context)
+
+        elif texto == "🎓 Ver inscritos":
+            await responder(
+                update,
+                "🎓 Escribe el nombre de la optativa para ver sus estudiantes inscritos:",
+                reply_markup=cancelar_inline
+            )
+            context.user_data["estado"] = "esperando_inscritos"
+
         elif texto == "🔓 Cerrar sesión":
             usuarios_logueados.discard(user_id)
             context.user_data.clear()
-            await update.message.reply_text("👋 Sesión cerrada.", reply_markup=ReplyKeyboardRemove())
+            await responder(update, "👋 Sesión cerrada.", reply_markup=ReplyKeyboardRemove())
 
         elif texto == "👨‍🏫 Ver profesores":
             return await ver_profesores(update, context)
 
         elif texto == "➕ Agregar profesores":
             if context.user_data.get("usuario") != "superadmin":
-                await update.message.reply_text("❌ Solo el superadmin puede agregar profesores.")
+                await responder(update, "❌ Solo el superadmin puede agregar profesores.")
                 return
-            await update.message.reply_text(
+            await responder(
+                update,
                 "📨 Envía los profesores en el formato:\n\n`usuario clave Nombre Apellido`",
                 parse_mode="Markdown",
                 reply_markup=cancelar_inline
@@ -1022,9 +1942,10 @@ async def manejar_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         elif texto == "❌ Eliminar profesores":
             if context.user_data.get("usuario") != "superadmin":
-                await update.message.reply_text("❌ Solo el superadmin puede eliminar profesores.")
+                await responder(update, "❌ Solo el superadmin puede eliminar profesores.")
                 return
-            await update.message.reply_text(
+            await responder(
+                update,
                 "🗑️ Escribe los usuarios de los profesores a eliminar, uno por línea.",
                 reply_markup=cancelar_inline
             )
@@ -1057,19 +1978,117 @@ async def manejar_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
             mensaje += f"• *{c['nombre']}* — {c.get('descripcion', '')}\n"
         await enviar_mensaje_largo(update, context, mensaje, parse_mode="Markdown")
 
+# end region
+# region Ciclo de vida de la aplicación
+
+# Se llama tras conectar con Telegram y justo antes de empezar el polling: lo que
+# no hace falta para atender el primer update se lanza en segundo plano
+async def post_init(app):
+    global cola_envios
+    marcar_arranque("conexión con Telegram y sesiones")
+    # Los profesores que tenían sesión antes del reinicio no tienen que volver a entrar,
+    # salvo que se los haya eliminado de profesores.json mientras tanto
+    vigentes = {p["usuario"] for p in await cargar_profesores()} | {"superadmin"}
+    for user_id, datos in app.user_data.items():
+        if datos.get("sesion"):
+            if datos.get("usuario") in vigentes:
+                usuarios_logueados.add(user_id)
+            else:
+                cerrar_sesion(app, user_id)
+    cola_envios = ColaEnvios(app.bot, LIMITE_MENSAJES_GLOBAL, LIMITE_MENSAJES_CHAT)
+    await cola_envios.iniciar()
+    await monitor_bucle.iniciar()
+    await metricas.iniciar()
+    await fragmentos.iniciar()
+    lanzar_en_fondo(preparar_busqueda(fragmentos.principal))
+    lanzar_en_fondo(publicar_comandos(app.bot))
+    marcar_arranque("servicios")
+    print("⏱️ " + resumen_arranque())
+
+async def publicar_comandos(bot):
+    try:
+        await bot.set_my_commands([
+            BotCommand("login", "Iniciar sesión como profesor"),
+            BotCommand("rev", "Dejar una reseña sobre tu optativa"),
+            BotCommand("vrev", "Ver reseñas de una optativa"),
+            BotCommand("pref", "Indicar tus optativas preferidas"),
+            BotCommand("start", "Ver optativas disponibles"),
+            BotCommand("log", "Enviar el registro de operaciones"),
+            BotCommand("exportar", "Descargar el padrón en CSV o TSV (profesores)"),
+            BotCommand("facultad", "Ver o cambiar la facultad o semestre"),
+            BotCommand("stats", "Estadísticas de uso del bot (profesores)"),
+            BotCommand("help", "Ayuda para principiantes"),
+            BotCommand("delrev", "Eliminar todas las reseñas (solo superadmin)"),
+            BotCommand("archivar", "Archivar el semestre actual (solo superadmin)"),
+            BotCommand("lag", "Ver el retraso del bot (solo superadmin)"),
+            BotCommand("perfil", "Perfilar el bot (solo superadmin)")
+        ])
+    except Exception as e:
+        print("⚠️ No se pudo publicar la lista de comandos:", e)
+
+async def post_shutdown(app):
+    await fragmentos.detener()
+    await monitor_bucle.detener()
+    await metricas.detener()
+    if grabador is not None:
+        await grabador.volcar()
+        print(f"🎙️ Tráfico grabado: {grabador.grabados} updates en {grabador.ruta}")
+    if cola_envios is not None:
+        est = cola_envios.estadisticas
+        print(f"📤 Cola de envíos: {est['enviados']} enviados, {est['fusionados']} fusionados, {est['reintentos']} reintentos, {cola_envios.profundidad()} pendientes")
+        descartados = await cola_envios.detener(plazo=PLAZO_VACIAR_COLA)
+        if descartados:
+            print(f"⚠️ Cola de envíos: {descartados} mensajes descartados al cerrar")
+    # Las escrituras pendientes terminan antes de salir
+    await asyncio.to_thread(almacen.cerrar)
+
 # end region
 # region Manejo de consultas
 
+def renderizar_tarjeta(opt):
+    disponibles = libro_plazas.disponibles(opt["nombre"])
+    plazas_opt = "Ilimitadas" if disponibles == -1 else disponibles
+    relacionadas = opt.get("relacionadas", [])
+    relacionadas_str = "\n    - " + "\n    - ".join(relacionadas) if relacionadas else "    (ninguna)"
+
+    # Agregados de reseñas mantenidos por el índice
+    resumen = indice_resenas.resumen(opt["nombre"])
+    mejor = resumen.mejor()
+    peor = resumen.peor()
+    historico = archivo_semestres.resumen(opt["nombre"])
+
+    mejor_txt = f"⭐ Mejor reseña ({mejor['puntuacion']}/5):\n  _{escapar_markdown(mejor['comentario'])}_ — @{escapar_markdown(mejor['usuario_telegram'])}" if mejor else "⭐ Mejor reseña: (ninguna)"
+    peor_txt = f"😕 Peor reseña ({peor['puntuacion']}/5):\n  _{escapar_markdown(peor['comentario'])}_ — @{escapar_markdown(peor['usuario_telegram'])}" if peor else "😕 Peor reseña: (ninguna)"
+
+    return (
+        f"• *{opt['nombre']}*\n"
+        f"  👨‍🏫 Profesor: {opt['profesor']}\n"
+        f"  📝 {opt.get('descripcion', 'Sin descripción')}\n"
+        f"  👥 Plazas disponibles: {plazas_opt}\n"
+        f"  📘 Asignaturas relacionadas:\n{relacionadas_str}\n"
+        f"  {mejor_txt}\n"
+        f"  {peor_txt}"
+        + (f"\n  🗄️ {texto_historico(historico)}" if historico else "")
+    )
+
+# La tarjeta cambia solo si cambia la optativa, sus plazas libres o sus reseñas
+def tarjeta_optativa(opt):
+    nombre = opt["nombre"]
+    version = (
+        catalogo.version_de(nombre), libro_plazas.disponibles(nombre),
+        indice_resenas.resumen(nombre).version, archivo_semestres.version,
+    )
+    return obtener_cacheado(tarjetas_optativas, nombre, version, lambda: renderizar_tarjeta(opt))
+
 async def consulta_estudiante(update: Update, context: ContextTypes.DEFAULT_TYPE):
     texto = update.message.text.strip().lower()
-    profesores = cargar_profesores()
-    resenas = cargar_resenas()
+    profesores = await cargar_profesores()
 
     # Buscar si corresponde a un profesor
     for prof in profesores:
         if prof["nombre"].lower() == texto:
             usuario = prof["usuario"]
-            optativas = [opt for opt in cargar_optativas() if opt["profesor"] == prof["nombre"]]
+            optativas = [opt for opt in catalogo if opt["profesor"] == prof["nombre"]]
 
             mensaje = f"👨‍🏫 *Usuario:* `{usuario}`\n📚 *Optativas que imparte:*"
             if optativas:
@@ -1080,74 +2099,104 @@ async def consulta_estudiante(update: Update, context: ContextTypes.DEFAULT_TYPE
             await enviar_mensaje_largo(update, context, mensaje, parse_mode="Markdown")
             return
 
-    # Si no es profesor, buscar por modelo vectorial
-    ruta_script = os.path.join(os.path.dirname(__file__), "search_engine.py")
-
-    resultado = subprocess.run(
-        ["python", ruta_script, texto],
-        capture_output=True,
-        text=True,
-        encoding="utf-8"
-    )
-
+    # Si no es profesor, buscar por modelo vectorial (índice precalculado de catálogo y reseñas)
     try:
-        optativas = json.loads(resultado.stdout)
+        await busqueda_lista.wait()  # Solo espera durante el primer segundo tras arrancar
+        optativas = indice_busqueda.buscar(texto)
         if not optativas:
-            await update.message.reply_text("🔍 No se encontraron optativas relacionadas.")
+            await responder(update, "🔍 No se encontraron optativas relacionadas.")
             return
 
-        await update.message.reply_markdown("🔍 *Resultados más relevantes:*\n")
-
-        for opt in optativas:
-            plazas = "Ilimitadas" if opt.get("plazas") == -1 else opt.get("plazas", "No disponible")
-            relacionadas = opt.get("relacionadas", [])
-            relacionadas_str = "\n    - " + "\n    - ".join(relacionadas) if relacionadas else "    (ninguna)"
-
-            # Filtrar reseñas para esta optativa
-            resenas_opt = [r for r in resenas if r["optativa"] == opt["nombre"]]
-            mejor = max(resenas_opt, key=lambda r: r["puntuacion"], default=None)
-            peor = min(resenas_opt, key=lambda r: r["puntuacion"], default=None)
-
-            mejor_txt = f"⭐ Mejor reseña ({mejor['puntuacion']}/5):\n  _{mejor['comentario']}_ — @{escapar_markdown(mejor['usuario_telegram'])}" if mejor else "⭐ Mejor reseña: (ninguna)"
-            peor_txt = f"😕 Peor reseña ({peor['puntuacion']}/5):\n  _{peor['comentario']}_ — @{escapar_markdown(peor['usuario_telegram'])}" if peor else "😕 Peor reseña: (ninguna)"
-
-            mensaje_opt = (
-                f"• *{opt['nombre']}*\n"
-                f"  👨‍🏫 Profesor: {opt['profesor']}\n"
-                f"  📝 {opt.get('descripcion', 'Sin descripción')}\n"
-                f"  👥 Plazas disponibles: {plazas}\n"
-                f"  📘 Asignaturas relacionadas:\n{relacionadas_str}\n"
-                f"  {mejor_txt}\n"
-                f"  {peor_txt}"
-            )
-
-            await enviar_mensaje_largo(update, context, mensaje_opt, parse_mode="Markdown")
+        # Encabezado y tarjetas salen por la cola, que los agrupa en la menor cantidad de mensajes
+        textos = ["🔍 *Resultados más relevantes:*\n"] + [tarjeta_optativa(opt) for opt in optativas]
+        await enviar_en_cola(update, textos, parse_mode="Markdown")
 
 
 
     except Exception as e:
-        await update.message.reply_text("❌ Error procesando la consulta.")
+        await responder(update, "❌ Error procesando la consulta.")
         print("Error:", e)
 
 async def enviar_log(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id not in usuarios_logueados:
-        await update.message.reply_text("❌ Este comando es solo para profesores.")
+        await responder(update, "❌ Este comando es solo para profesores.")
         return
 
-    if not os.path.exists(LOG_PATH):
-        await update.message.reply_text("📭 El registro de operaciones aún no existe.")
+    contenido = await almacen.leer_bytes(LOG_PATH)
+    if contenido is None:
+        await responder(update, "📭 El registro de operaciones aún no existe.")
         return
 
     try:
         await context.bot.send_document(
             chat_id=update.effective_chat.id,
-            document=open(LOG_PATH, "rb"),
+            document=contenido,
             filename="registro_operaciones.txt",
             caption="📄 Aquí tienes el registro de operaciones más reciente."
         )
     except Exception as e:
-        await update.message.reply_text(f"❌ Error al enviar el archivo: {str(e)}")
+        await responder(update, f"❌ Error al enviar el archivo: {str(e)}")
+
+def filas_padron(estudiantes):
+    for est in sorted(estudiantes, key=lambda e: (e["grupo"], e["nombre"])):
+        yield est["nombre"], est["grupo"], est["optativa"], (est.get("espera") or {}).get("optativa", "")
+
+async def exportar_padron(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in usuarios_logueados:
+        await responder(update, "❌ Este comando es solo para profesores.")
+        return
+
+    formato = context.args[0].lower() if context.args else "csv"
+    if formato not in ("csv", "tsv"):
+        await responder(update, "⚠️ Uso: /exportar [csv|tsv]")
+        return
+
+    # Solo se copian las referencias; las filas se generan a medida que se escriben, en el hilo del almacén
+    estudiantes = padron.como_lista()
+    contenido = await almacen.ejecutar(escribir_planilla, filas_padron(estudiantes), "\t" if formato == "tsv" else ",")
+
+    try:
+        await context.bot.send_document(
+            chat_id=update.effective_chat.id,
+            document=contenido,
+            filename=f"padron_{datetime.now().strftime('%Y%m%d_%H%M')}.{formato}",
+            caption=f"📤 Padrón con {len(estudiantes)} estudiante(s) y sus asignaciones."
+        )
+    except Exception as e:
+        await responder(update, f"❌ Error al enviar el archivo: {str(e)}")
+
+
+# ---------- FACULTAD / SEMESTRE ----------
+async def elegir_fragmento(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    actual = context.user_data.get("fragmento", NOMBRE_PRINCIPAL)
+    if not context.args:
+        lineas = [f"{'👉' if nombre == actual else '•'} {nombre}" for nombre in await fragmentos.disponibles()]
+        await responder(
+            update,
+            "🗂️ Facultades y semestres:\n" + "\n".join(lineas) + "\n\nUsa /facultad <nombre> para cambiar."
+        )
+        return
+
+    nombre = context.args[0].strip()
+    if not await fragmentos.existe(nombre):
+        if update.effective_user.id not in usuarios_logueados or context.user_data.get("usuario") != "superadmin":
+            await responder(update, f"❌ No existe '{nombre}'. Usa /facultad para ver la lista.")
+            return
+        try:
+            await fragmentos.crear(nombre)
+        except ValueError as e:
+            await responder(update, f"❌ {e}")
+            return
+        await registrar_operacion("superadmin", f"creó la facultad o semestre '{nombre}'")
+        await responder(update, f"🆕 Se creó '{nombre}' sin datos. Sube sus archivos de estudiantes y optativas.")
+
+    # Vale desde el próximo mensaje: este update ya se está procesando con el fragmento anterior
+    if nombre == NOMBRE_PRINCIPAL:
+        context.user_data.pop("fragmento", None)
+    else:
+        context.user_data["fragmento"] = nombre
+    await responder(update, f"✅ Ahora trabajas con '{nombre}'.")
 
 
 # end region
@@ -1159,7 +2208,9 @@ login_conv = ConversationHandler(
         LOGIN_USUARIO: [MessageHandler(filters.TEXT & ~filters.COMMAND, recibir_usuario)],
         LOGIN_CLAVE: [MessageHandler(filters.TEXT & ~filters.COMMAND, recibir_clave)],
     },
-    fallbacks=[]
+    fallbacks=[],
+    name="login",
+    persistent=True
 )
 
 crear_optativa_handler = ConversationHandler(
@@ -1171,7 +2222,9 @@ crear_optativa_handler = ConversationHandler(
         CREAR_PLAZAS: [MessageHandler(filters.TEXT & ~filters.COMMAND, recibir_plazas_optativa)],
         CREAR_RELACIONADAS: [MessageHandler(filters.TEXT & ~filters.COMMAND, recibir_relacionadas_optativa)],
     },
-    fallbacks=[CallbackQueryHandler(cancelar_creacion_optativa_callback, pattern="^cancelar_creacion_optativa$")]
+    fallbacks=[CallbackQueryHandler(cancelar_creacion_optativa_callback, pattern="^cancelar_creacion_optativa$")],
+    name="crear_optativa",
+    persistent=True
 )
 
 eliminar_optativas_handler = ConversationHandler(
@@ -1179,7 +2232,9 @@ eliminar_optativas_handler = ConversationHandler(
     states={
         ELIMINAR_OPTATIVAS: [MessageHandler(filters.TEXT & ~filters.COMMAND, procesar_eliminar_optativas)],
     },
-    fallbacks=[CallbackQueryHandler(cancelar_callback, pattern="^cancelar$")]
+    fallbacks=[CallbackQueryHandler(cancelar_callback, pattern="^cancelar$")],
+    name="eliminar_optativas",
+    persistent=True
 )
 
 resena_handler = ConversationHandler(
@@ -1189,7 +2244,20 @@ resena_handler = ConversationHandler(
         RESEÑA_COMENTARIO: [MessageHandler(filters.TEXT & ~filters.COMMAND, recibir_comentario_resena)],
         RESEÑA_PUNTUACION: [MessageHandler(filters.TEXT & ~filters.COMMAND, recibir_puntuacion_resena)],
     },
-    fallbacks=[CallbackQueryHandler(cancelar_resena_callback, pattern="^cancelar_resena$")]
+    fallbacks=[CallbackQueryHandler(cancelar_resena_callback, pattern="^cancelar_resena$")],
+    name="resena",
+    persistent=True
+)
+
+preferencias_handler = ConversationHandler(
+    entry_points=[CommandHandler("pref", iniciar_preferencias)],
+    states={
+        PREFERENCIA_IDENTIFICACION: [MessageHandler(filters.TEXT & ~filters.COMMAND, recibir_identificacion_preferencias)],
+        PREFERENCIA_LISTA: [MessageHandler(filters.TEXT & ~filters.COMMAND, recibir_lista_preferencias)],
+    },
+    fallbacks=[CallbackQueryHandler(cancelar_preferencias_callback, pattern="^cancelar_preferencias$")],
+    name="preferencias",
+    persistent=True
 )
 
 ver_reseñas_handler = ConversationHandler(
@@ -1197,31 +2265,87 @@ ver_reseñas_handler = ConversationHandler(
     states={
         VER_RESEÑA_NOMBRE: [MessageHandler(filters.TEXT & ~filters.COMMAND, mostrar_resenas_optativa)]
     },
-    fallbacks=[CallbackQueryHandler(cancelar_verresena_callback, pattern="^cancelar_verresena$")]
+    fallbacks=[CallbackQueryHandler(cancelar_verresena_callback, pattern="^cancelar_verresena$")],
+    name="ver_resenas",
+    persistent=True
 )
 
 # end region
-# region Ejecución principal
+# region Grabación de tráfico
+
+# Fragmento de datos que eligió el usuario con /facultad (None para el principal)
+# /facultad se procesa siempre con el principal: solo cambia la elección del usuario
+# y es la salida si su fragmento no se puede cargar.
+def fragmento_elegido(app, update):
+    usuario = update.effective_user if isinstance(update, Update) else None
+    datos = app.user_data.get(usuario.id) if usuario else None
+    if not datos or es_comando(update, "facultad"):
+        return None
+    return datos.get("fragmento")
+
+def es_comando(update, comando):
+    texto = update.message.text if update.message and update.message.text else ""
+    return texto.split("@", 1)[0].split(maxsplit=1)[:1] == [f"/{comando}"]
+
+# El fragmento del usuario no se pudo cargar: el update no se procesa con ningún otro
+async def avisar_fragmento_no_disponible(update, error):
+    if not isinstance(error, FragmentoNoDisponible):
+        raise error
+    print("⚠️", error)
+    if update.effective_chat:
+        await cola_envios.enviar(
+            update.effective_chat.id,
+            f"⚠️ {error}\nNo se hizo ningún cambio. Intenta más tarde o cambia de facultad con /facultad.",
+        )
 
-if __name__ == "__main__":
+def rol_usuario(app, user_id):
+    if user_id not in usuarios_logueados:
+        return None
+    return "superadmin" if app.user_data.get(user_id, {}).get("usuario") == "superadmin" else "profesor"
+
+# True si el próximo mensaje del usuario puede llevar una contraseña (login o alta de profesores)
+def esperando_credenciales(app, user_id):
+    datos = app.user_data.get(user_id) or {}
+    return bool(datos.get("credenciales")) or datos.get("estado") == "esperando_agregar_profesores"
+
+def iniciar_grabacion(app, ruta):
+    global grabador
+    textos_fijos = [boton.text for fila in menu_profesor.keyboard for boton in fila]
+    grabador = GrabadorUpdates(
+        ruta, catalogo, padron, textos_fijos, lambda uid: rol_usuario(app, uid), almacen,
+        credenciales=lambda uid: esperando_credenciales(app, uid),
+    )
 
-    # Obteniendo TOKEN del bot
-    parser = argparse.ArgumentParser(description="Iniciar el bot de optativas")
-    parser.add_argument("token", help="Token del bot de Telegram")
-    args = parser.parse_args()
+def grabar_update(update, llegada):
+    grabador.registrar(update, llegada)
+    if grabador.necesita_volcar():
+        lanzar_en_fondo(grabador.volcar())
 
-    # Construcción de la app mediante el token
-    app = ApplicationBuilder().token(args.token).build()
-
-    app.bot.set_my_commands([
-        BotCommand("login", "Iniciar sesión como profesor"),
-        BotCommand("rev", "Dejar una reseña sobre tu optativa"),
-        BotCommand("vrev", "Ver reseñas de una optativa"),
-        BotCommand("start", "Ver optativas disponibles"),
-        BotCommand("log", "Enviar el registro de operaciones"),
-        BotCommand("help", "Ayuda para principiantes"),
-        BotCommand("delrev", "Eliminar todas las reseñas (solo superadmin)")
-    ])
+# end region
+# region Construcción de la aplicación
+
+# Construye la aplicación con todos los handlers registrados. 'solicitud' permite
+# sustituir la conexión con la API de Telegram (por ejemplo, en load_test.py).
+def construir_aplicacion(token, solicitud=None, ruta_grabacion=None):
+    procesador = ProcesadorPorChat(
+        TRABAJADORES_CONCURRENTES,
+        al_recibir=grabar_update if ruta_grabacion else None,
+        contexto=lambda update: fragmentos.usar(fragmento_elegido(app, update)),
+        sin_contexto=avisar_fragmento_no_disponible,
+    )
+    constructor = (
+        ApplicationBuilder()
+        .token(token)
+        .concurrent_updates(procesador)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .persistence(PersistenciaSesiones(SESIONES_FILE, SESIONES_DIARIO_FILE, almacen, INTERVALO_SESIONES))
+    )
+    if solicitud is not None:
+        constructor = constructor.request(solicitud).get_updates_request(solicitud)
+    app = constructor.build()
+    if ruta_grabacion:
+        iniciar_grabacion(app, ruta_grabacion)
 
     # Agregando handlers
     app.add_handler(MessageHandler(filters.Regex("^📚 Ver optativas$"), ver_optativas))
@@ -1229,14 +2353,50 @@ if __name__ == "__main__":
     app.add_handler(CallbackQueryHandler(cancelar_callback, pattern="^cancelar$"))
     app.add_handler(crear_optativa_handler)
     app.add_handler(resena_handler)
+    app.add_handler(preferencias_handler)
     app.add_handler(ver_reseñas_handler)
+    app.add_handler(CallbackQueryHandler(paginar_resenas_callback, pattern="^vrev:"))
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("log", enviar_log))
+    app.add_handler(CommandHandler("exportar", exportar_padron))
+    app.add_handler(CommandHandler("facultad", elegir_fragmento))
     app.add_handler(CommandHandler("help", comando_help))
     app.add_handler(CommandHandler("delrev", eliminar_todas_las_resenas))
+    app.add_handler(CommandHandler("archivar", archivar_semestre))
+    app.add_handler(CommandHandler("lag", ver_lag))
+    app.add_handler(CommandHandler("stats", ver_estadisticas))
+    app.add_handler(CommandHandler("perfil", perfilar))
     app.add_handler(login_conv)
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, manejar_mensaje))
     app.add_handler(MessageHandler(filters.Document.ALL, manejar_archivo))
 
+    # Cada handler registrado informa al monitor de sus pasos lentos y a las métricas
+    for grupo in app.handlers.values():
+        envolver_handlers(grupo, monitor_bucle.envolver)
+        envolver_handlers(grupo, metricas.envolver)
+    return app
+
+# end region
+# region Ejecución principal
+
+if __name__ == "__main__":
+    tiempos_arranque.append(("python-telegram-bot", DURACION_TELEGRAM))
+    marcar_arranque("otros imports")
+
+    # Obteniendo TOKEN del bot
+    parser = argparse.ArgumentParser(description="Iniciar el bot de optativas")
+    parser.add_argument("token", help="Token del bot de Telegram")
+    parser.add_argument("--grabar", action="store_true", help="Grabar el tráfico anonimizado en logs/ para reproducirlo con replay.py")
+    args = parser.parse_args()
+
+    # Carga del estado en memoria (el índice de búsqueda se ajusta después, en segundo plano)
+    cargar_estado()
+    marcar_arranque("carga de datos")
+
+    # Construcción de la app mediante el token
+    ruta_grabacion = f"logs/trafico_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl.gz" if args.grabar else None
+    app = construir_aplicacion(args.token, ruta_grabacion=ruta_grabacion)
+    marcar_arranque("handlers")
+
     print("🤖 Bot corriendo...")
     app.run_polling()
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+Comparación de memoria entre los registros de records.py y los diccionarios
+que devolvía json.load.
+
+Genera estudiantes, optativas y reseñas sintéticos con la forma de los
+archivos de data (grupos y optativas repetidos, una parte de los estudiantes
+en lista de espera o con chat registrado), los serializa a JSON y los carga
+de las dos maneras. Para cada una informa la memoria que queda ocupada, el
+pico durante la carga, el tiempo de carga y el de un recorrido completo
+leyendo un campo, que es lo que hacen los handlers al contar inscritos.
+
+Uso:
+    python memory_benchmark.py --estudiantes 50000 --resenas 20000
+    python memory_benchmark.py --estudiantes 200000 --json memoria.json
+"""
+
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+from records import Estudiante, Optativa, Resena
+
+COMENTARIOS = [
+    "Muy buena, el profesor explica claro.",
+    "Mucho trabajo práctico pero se aprende.",
+    "Regular, los temas se repiten.",
+    "Excelente para quien quiere investigar.",
+]
+
+
+def generar(estudiantes, optativas, resenas, semilla):
+    """Devuelve el texto JSON de los tres archivos sintéticos."""
+    azar = random.Random(semilla)
+    grupos = [f"C{anio}{numero}" for anio in range(1, 5) for numero in range(1, 13)]
+    lista_optativas = [
+        {
+            "nombre": f"Optativa sintética {i}",
+            "profesor": f"Profesor {i % 15}",
+            "descripcion": "Objetivos, contenidos y evaluación de la asignatura. " * 8,
+            "plazas": azar.choice([-1, 20, 30, 40]),
+            "relacionadas": [f"Optativa sintética {(i + 1) % optativas}"],
+        }
+        for i in range(optativas)
+    ]
+    lista_estudiantes = []
+    for i in range(estudiantes):
+        est = {
+            "nombre": f"Estudiante{i} Apellido{i % 97} Apellido{i % 89}",
+            "grupo": azar.choice(grupos),
+            "optativa": azar.choice(lista_optativas)["nombre"] if azar.random() < 0.8 else "",
+        }
+        if azar.random() < 0.05:
+            est["espera"] = {
+                "optativa": azar.choice(lista_optativas)["nombre"],
+                "prioridad": 0,
+                "solicitud": "2025-01-01T12:00:00",
+            }
+        if azar.random() < 0.3:
+            est["chat_id"] = 100000 + i
+        lista_estudiantes.append(est)
+    lista_resenas = [
+        {
+            "nombre": est["nombre"],
+            "grupo": est["grupo"],
+            "usuario_telegram": f"usuario{i}",
+            "optativa": azar.choice(lista_optativas)["nombre"],
+            "comentario": azar.choice(COMENTARIOS),
+            "puntuacion": azar.randint(1, 5),
+        }
+        for i, est in enumerate(azar.choices(lista_estudiantes, k=resenas))
+    ]
+    return {
+        "estudiantes": json.dumps(lista_estudiantes, ensure_ascii=False),
+        "optativas": json.dumps(lista_optativas, ensure_ascii=False),
+        "resenas": json.dumps(lista_resenas, ensure_ascii=False),
+    }
+
+
+def como_diccionarios(textos):
+    return {nombre: json.loads(texto) for nombre, texto in textos.items()}
+
+
+def como_registros(textos):
+    # Igual que los cargadores de main.py
+    return {
+        "estudiantes": [Estudiante(est) for est in json.loads(textos["estudiantes"])],
+        "optativas": [Optativa(opt) for opt in json.loads(textos["optativas"])],
+        "resenas": [Resena(r) for r in json.loads(textos["resenas"])],
+    }
+
+
+def medir(cargar, textos):
+    gc.collect()
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    datos = cargar(textos)
+    carga = time.perf_counter() - inicio
+    gc.collect()
+    ocupada, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    inicio = time.perf_counter()
+    inscritos = {}
+    for est in datos["estudiantes"]:
+        if est["optativa"]:
+            inscritos[est["optativa"]] = inscritos.get(est["optativa"], 0) + 1
+    recorrido = time.perf_counter() - inicio
+    return {
+        "ocupada": ocupada, "pico": pico, "carga": carga, "recorrido": recorrido,
+        "registros": {nombre: len(lista) for nombre, lista in datos.items()},
+    }
+
+
+def informe(resultados):
+    base, nuevo = resultados["diccionarios"], resultados["registros"]
+    cantidades = ", ".join(f"{n} {nombre}" for nombre, n in base["registros"].items())
+    lineas = [
+        f"Registros: {cantidades}",
+        "",
+        f"{'':<22}{'diccionarios':>14}{'registros':>14}{'cambio':>10}",
+    ]
+    filas = [
+        ("Memoria ocupada (MB)", "ocupada", 1 / 2**20),
+        ("Pico de carga (MB)", "pico", 1 / 2**20),
+        ("Carga (ms)", "carga", 1000),
+        ("Recorrido (ms)", "recorrido", 1000),
+    ]
+    for titulo, campo, escala in filas:
+        antes, ahora = base[campo] * escala, nuevo[campo] * escala
+        cambio = f"{(ahora - antes) / antes * 100:+.0f} %" if antes else "-"
+        lineas.append(f"{titulo:<22}{antes:>14.1f}{ahora:>14.1f}{cambio:>10}")
+    total = sum(base["registros"].values())
+    lineas.append("")
+    lineas.append(
+        f"Bytes por registro: {base['ocupada'] / total:.0f} con diccionarios, "
+        f"{nuevo['ocupada'] / total:.0f} con registros"
+    )
+    return "\n".join(lineas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memoria de los registros compactos frente a diccionarios")
+    parser.add_argument("--estudiantes", type=int, default=50000, help="Estudiantes sintéticos")
+    parser.add_argument("--optativas", type=int, default=40, help="Optativas sintéticas")
+    parser.add_argument("--resenas", type=int, default=20000, help="Reseñas sintéticas")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--json", help="Además, guardar el informe en este archivo JSON")
+    args = parser.parse_args()
+
+    textos = generar(args.estudiantes, args.optativas, args.resenas, args.semilla)
+    resultados = {
+        "diccionarios": medir(como_diccionarios, textos),
+        "registros": medir(como_registros, textos),
+    }
+    print(informe(resultados))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=4, ensure_ascii=False)
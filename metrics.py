@@ -0,0 +1,141 @@
+"""
+Métricas por handler: llamadas, errores e histograma de latencia.
+
+Los callbacks se envuelven con MetricasHandlers.envolver (ver
+monitor.envolver_handlers). La latencia es el tiempo total del handler,
+incluidas las esperas de red y disco. Periódicamente se escribe un archivo
+en el formato de texto de Prometheus para que lo lea un recolector local.
+"""
+
+import asyncio
+import functools
+import time
+
+from storage import escribir_texto_atomico
+
+# Límites superiores (s) de los cubos del histograma, como los de Prometheus por defecto
+CUBOS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _MetricaHandler:
+    def __init__(self):
+        self.llamadas = 0
+        self.errores = 0
+        self.suma = 0.0
+        # Un contador por cubo más el de +Inf (no acumulados)
+        self.cubos = [0] * (len(CUBOS_LATENCIA) + 1)
+
+    def observar(self, duracion, error):
+        self.llamadas += 1
+        self.errores += error
+        self.suma += duracion
+        for i, limite in enumerate(CUBOS_LATENCIA):
+            if duracion <= limite:
+                self.cubos[i] += 1
+                return
+        self.cubos[-1] += 1
+
+    def percentil(self, p):
+        """Límite superior del cubo que contiene el percentil p (inf si cae en el último)."""
+        objetivo = p / 100 * self.llamadas
+        acumulado = 0
+        for limite, cantidad in zip(CUBOS_LATENCIA + (float("inf"),), self.cubos):
+            acumulado += cantidad
+            if acumulado >= objetivo:
+                return limite
+        return float("inf")
+
+
+class MetricasHandlers:
+    """
+    Parámetros:
+      - ruta: archivo de texto con las métricas en formato Prometheus
+      - intervalo: cada cuántos segundos se reescribe el archivo
+      - almacen: AlmacenAsincrono con el que se escribe el archivo fuera del bucle
+    """
+
+    def __init__(self, ruta, intervalo=15, almacen=None):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.almacen = almacen
+        self.handlers = {}
+        self._indicadores = []
+        self._tarea = None
+
+    def envolver(self, nombre, callback):
+        """Envoltorio para envolver_handlers(): cuenta llamadas, errores y latencia."""
+        metrica = self.handlers.setdefault(nombre, _MetricaHandler())
+
+        @functools.wraps(callback)
+        async def medido(update, context):
+            inicio = time.perf_counter()
+            error = True
+            try:
+                resultado = await callback(update, context)
+                error = False
+                return resultado
+            finally:
+                metrica.observar(time.perf_counter() - inicio, error)
+        return medido
+
+    def registrar_indicador(self, nombre, ayuda, funcion):
+        """Agrega un valor instantáneo (gauge) calculado por 'funcion' al exportar."""
+        self._indicadores.append((nombre, ayuda, funcion))
+
+    # ---------- Exportación ----------
+
+    def texto_prometheus(self):
+        lineas = [
+            "# HELP bot_handler_llamadas_total Llamadas a cada handler.",
+            "# TYPE bot_handler_llamadas_total counter",
+        ]
+        lineas += [f'bot_handler_llamadas_total{{handler="{n}"}} {m.llamadas}' for n, m in sorted(self.handlers.items())]
+        lineas += [
+            "# HELP bot_handler_errores_total Llamadas a cada handler que terminaron con una excepción.",
+            "# TYPE bot_handler_errores_total counter",
+        ]
+        lineas += [f'bot_handler_errores_total{{handler="{n}"}} {m.errores}' for n, m in sorted(self.handlers.items())]
+        lineas += [
+            "# HELP bot_handler_duracion_segundos Latencia de cada handler.",
+            "# TYPE bot_handler_duracion_segundos histogram",
+        ]
+        for nombre, metrica in sorted(self.handlers.items()):
+            acumulado = 0
+            for limite, cantidad in zip(CUBOS_LATENCIA, metrica.cubos):
+                acumulado += cantidad
+                lineas.append(f'bot_handler_duracion_segundos_bucket{{handler="{nombre}",le="{limite}"}} {acumulado}')
+            lineas.append(f'bot_handler_duracion_segundos_bucket{{handler="{nombre}",le="+Inf"}} {metrica.llamadas}')
+            lineas.append(f'bot_handler_duracion_segundos_sum{{handler="{nombre}"}} {metrica.suma:.6f}')
+            lineas.append(f'bot_handler_duracion_segundos_count{{handler="{nombre}"}} {metrica.llamadas}')
+        for nombre, ayuda, funcion in self._indicadores:
+            lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} gauge", f"{nombre} {funcion()}"]
+        return "\n".join(lineas) + "\n"
+
+    async def exportar(self):
+        texto = self.texto_prometheus()
+        if self.almacen is not None:
+            await self.almacen.ejecutar(escribir_texto_atomico, self.ruta, texto)
+        else:
+            escribir_texto_atomico(self.ruta, texto)
+
+    async def iniciar(self):
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._exportar_periodicamente())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+            await self.exportar()
+
+    async def _exportar_periodicamente(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await self.exportar()
+            except Exception as e:
+                print("Error exportando métricas:", e)
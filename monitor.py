@@ -0,0 +1,146 @@
+"""
+Monitor del bucle de eventos.
+
+Mide el retraso con que el bucle atiende un temporizador (si un handler
+bloquea el hilo, el temporizador se despierta tarde) y registra cada paso de
+un handler que retiene el bucle más de un umbral, con el nombre del handler.
+Un paso es el tramo de código entre dos await: es lo que realmente bloquea a
+los demás usuarios.
+"""
+
+import asyncio
+import functools
+import time
+from collections import deque
+from datetime import datetime
+
+
+def percentil(ordenados, p):
+    """Percentil p (0-100) de una lista ya ordenada, por el método del rango más cercano."""
+    if not ordenados:
+        return 0.0
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+class _PasosMedidos:
+    """Ejecuta una corrutina midiendo cuánto dura cada uno de sus pasos."""
+
+    def __init__(self, corrutina, al_medir):
+        self._corrutina = corrutina
+        self._al_medir = al_medir
+
+    def __await__(self):
+        corrutina = self._corrutina
+        valor, error = None, None
+        while True:
+            inicio = time.perf_counter()
+            try:
+                if error is None:
+                    pendiente = corrutina.send(valor)
+                else:
+                    pendiente = corrutina.throw(error)
+            except StopIteration as fin:
+                self._al_medir(time.perf_counter() - inicio)
+                return fin.value
+            except BaseException:
+                self._al_medir(time.perf_counter() - inicio)
+                raise
+            self._al_medir(time.perf_counter() - inicio)
+            try:
+                valor, error = (yield pendiente), None
+            except GeneratorExit:
+                corrutina.close()
+                raise
+            except BaseException as e:
+                valor, error = None, e
+
+
+def envolver_handlers(handlers, envoltorio):
+    """
+    Reemplaza el callback de cada handler (también los de dentro de un
+    ConversationHandler) por envoltorio(nombre, callback).
+    """
+    for handler in handlers:
+        if hasattr(handler, "entry_points"):
+            anidados = list(handler.entry_points) + list(handler.fallbacks)
+            for estado in handler.states.values():
+                anidados.extend(estado)
+            envolver_handlers(anidados, envoltorio)
+        elif getattr(handler, "callback", None) is not None:
+            handler.callback = envoltorio(handler.callback.__name__, handler.callback)
+
+
+class MonitorBucle:
+    """
+    Parámetros:
+      - intervalo: cada cuántos segundos se mide el retraso del bucle
+      - umbral: duración (s) a partir de la cual un paso se considera lento
+      - muestras: cantidad de mediciones de retraso que se conservan
+      - max_lentos: cantidad de pasos lentos recientes que se conservan
+    """
+
+    def __init__(self, intervalo=0.1, umbral=0.1, muestras=3000, max_lentos=50):
+        self.intervalo = intervalo
+        self.umbral = umbral
+        self._retrasos = deque(maxlen=muestras)
+        self.lentos = deque(maxlen=max_lentos)
+        self._tarea = None
+
+    # ---------- Retraso del bucle ----------
+
+    async def iniciar(self):
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._muestrear())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    async def _muestrear(self):
+        while True:
+            inicio = time.perf_counter()
+            await asyncio.sleep(self.intervalo)
+            retraso = max(0.0, time.perf_counter() - inicio - self.intervalo)
+            self._retrasos.append(retraso)
+            if retraso >= self.umbral and not self._atribuido(retraso):
+                # Nadie instrumentado se hizo cargo: fue otra tarea del bucle
+                self._registrar_lento("(otra tarea del bucle)", retraso)
+
+    def _atribuido(self, retraso):
+        # El bloqueo ya quedó registrado si un handler terminó un paso lento hace poco
+        if not self.lentos:
+            return False
+        ultimo = self.lentos[-1]
+        return time.monotonic() - ultimo[2] <= retraso + self.intervalo and ultimo[0] != "(otra tarea del bucle)"
+
+    def percentiles(self):
+        ordenados = sorted(self._retrasos)
+        return {
+            "muestras": len(ordenados),
+            "p50": percentil(ordenados, 50),
+            "p95": percentil(ordenados, 95),
+            "p99": percentil(ordenados, 99),
+            "max": ordenados[-1] if ordenados else 0.0,
+        }
+
+    # ---------- Pasos lentos de los handlers ----------
+
+    def _registrar_lento(self, nombre, duracion):
+        self.lentos.append((nombre, duracion, time.monotonic(), datetime.now()))
+
+    def envolver(self, nombre, callback):
+        """Envoltorio para envolver_handlers(): mide los pasos del callback."""
+        def al_medir(duracion):
+            if duracion >= self.umbral:
+                self._registrar_lento(nombre, duracion)
+
+        @functools.wraps(callback)
+        async def medido(update, context):
+            return await _PasosMedidos(callback(update, context), al_medir)
+        return medido
@@ -0,0 +1,47 @@
+"""
+Perfilado bajo demanda del bot en producción.
+
+Usa cProfile sobre el hilo del bucle de eventos, donde corren todos los
+handlers. Solo se activa mientras dura una sesión pedida por el superadmin;
+fuera de ella no hay ningún gancho instalado y el costo es nulo. Las tareas
+que corren en otros hilos (escrituras a disco, asignación automática) no
+aparecen en el perfil.
+"""
+
+import cProfile
+import io
+import marshal
+import pstats
+import time
+
+
+class SesionPerfilado:
+    def __init__(self):
+        self._perfil = cProfile.Profile()
+        self.inicio = None
+        self.duracion = None
+
+    def iniciar(self):
+        self.inicio = time.perf_counter()
+        self._perfil.enable()
+
+    def detener(self):
+        self._perfil.disable()
+        self.duracion = time.perf_counter() - self.inicio
+
+    def exportar(self, top=30):
+        """
+        Devuelve (contenido del archivo .prof, resumen en texto). El archivo
+        se abre con pstats o con visores como snakeviz.
+        """
+        self._perfil.create_stats()
+        contenido = marshal.dumps(self._perfil.stats)
+
+        salida = io.StringIO()
+        estadisticas = pstats.Stats(self._perfil, stream=salida)
+        estadisticas.strip_dirs()
+        salida.write(f"Perfil de {self.duracion:.1f} s\n\n=== Por tiempo propio ===\n")
+        estadisticas.sort_stats("tottime").print_stats(top)
+        salida.write("\n=== Por tiempo acumulado ===\n")
+        estadisticas.sort_stats("cumulative").print_stats(top)
+        return contenido, salida.getvalue()
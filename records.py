@@ -0,0 +1,131 @@
+"""
+Registros compactos para estudiantes, optativas y reseñas.
+
+Cada registro es un objeto con __slots__: los campos van en posiciones fijas
+en lugar de una tabla hash por registro, y los valores que se repiten en
+miles de registros (grupos, nombres de optativa, profesores) se internan
+para que todos compartan la misma cadena.
+
+Se usan como diccionarios (registro["grupo"], get, pop, "espera" in
+registro, comparación con un dict), así que los handlers no cambian. Un
+campo opcional sin valor no existe para el diccionario, igual que una clave
+ausente. Los campos que no se conocen (p. ej. de un archivo subido) se
+conservan aparte para no perder datos al guardar.
+"""
+
+import sys
+from collections.abc import MutableMapping
+
+
+class Registro(MutableMapping):
+    __slots__ = ("_extra",)
+
+    CAMPOS = ()       # Campos con posición fija, en el orden en que se guardan
+    INTERNADOS = ()   # Campos de texto que se repiten entre registros
+
+    def __init_subclass__(cls):
+        super().__init_subclass__()
+        cls._campos = frozenset(cls.CAMPOS)
+        cls._internados = frozenset(cls.INTERNADOS)
+
+    def __init__(self, datos=None, **campos):
+        self._extra = None
+        if campos:
+            datos = dict(datos or {}, **campos)
+        if not datos:
+            return
+        # Equivale a self[clave] = valor para cada campo, sin una llamada por campo
+        conocidos, internados = self._campos, self._internados
+        for clave, valor in datos.items():
+            if clave in conocidos:
+                if clave in internados and type(valor) is str:
+                    valor = sys.intern(valor)
+                setattr(self, clave, valor)
+            else:
+                self[clave] = valor
+
+    @classmethod
+    def desde(cls, datos):
+        """El mismo registro si ya es de esta clase; si no, uno nuevo con sus datos."""
+        return datos if type(datos) is cls else cls(datos)
+
+    def __getitem__(self, clave):
+        if clave in self._campos:
+            try:
+                return getattr(self, clave)
+            except AttributeError:
+                raise KeyError(clave) from None
+        if self._extra is None:
+            raise KeyError(clave)
+        return self._extra[clave]
+
+    def __setitem__(self, clave, valor):
+        if clave in self._campos:
+            if clave in self._internados and type(valor) is str:
+                valor = sys.intern(valor)
+            setattr(self, clave, valor)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[clave] = valor
+
+    def __delitem__(self, clave):
+        if clave in self._campos:
+            try:
+                delattr(self, clave)
+            except AttributeError:
+                raise KeyError(clave) from None
+        elif self._extra is None:
+            raise KeyError(clave)
+        else:
+            del self._extra[clave]
+
+    def __contains__(self, clave):
+        if clave in self._campos:
+            return hasattr(self, clave)
+        return self._extra is not None and clave in self._extra
+
+    def __iter__(self):
+        for campo in self.CAMPOS:
+            if hasattr(self, campo):
+                yield campo
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def como_dict(self):
+        """Copia como diccionario, para serializar."""
+        datos = {campo: getattr(self, campo) for campo in self.CAMPOS if hasattr(self, campo)}
+        if self._extra:
+            datos.update(self._extra)
+        return datos
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.como_dict()!r})"
+
+
+class Estudiante(Registro):
+    __slots__ = ("nombre", "grupo", "optativa", "espera", "chat_id")
+    CAMPOS = __slots__
+    INTERNADOS = ("grupo", "optativa")
+
+
+class Optativa(Registro):
+    __slots__ = ("nombre", "profesor", "descripcion", "plazas", "relacionadas")
+    CAMPOS = __slots__
+    INTERNADOS = ("profesor",)
+
+
+class Resena(Registro):
+    __slots__ = ("nombre", "grupo", "usuario_telegram", "optativa", "comentario", "puntuacion")
+    CAMPOS = __slots__
+    INTERNADOS = ("grupo", "optativa")
+
+
+def como_json(objeto):
+    """Para el parámetro default de json.dump: serializa los registros como diccionarios."""
+    if isinstance(objeto, Registro):
+        return objeto.como_dict()
+    raise TypeError(f"Objeto de tipo {type(objeto).__name__} no serializable a JSON")
@@ -0,0 +1,236 @@
+"""
+Reproducción de tráfico grabado con `python main.py TOKEN --grabar`.
+
+Envía los updates de una grabación a la aplicación real de main.py, sobre
+una copia de la carpeta data y la API local de load_test.py, respetando los
+tiempos originales (o acelerándolos) y el reparto por chat. Así se puede
+comparar la latencia de dos versiones del bot con la forma real del tráfico.
+
+Las referencias a estudiantes de la grabación se resuelven contra el padrón
+de la copia con la sal del archivo <grabación>.sal (sin él quedan sin
+resolver); a quienes estaban con sesión de profesor se les inicia sesión
+como superadmin antes de su primer mensaje. Los archivos subidos no se
+graban, así que se omiten. Los mensajes con credenciales se envían como un
+texto fijo, para que las conversaciones avancen igual que en la grabación.
+
+Uso:
+    python replay.py logs/trafico_20250101_120000.jsonl.gz --velocidad 10 --json nueva.json
+    python replay.py grabacion.jsonl.gz --velocidad 0 --comparar nueva.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from load_test import ApiLocal, GeneradorUpdates, ejecutar_en_copia
+from monitor import percentil
+from traffic_recorder import PREFIJO_ESTUDIANTE, hash_corto, leer_grabacion, leer_sal
+
+TEXTO_CREDENCIAL = "credencial-omitida"
+
+
+class Reproductor:
+    def __init__(self, main, app, api, sal, registros, velocidad):
+        self.main = main
+        self.app = app
+        self.api = api
+        self.registros = sorted(registros, key=lambda r: r["t"])
+        self.velocidad = velocidad
+        self.generador = GeneradorUpdates(app.bot)
+        self.sal = sal
+        self.latencias = {}
+        self.errores = {}
+        self.omitidos = 0
+        self.sin_resolver = 0
+        self._logueados = set()
+        self._tipo_actual = {}
+        self._textos_fijos = {boton.text for fila in main.menu_profesor.keyboard for boton in fila}
+        # hash de "Nombre Apellidos Grupo" → texto real de la copia
+        self._estudiantes = {
+            hash_corto(self.sal, f"{est['nombre']} {est['grupo']}"): f"{est['nombre']} {est['grupo']}"
+            for est in main.padron
+        } if sal is not None else {}
+
+    def tipo(self, registro):
+        """Clave con la que se agrupan las latencias."""
+        if registro["k"] != "texto":
+            return registro["k"] if registro["k"] != "callback" else "callback " + registro["d"].split(":")[0]
+        texto = registro["x"]
+        if texto.startswith("/"):
+            return texto
+        if texto in self._textos_fijos:
+            return "menú " + texto
+        return "texto"
+
+    def resolver(self, texto):
+        lineas = []
+        for linea in texto.split("\n"):
+            if linea.startswith(PREFIJO_ESTUDIANTE):
+                real = self._estudiantes.get(linea[len(PREFIJO_ESTUDIANTE):])
+                if real is None:
+                    self.sin_resolver += 1
+                    real = "Estudiante Desconocido De Grabacion X"
+                linea = real
+            lineas.append(linea)
+        return "\n".join(lineas)
+
+    async def contar_error(self, update, context):
+        usuario = update.effective_user.id if getattr(update, "effective_user", None) else None
+        tipo = self._tipo_actual.get(usuario, "desconocido")
+        self.errores[tipo] = self.errores.get(tipo, 0) + 1
+
+    async def procesar(self, update):
+        await self.app.update_processor.process_update(update, self.app.process_update(update))
+
+    async def iniciar_sesion(self, usuario):
+        self._logueados.add(usuario)
+        for texto in ("/login", "superadmin", self.main.SUPERADMIN_PASSWORD):
+            await self.procesar(self.generador.texto(usuario, texto))
+
+    async def enviar(self, registro):
+        usuario = registro.get("u") or registro.get("c")
+        if registro.get("r") and usuario not in self._logueados:
+            await self.iniciar_sesion(usuario)
+
+        if registro["k"] == "texto":
+            update = self.generador.texto(usuario, self.resolver(registro["x"]))
+        elif registro["k"] == "credencial":
+            update = self.generador.texto(usuario, TEXTO_CREDENCIAL)
+        else:
+            update = self.generador.callback(usuario, registro["d"])
+        tipo = self.tipo(registro)
+        self._tipo_actual[usuario] = tipo
+        inicio = time.perf_counter()
+        try:
+            await self.procesar(update)
+        except Exception:
+            self.errores[tipo] = self.errores.get(tipo, 0) + 1
+        self.latencias.setdefault(tipo, []).append(time.perf_counter() - inicio)
+
+    async def ejecutar(self):
+        # Cada usuario conserva su orden: sus updates se encadenan, los de distintos usuarios se solapan
+        ultimas = {}
+        tareas = []
+        inicio = time.perf_counter()
+        for registro in self.registros:
+            if registro["k"] not in ("texto", "callback", "credencial"):
+                self.omitidos += 1
+                continue
+            if self.velocidad:
+                espera = registro["t"] / self.velocidad - (time.perf_counter() - inicio)
+                if espera > 0:
+                    await asyncio.sleep(espera)
+            usuario = registro.get("u") or registro.get("c")
+            tarea = asyncio.create_task(self._en_orden(ultimas.get(usuario), registro))
+            ultimas[usuario] = tarea
+            tareas.append(tarea)
+        await asyncio.gather(*tareas)
+        return time.perf_counter() - inicio
+
+    async def _en_orden(self, anterior, registro):
+        if anterior is not None:
+            await asyncio.shield(anterior)
+        await self.enviar(registro)
+
+    def informe(self, duracion):
+        total = sum(len(v) for v in self.latencias.values())
+        errores = sum(self.errores.values())
+        lineas = [
+            f"Duración: {duracion:.1f} s · updates: {total} · rendimiento: {total / duracion:.1f} updates/s",
+            f"Errores: {errores} · omitidos (archivos u otros): {self.omitidos} · estudiantes sin resolver: {self.sin_resolver}",
+            f"Llamadas a la API: {dict(sorted(self.api.llamadas.items()))}",
+            "",
+            f"{'tipo':<34}{'n':>7}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'máx ms':>10}",
+        ]
+        resumen = {}
+        for tipo in sorted(self.latencias, key=lambda t: -len(self.latencias[t])):
+            ordenadas = sorted(self.latencias[tipo])
+            fila = {
+                "n": len(ordenadas),
+                "errores": self.errores.get(tipo, 0),
+                "p50": percentil(ordenadas, 50),
+                "p95": percentil(ordenadas, 95),
+                "p99": percentil(ordenadas, 99),
+                "max": ordenadas[-1],
+            }
+            resumen[tipo] = fila
+            lineas.append(
+                f"{tipo[:33]:<34}{fila['n']:>7}{fila['errores']:>6}{fila['p50'] * 1000:>10.1f}"
+                f"{fila['p95'] * 1000:>10.1f}{fila['p99'] * 1000:>10.1f}{fila['max'] * 1000:>10.1f}"
+            )
+        p = self.main.monitor_bucle.percentiles()
+        lineas.append("")
+        lineas.append(f"Retraso del bucle: p50 {p['p50'] * 1000:.1f} ms · p99 {p['p99'] * 1000:.1f} ms · máx {p['max'] * 1000:.1f} ms")
+        return "\n".join(lineas), {
+            "duracion": duracion, "updates": total, "errores": errores,
+            "tipos": resumen, "retraso_bucle": p,
+        }
+
+
+def comparar(actual, ruta_base):
+    """Tabla con la variación del p95 por tipo frente a un informe JSON anterior."""
+    with open(ruta_base, "r", encoding="utf-8") as f:
+        base = json.load(f)["tipos"]
+    lineas = [f"{'tipo':<34}{'p95 base':>10}{'p95 ahora':>11}{'cambio':>9}"]
+    for tipo, fila in actual["tipos"].items():
+        if tipo not in base:
+            continue
+        antes, ahora = base[tipo]["p95"] * 1000, fila["p95"] * 1000
+        cambio = f"{(ahora - antes) / antes * 100:+.0f} %" if antes else "-"
+        lineas.append(f"{tipo[:33]:<34}{antes:>10.1f}{ahora:>11.1f}{cambio:>9}")
+    return "\n".join(lineas)
+
+
+async def correr(args):
+    import main  # Se importa después de cambiar a la carpeta temporal: usa rutas relativas
+
+    if args.sin_limites:
+        main.LIMITE_MENSAJES_GLOBAL = main.LIMITE_MENSAJES_CHAT = 1_000_000
+    main.cargar_estado()
+
+    _, registros = leer_grabacion(args.grabacion)
+    sal = leer_sal(args.grabacion)
+    if sal is None:
+        print(f"⚠️ No se encontró {args.grabacion}.sal: las referencias a estudiantes quedarán sin resolver")
+    api = ApiLocal(args.latencia_api / 1000)
+    app = main.construir_aplicacion("1:reproduccion", solicitud=api)
+    reproductor = Reproductor(main, app, api, sal, registros, args.velocidad)
+    app.add_error_handler(reproductor.contar_error)
+
+    await app.initialize()
+    await main.post_init(app)
+    try:
+        duracion = await reproductor.ejecutar()
+        texto, datos = reproductor.informe(duracion)
+    finally:
+        # Mismo orden que run_polling: la aplicación guarda las sesiones antes de que se cierre el almacén
+        await app.shutdown()
+        await main.post_shutdown(app)
+
+    print(texto)
+    if args.comparar:
+        print()
+        print(comparar(datos, args.comparar))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(datos, f, indent=4, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproducir tráfico grabado del bot de optativas")
+    parser.add_argument("grabacion", help="Archivo .jsonl.gz generado con main.py --grabar")
+    parser.add_argument("--velocidad", type=float, default=1, help="Factor de aceleración (0 = sin esperas)")
+    parser.add_argument("--latencia-api", type=float, default=30, help="Latencia simulada de la API de Telegram (ms)")
+    parser.add_argument("--sin-limites", action="store_true", help="Desactiva los límites de la cola de envíos")
+    parser.add_argument("--datos", default="data", help="Carpeta de datos que se copia para la reproducción")
+    parser.add_argument("--json", help="Guardar el informe en este archivo JSON")
+    parser.add_argument("--comparar", help="Informe JSON de otra versión con el que comparar el p95")
+    args = parser.parse_args()
+
+    args.grabacion = os.path.abspath(args.grabacion)
+    for campo in ("json", "comparar"):
+        if getattr(args, campo):
+            setattr(args, campo, os.path.abspath(getattr(args, campo)))
+    ejecutar_en_copia(args.datos, lambda: correr(args))
@@ -0,0 +1,123 @@
+"""
+Almacenamiento en memoria de las reseñas de optativas.
+
+Las reseñas se indexan por optativa y cada optativa mantiene sus agregados
+(cantidad, suma, histograma de puntuaciones, mejor y peor reseña) que se
+actualizan en O(1) al insertar, reemplazar o eliminar una reseña.
+"""
+
+from records import Resena
+
+
+def clave_resena(resena):
+    """Un estudiante tiene como máximo una reseña por optativa."""
+    return (resena["nombre"], resena["grupo"], resena["optativa"])
+
+
+class ResumenOptativa:
+    """Reseñas y agregados de una sola optativa."""
+
+    def __init__(self):
+        self.resenas = {}
+        # Reseñas agrupadas por puntuación (índices 1 a 5) en orden de llegada
+        self.por_puntuacion = [{} for _ in range(6)]
+        self.suma = 0
+        # Cambia con cada modificación, sirve para invalidar cachés
+        self.version = 0
+
+    @property
+    def cantidad(self):
+        return len(self.resenas)
+
+    @property
+    def promedio(self):
+        return self.suma / len(self.resenas) if self.resenas else None
+
+    @property
+    def histograma(self):
+        return {p: len(self.por_puntuacion[p]) for p in range(1, 6)}
+
+    def agregar(self, clave, resena):
+        self.resenas[clave] = resena
+        self.por_puntuacion[resena["puntuacion"]][clave] = resena
+        self.suma += resena["puntuacion"]
+        self.version += 1
+
+    def quitar(self, clave):
+        resena = self.resenas.pop(clave, None)
+        if resena is not None:
+            del self.por_puntuacion[resena["puntuacion"]][clave]
+            self.suma -= resena["puntuacion"]
+            self.version += 1
+        return resena
+
+    def mejor(self):
+        """La primera reseña recibida con la puntuación más alta."""
+        for p in range(5, 0, -1):
+            if self.por_puntuacion[p]:
+                return next(iter(self.por_puntuacion[p].values()))
+        return None
+
+    def peor(self):
+        """La primera reseña recibida con la puntuación más baja."""
+        for p in range(1, 6):
+            if self.por_puntuacion[p]:
+                return next(iter(self.por_puntuacion[p].values()))
+        return None
+
+
+class IndiceResenas:
+    """Reseñas indexadas por optativa, con el orden global de llegada para persistirlas."""
+
+    def __init__(self, resenas=None):
+        self._todas = {}
+        self._por_optativa = {}
+        if resenas:
+            self.reconstruir(resenas)
+
+    def reconstruir(self, resenas):
+        self._todas.clear()
+        self._por_optativa.clear()
+        for resena in resenas:
+            self.insertar(resena)
+
+    def __len__(self):
+        return len(self._todas)
+
+    def insertar(self, resena):
+        """Agrega una reseña reemplazando la anterior del mismo estudiante. Devuelve la anterior o None."""
+        resena = Resena.desde(resena)
+        clave = clave_resena(resena)
+        anterior = self.eliminar(*clave)
+        self._todas[clave] = resena
+        self._por_optativa.setdefault(resena["optativa"], ResumenOptativa()).agregar(clave, resena)
+        return anterior
+
+    def obtener(self, nombre, grupo, optativa):
+        return self._todas.get((nombre, grupo, optativa))
+
+    def eliminar(self, nombre, grupo, optativa):
+        clave = (nombre, grupo, optativa)
+        resena = self._todas.pop(clave, None)
+        if resena is not None:
+            self._por_optativa[optativa].quitar(clave)
+        return resena
+
+    def vaciar(self):
+        self._todas.clear()
+        for resumen in self._por_optativa.values():
+            resumen.resenas.clear()
+            resumen.por_puntuacion = [{} for _ in range(6)]
+            resumen.suma = 0
+            resumen.version += 1
+
+    def resumen(self, optativa):
+        """Agregados de la optativa (vacíos si no tiene reseñas)."""
+        return self._por_optativa.setdefault(optativa, ResumenOptativa())
+
+    def de_optativa(self, optativa):
+        resumen = self._por_optativa.get(optativa)
+        return list(resumen.resenas.values()) if resumen else []
+
+    def como_lista(self):
+        return list(self._todas.values())
@@ -1,12 +1,17 @@
+import asyncio
 import json
 import sys
 import io
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import re
 
-# Forzar UTF-8 en stdout
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+# sklearn y scipy tardan más de un segundo en importarse: se cargan la primera
+# vez que hacen falta (o antes, en segundo plano, con precargar)
+
+def precargar():
+    """Importa sklearn y scipy para que la primera búsqueda no pague su costo."""
+    import sklearn.feature_extraction.text
+    import sklearn.metrics.pairwise
+    import scipy.sparse
 
 def extraer_asignaturas_con_peso(query):
     """
@@ -39,16 +44,11 @@ def construir_corpus(optativas):
         corpus.append(texto)
     return corpus
 
-def buscar_optativas(query, peso_base=0.1):
-    optativas = cargar_optativas()
-    corpus = construir_corpus(optativas)
-    similitud_total = [0.0 for _ in optativas]
-
-    # TF-IDF completo del corpus
-    vectorizer = TfidfVectorizer()
-    matriz = vectorizer.fit_transform(corpus)
-
-    # Dividir tokens y clasificarlos
+def clasificar_tokens(query):
+    """
+    Divide la query en palabras prohibidas (!palabra), palabras con peso
+    (palabra***) y palabras normales.
+    """
     tokens = re.findall(r"(!?[^\s*]+)(\*{1,5})?", query.lower())
 
     palabras_prohibidas = set()
@@ -64,36 +64,232 @@ def buscar_optativas(query, peso_base=0.1):
         else:
             palabras_normales.append(palabra)
 
-    # TF-IDF para términos normales
-    for palabra in palabras_normales:
-        tfidf_query = vectorizer.transform([palabra])
-        similitudes = cosine_similarity(tfidf_query, matriz)[0]
-        for i in range(len(similitudes)):
-            similitud_total[i] += similitudes[i]
-
-    # Términos con estrellas → score adicional
-    for palabra, peso in palabras_con_peso:
-        tfidf_query = vectorizer.transform([palabra])
-        similitudes = cosine_similarity(tfidf_query, matriz)[0]
-        for i in range(len(similitudes)):
-            similitud_total[i] += similitudes[i]
-        for i, opt in enumerate(optativas):
-            texto_opt = f"{opt['nombre']} {opt['profesor']} {opt['descripcion']} {' '.join(opt.get('relacionadas', []))}".lower()
-            if palabra in texto_opt:
-                similitud_total[i] += peso_base * peso
-
-    # ⚠️ Eliminar optativas que contengan alguna palabra prohibida
-    for i, opt in enumerate(optativas):
-        texto_opt = f"{opt['nombre']} {opt['profesor']} {opt['descripcion']} {' '.join(opt.get('relacionadas', []))}".lower()
-        if any(palabra in texto_opt for palabra in palabras_prohibidas):
-            similitud_total[i] = 0.0
-
-    # Ordenar y devolver
-    resultados = sorted(zip(optativas, similitud_total), key=lambda x: x[1], reverse=True)
-    mejores = [opt for opt, score in resultados if score > 0][:10]
-    return mejores
+    return palabras_prohibidas, palabras_normales, palabras_con_peso
+
+def ajustar_comentarios(comentarios):
+    """
+    Ajusta el TF-IDF de los comentarios (un documento por optativa). Devuelve
+    (vectorizer, filas, matriz), o (None, [], None) si no hay ningún comentario.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    if not any(comentarios):
+        return None, [], None
+    vectorizer = TfidfVectorizer()
+    matriz = vectorizer.fit_transform(comentarios)
+    return vectorizer, [matriz[i] for i in range(matriz.shape[0])], matriz
+
+class IndiceBusqueda:
+    """
+    Índice de búsqueda precalculado sobre el catálogo y los comentarios de las reseñas.
+
+    El TF-IDF del catálogo se ajusta una sola vez por versión del catálogo. Los
+    comentarios de cada optativa forman un documento aparte cuyo vector se
+    recalcula solo para la optativa que recibe una reseña, junto con su
+    puntuación previa (promedio bayesiano). Una consulta no recorre el
+    catálogo ni las reseñas: solo transforma sus palabras y las compara con
+    las matrices ya calculadas.
+
+    Dentro del bucle de eventos los ajustes completos se piden con reajustar():
+    corren en otro hilo y el resultado se instala de una vez, así que las
+    consultas nunca ven un índice a medio ajustar ni esperan a sklearn.
+
+    Parámetros:
+      - peso_resenas: cuánto aporta la similitud con los comentarios (0 la ignora)
+      - peso_puntuacion: cuánto aporta la puntuación previa a las optativas que coinciden (0 la ignora)
+    """
+
+    # Reseñas "virtuales" con la media global que suaviza el promedio de optativas con pocas reseñas
+    PRIOR_RESENAS = 5
+    # Atributos que forman un ajuste y que _instalar reemplaza juntos
+    AJUSTE = (
+        "optativas", "_posicion", "_textos", "vectorizer", "matriz", "_comentarios", "_suma", "_cantidad",
+        "_total_suma", "_total_cantidad", "_vectorizer_resenas", "_filas_resenas", "_matriz_resenas",
+    )
+
+    def __init__(self, peso_resenas=0.0, peso_puntuacion=0.0):
+        self.peso_resenas = peso_resenas
+        self.peso_puntuacion = peso_puntuacion
+        self.optativas = []
+        self._posicion = {}
+        self._comentarios = []
+        self._vectorizer_resenas = None
+        # Reajustes en otro hilo (ver reajustar): reseñas recibidas, pedido pendiente y tarea en curso
+        self._cambios = 0
+        self._pendiente = None
+        self._tarea = None
+
+    def reconstruir(self, optativas, resenas=()):
+        """
+        Ajusta el índice completo a partir del catálogo y la lista de reseñas.
+        Es bloqueante: dentro del bucle de eventos usar reajustar().
+        """
+        self._instalar(self._ajustado(optativas, resenas))
+
+    def _ajustado(self, optativas, resenas):
+        # Índice nuevo con los mismos pesos; no toca este, así que puede correr en otro hilo
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        nuevo = IndiceBusqueda(self.peso_resenas, self.peso_puntuacion)
+        nuevo.optativas = list(optativas)
+        nuevo._posicion = {opt["nombre"]: i for i, opt in enumerate(nuevo.optativas)}
+        nuevo._textos = [
+            f"{opt['nombre']} {opt['profesor']} {opt['descripcion']} {' '.join(opt.get('relacionadas', []))}".lower()
+            for opt in nuevo.optativas
+        ]
+
+        nuevo.vectorizer = TfidfVectorizer()
+        nuevo.matriz = nuevo.vectorizer.fit_transform(construir_corpus(nuevo.optativas)) if nuevo.optativas else None
+
+        por_optativa = {}
+        for r in resenas:
+            por_optativa.setdefault(r["optativa"], []).append(r)
+        nuevo._comentarios = [""] * len(nuevo.optativas)
+        nuevo._suma = [0] * len(nuevo.optativas)
+        nuevo._cantidad = [0] * len(nuevo.optativas)
+        nuevo._total_suma = nuevo._total_cantidad = 0
+        for nombre, lista in por_optativa.items():
+            i = nuevo._posicion.get(nombre)
+            if i is not None:
+                nuevo._fijar_resenas(i, lista)
+        nuevo._vectorizer_resenas, nuevo._filas_resenas, nuevo._matriz_resenas = ajustar_comentarios(nuevo._comentarios)
+        return nuevo
+
+    def _instalar(self, nuevo):
+        # Sin await de por medio: para el bucle el cambio de ajuste es atómico
+        for atributo in self.AJUSTE:
+            setattr(self, atributo, getattr(nuevo, atributo))
+
+    def reajustar(self, datos=None):
+        """
+        Pide un reajuste en otro hilo y devuelve la tarea que lo hace. Mientras
+        corre, las consultas usan el ajuste anterior.
+
+        'datos' es una función que devuelve (optativas, reseñas) vigentes y se
+        llama en el bucle al empezar: pide un ajuste completo. Sin ella solo se
+        reajustan los comentarios (cuando llegan palabras nuevas en reseñas).
+        Los pedidos que llegan durante un reajuste se juntan en uno más al
+        terminar; un ajuste completo incluye al de comentarios.
+        """
+        if datos is not None:
+            self._pendiente = datos
+        elif self._pendiente is None:
+            self._pendiente = False
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.ensure_future(self._reajustar())
+        return self._tarea
+
+    async def _reajustar(self):
+        while self._pendiente is not None:
+            datos, self._pendiente = self._pendiente, None
+            cambios = self._cambios
+            if datos:
+                optativas, resenas = datos()
+                nuevo = await asyncio.to_thread(self._ajustado, optativas, resenas)
+                self._instalar(nuevo)
+                if self._cambios != cambios and self._pendiente is None:
+                    # Llegaron reseñas durante el ajuste y no están en la lista que se usó
+                    self._pendiente = datos
+            else:
+                comentarios = self._comentarios
+                ajuste = await asyncio.to_thread(ajustar_comentarios, list(comentarios))
+                if comentarios is not self._comentarios:
+                    continue  # Un ajuste completo reemplazó los comentarios mientras tanto
+                self._vectorizer_resenas, self._filas_resenas, self._matriz_resenas = ajuste
+                if self._cambios != cambios and self._pendiente is None:
+                    self._pendiente = False
+
+    def _fijar_resenas(self, i, resenas):
+        # Los totales de todas las optativas se mantienen al día para no sumarlos en cada consulta
+        suma = sum(r["puntuacion"] for r in resenas)
+        self._total_suma += suma - self._suma[i]
+        self._total_cantidad += len(resenas) - self._cantidad[i]
+        self._comentarios[i] = " ".join(r["comentario"] for r in resenas).lower()
+        self._suma[i] = suma
+        self._cantidad[i] = len(resenas)
+
+    def actualizar_resenas(self, nombre, resenas):
+        """
+        Recalcula el vector de comentarios y la puntuación de una sola optativa.
+        Devuelve True si los comentarios traen palabras que el índice no conoce:
+        hasta que se llame a reajustar(), esa optativa conserva su vector anterior.
+        """
+        self._cambios += 1
+        i = self._posicion.get(nombre)
+        if i is None:
+            return False
+        self._fijar_resenas(i, resenas)
+        if self._vectorizer_resenas is None:
+            return True
+        analizador = self._vectorizer_resenas.build_analyzer()
+        if any(t not in self._vectorizer_resenas.vocabulary_ for t in analizador(self._comentarios[i])):
+            return True
+        self._filas_resenas[i] = self._vectorizer_resenas.transform([self._comentarios[i]])
+        self._matriz_resenas = None
+        return False
+
+    def puntuacion_previa(self, i):
+        """Promedio bayesiano de la optativa normalizado a [0, 1]."""
+        total = self._total_cantidad
+        media = self._total_suma / total if total else 3
+        promedio = (self.PRIOR_RESENAS * media + self._suma[i]) / (self.PRIOR_RESENAS + self._cantidad[i])
+        return (promedio - 1) / 4
+
+    def _similitud_resenas(self, palabra):
+        from scipy.sparse import vstack
+        from sklearn.metrics.pairwise import cosine_similarity
+        if self._vectorizer_resenas is None:
+            return None
+        if self._matriz_resenas is None:
+            self._matriz_resenas = vstack(self._filas_resenas).tocsr()
+        return cosine_similarity(self._vectorizer_resenas.transform([palabra]), self._matriz_resenas)[0]
+
+    def buscar(self, query, peso_base=0.1, limite=10):
+        from sklearn.metrics.pairwise import cosine_similarity
+        if not self.optativas:
+            return []
+        similitud_total = [0.0 for _ in self.optativas]
+        palabras_prohibidas, palabras_normales, palabras_con_peso = clasificar_tokens(query)
+
+        # TF-IDF para términos normales y con estrellas (catálogo y comentarios)
+        for palabra in palabras_normales + [p for p, _ in palabras_con_peso]:
+            similitudes = cosine_similarity(self.vectorizer.transform([palabra]), self.matriz)[0]
+            for i in range(len(similitudes)):
+                similitud_total[i] += similitudes[i]
+            if self.peso_resenas:
+                similitudes = self._similitud_resenas(palabra)
+                if similitudes is not None:
+                    for i in range(len(similitudes)):
+                        similitud_total[i] += self.peso_resenas * similitudes[i]
+
+        # Términos con estrellas → score adicional
+        for palabra, peso in palabras_con_peso:
+            for i, texto_opt in enumerate(self._textos):
+                if palabra in texto_opt:
+                    similitud_total[i] += peso_base * peso
+
+        # ⚠️ Eliminar optativas que contengan alguna palabra prohibida
+        for i, texto_opt in enumerate(self._textos):
+            if any(palabra in texto_opt for palabra in palabras_prohibidas):
+                similitud_total[i] = 0.0
+
+        # La puntuación previa solo reordena optativas que ya coinciden con la consulta
+        if self.peso_puntuacion:
+            for i in range(len(similitud_total)):
+                if similitud_total[i] > 0:
+                    similitud_total[i] += self.peso_puntuacion * self.puntuacion_previa(i)
+
+        # Ordenar y devolver
+        resultados = sorted(zip(self.optativas, similitud_total), key=lambda x: x[1], reverse=True)
+        return [opt for opt, score in resultados if score > 0][:limite]
+
+def buscar_optativas(query, peso_base=0.1):
+    indice = IndiceBusqueda()
+    indice.reconstruir(cargar_optativas())
+    return indice.buscar(query, peso_base)
 
 if __name__ == "__main__":
+    # Forzar UTF-8 en stdout
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
     consulta = " ".join(sys.argv[1:])
     if not consulta.strip():
         print(json.dumps({"error": "Consulta vacía."}))
@@ -0,0 +1,332 @@
+"""
+Cola central de mensajes salientes hacia Telegram.
+
+Todos los envíos pasan por una sola cola que respeta los límites de Telegram
+(unos 30 mensajes por segundo en total y alrededor de uno por segundo por
+chat) con cubetas de tokens globales y por chat. Mientras un chat espera su
+turno, los mensajes consecutivos que se le encolan se fusionan en uno solo
+hasta el largo máximo, así una consulta con varios resultados no gasta una
+llamada a la API por resultado.
+
+Solo necesita un objeto con un método async send_message(chat_id, text, ...),
+por lo que puede probarse con un bot falso local.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+from telegram.error import BadRequest, RetryAfter
+
+# Telegram admite 4096 unidades UTF-16 por mensaje; se deja margen, como en enviar_mensaje_largo
+LARGO_MAXIMO = 4000
+
+
+def largo_utf16(texto):
+    """Largo del texto como lo cuenta Telegram (los emoji y otros caracteres fuera del BMP cuentan 2)."""
+    return len(texto) + sum(1 for c in texto if ord(c) > 0xFFFF)
+
+
+def dividir(texto, largo_maximo):
+    """Parte el texto en trozos de hasta largo_maximo unidades UTF-16."""
+    if len(texto) * 2 <= largo_maximo or largo_utf16(texto) <= largo_maximo:
+        return [texto]
+    partes = []
+    inicio = largo = 0
+    for i, c in enumerate(texto):
+        ancho = 2 if ord(c) > 0xFFFF else 1
+        if largo + ancho > largo_maximo:
+            partes.append(texto[inicio:i])
+            inicio, largo = i, 0
+        largo += ancho
+    partes.append(texto[inicio:])
+    return partes
+
+
+class CuboTokens:
+    """Cubeta de tokens: permite ráfagas de 'capacidad' y repone 'tasa' tokens por segundo."""
+
+    def __init__(self, capacidad, tasa, reloj=time.monotonic):
+        self.capacidad = capacidad
+        self.tasa = tasa
+        self._reloj = reloj
+        self._tokens = capacidad
+        self._ultimo = reloj()
+        self._pausa_hasta = 0.0
+
+    def _reponer(self):
+        ahora = self._reloj()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+        return ahora
+
+    def espera(self):
+        """Segundos que faltan para poder tomar un token (0 si ya hay uno)."""
+        ahora = self._reponer()
+        if ahora < self._pausa_hasta:
+            return self._pausa_hasta - ahora
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.tasa
+
+    def tomar(self):
+        self._reponer()
+        self._tokens -= 1
+
+    def pausar(self, segundos):
+        """Bloquea la cubeta (por ejemplo, tras un RetryAfter de Telegram)."""
+        self._pausa_hasta = max(self._pausa_hasta, self._reponer() + segundos)
+        self._tokens = 0
+
+
+class _Envio:
+    # Mensaje a enviar: una o más partes fusionadas, cada una con el futuro de quien la encoló
+    def __init__(self, chat_id, parse_mode, fusionable=True):
+        self.chat_id = chat_id
+        self.parse_mode = parse_mode
+        self.reply_markup = None
+        self.partes = []
+        self.futuros = []
+        self.largo = 0
+        self.fusionable = fusionable
+        self.intentos = 0
+
+    @property
+    def texto(self):
+        return "\n\n".join(self.partes)
+
+    def agregar(self, texto, futuro, reply_markup):
+        self.largo += largo_utf16(texto) + (2 if self.partes else 0)
+        self.partes.append(texto)
+        self.futuros.append(futuro)
+        self.reply_markup = reply_markup
+
+    def admite(self, texto, parse_mode, largo_maximo):
+        return (
+            self.fusionable
+            and self.reply_markup is None
+            and self.parse_mode == parse_mode
+            and self.largo + 2 + largo_utf16(texto) <= largo_maximo
+        )
+
+    def separar(self):
+        """Un envío sin fusionar por parte; el teclado queda en la última."""
+        separados = []
+        for i, (texto, futuro) in enumerate(zip(self.partes, self.futuros)):
+            envio = _Envio(self.chat_id, self.parse_mode, fusionable=False)
+            envio.agregar(texto, futuro, self.reply_markup if i == len(self.partes) - 1 else None)
+            separados.append(envio)
+        return separados
+
+
+async def _todas(futuros):
+    # Falla con el primer error, pero recoge los demás para que no queden sin leer
+    resultados = await asyncio.gather(*futuros, return_exceptions=True)
+    for resultado in resultados:
+        if isinstance(resultado, BaseException):
+            raise resultado
+    return resultados[-1]
+
+
+class ColaEnvios:
+    """
+    Cola de envíos con un orden estricto por chat y concurrencia entre chats.
+
+    Cada chat tiene como máximo un envío en curso, de modo que sus mensajes
+    llegan en el orden en que se encolaron. Un RetryAfter pausa la cubeta del
+    chat (y la global, porque Telegram limita al bot completo) y el envío se
+    reintenta al frente de su chat. Si Telegram rechaza un mensaje fusionado
+    (por ejemplo, por un Markdown inválido en una de sus partes), las partes
+    se reenvían por separado y la que falla sola se reintenta sin formato.
+    """
+
+    def __init__(self, bot, limite_global=30, limite_chat=1, rafaga_chat=3,
+                 largo_maximo=LARGO_MAXIMO, max_reintentos=5):
+        self.bot = bot
+        self.largo_maximo = largo_maximo
+        self.max_reintentos = max_reintentos
+        self._cubo_global = CuboTokens(limite_global, limite_global)
+        self._limite_chat = limite_chat
+        self._rafaga_chat = rafaga_chat
+        self._cubos_chat = {}
+        self._pendientes = {}       # chat_id → deque de _Envio
+        self._listos = deque()      # chats con pendientes y sin envío en curso
+        self._en_curso = set()
+        self._hay_trabajo = asyncio.Event()
+        self._tarea = None
+        self._envios_activos = set()
+        self.estadisticas = {"encolados": 0, "enviados": 0, "fusionados": 0, "reintentos": 0, "errores": 0, "espera_retry": 0.0}
+
+    # ---------- API pública ----------
+
+    def encolar(self, chat_id, texto, parse_mode=None, reply_markup=None):
+        """
+        Encola un mensaje y devuelve un futuro con el Message enviado.
+        Los textos más largos que el límite se dividen en varios mensajes: el
+        futuro se completa cuando se entregaron todos (con el Message del
+        último) o falla con el error de la primera parte que no se pudo enviar.
+        """
+        self.estadisticas["encolados"] += 1
+        partes = dividir(texto, self.largo_maximo)
+        cola = self._pendientes.setdefault(chat_id, deque())
+        futuros = []
+        for i, parte in enumerate(partes):
+            markup = reply_markup if i == len(partes) - 1 else None
+            futuro = asyncio.get_running_loop().create_future()
+            # Solo se fusiona con el último pendiente del chat, que aún no se está enviando
+            if cola and cola[-1].admite(parte, parse_mode, self.largo_maximo):
+                self.estadisticas["fusionados"] += 1
+            else:
+                cola.append(_Envio(chat_id, parse_mode))
+            cola[-1].agregar(parte, futuro, markup)
+            futuros.append(futuro)
+        if chat_id not in self._en_curso and chat_id not in self._listos:
+            self._listos.append(chat_id)
+        self._hay_trabajo.set()
+        return futuros[0] if len(futuros) == 1 else asyncio.ensure_future(_todas(futuros))
+
+    async def enviar(self, chat_id, texto, parse_mode=None, reply_markup=None):
+        """Encola un mensaje y espera a que se entregue."""
+        return await self.encolar(chat_id, texto, parse_mode, reply_markup)
+
+    def profundidad(self):
+        """Cantidad de mensajes (ya fusionados) pendientes de enviar."""
+        return sum(len(cola) for cola in self._pendientes.values())
+
+    async def iniciar(self):
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._despachar())
+
+    async def detener(self, vaciar=True, plazo=10.0):
+        """
+        Detiene el despacho; si vaciar es True antes entrega lo pendiente,
+        esperando como mucho 'plazo' segundos (un RetryAfter largo podría
+        demorarlo sin fin). Los mensajes que no salieron se descartan y sus
+        futuros se cancelan. Devuelve cuántos se descartaron.
+        """
+        if self._tarea is None:
+            return 0
+        if vaciar:
+            limite = time.monotonic() + plazo
+            while (self.profundidad() or self._en_curso) and time.monotonic() < limite:
+                await asyncio.sleep(0.05)
+        self._tarea.cancel()
+        for tarea in list(self._envios_activos):
+            tarea.cancel()
+        for tarea in [self._tarea, *self._envios_activos]:
+            try:
+                await tarea
+            except asyncio.CancelledError:
+                pass
+        self._tarea = None
+        descartados = 0
+        for cola in self._pendientes.values():
+            for envio in cola:
+                descartados += 1
+                for futuro in envio.futuros:
+                    futuro.cancel()
+        self._pendientes.clear()
+        self._listos.clear()
+        return descartados
+
+    # ---------- Despacho ----------
+
+    def _cubo_chat(self, chat_id):
+        cubo = self._cubos_chat.get(chat_id)
+        if cubo is None:
+            cubo = self._cubos_chat[chat_id] = CuboTokens(self._rafaga_chat, self._limite_chat)
+        return cubo
+
+    async def _despachar(self):
+        while True:
+            if not self._listos:
+                self._hay_trabajo.clear()
+                await self._hay_trabajo.wait()
+                continue
+
+            espera_global = self._cubo_global.espera()
+            if espera_global:
+                await self._dormir(espera_global)
+                continue
+
+            # Primer chat listo cuya cubeta tenga token; los demás conservan su turno
+            minima = None
+            for _ in range(len(self._listos)):
+                chat_id = self._listos.popleft()
+                espera = self._cubo_chat(chat_id).espera()
+                if not espera:
+                    break
+                self._listos.append(chat_id)
+                minima = espera if minima is None else min(minima, espera)
+            else:
+                await self._dormir(minima)
+                continue
+
+            self._cubo_global.tomar()
+            self._cubo_chat(chat_id).tomar()
+            envio = self._pendientes[chat_id].popleft()
+            self._en_curso.add(chat_id)
+            tarea = asyncio.create_task(self._enviar(envio))
+            self._envios_activos.add(tarea)
+            tarea.add_done_callback(self._envios_activos.discard)
+
+    async def _dormir(self, segundos):
+        # Despierta antes si llega trabajo nuevo que quizá pueda salir ya
+        self._hay_trabajo.clear()
+        try:
+            await asyncio.wait_for(self._hay_trabajo.wait(), timeout=segundos)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _enviar(self, envio):
+        chat_id = envio.chat_id
+        try:
+            mensaje = await self.bot.send_message(
+                chat_id=chat_id, text=envio.texto,
+                parse_mode=envio.parse_mode, reply_markup=envio.reply_markup,
+            )
+        except RetryAfter as e:
+            espera = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            self.estadisticas["reintentos"] += 1
+            self.estadisticas["espera_retry"] += espera
+            envio.intentos += 1
+            if envio.intentos > self.max_reintentos:
+                self._fallar(envio, e)
+            else:
+                self._cubo_chat(chat_id).pausar(espera)
+                self._cubo_global.pausar(espera)
+                self._pendientes.setdefault(chat_id, deque()).appendleft(envio)
+        except BadRequest as e:
+            # Un formato inválido en una parte no debe arrastrar a las demás: las partes
+            # fusionadas se reenvían por separado, y una parte sola, sin formato
+            if len(envio.partes) > 1:
+                self._pendientes.setdefault(chat_id, deque()).extendleft(reversed(envio.separar()))
+            elif envio.parse_mode is not None and "parse" in str(e).lower():
+                envio.parse_mode = None
+                self._pendientes.setdefault(chat_id, deque()).appendleft(envio)
+            else:
+                self._fallar(envio, e)
+        except asyncio.CancelledError:
+            # La cola se está deteniendo: vuelve al frente para que detener() lo descarte
+            self._pendientes.setdefault(chat_id, deque()).appendleft(envio)
+            raise
+        except Exception as e:
+            self._fallar(envio, e)
+        else:
+            self.estadisticas["enviados"] += 1
+            for futuro in envio.futuros:
+                if not futuro.done():
+                    futuro.set_result(mensaje)
+        finally:
+            self._en_curso.discard(chat_id)
+            if self._pendientes.get(chat_id):
+                self._listos.append(chat_id)
+            else:
+                self._pendientes.pop(chat_id, None)
+            self._hay_trabajo.set()
+
+    def _fallar(self, envio, error):
+        self.estadisticas["errores"] += 1
+        for futuro in envio.futuros:
+            if not futuro.done():
+                futuro.set_exception(error)
@@ -0,0 +1,156 @@
+"""
+Persistencia de sesiones y conversaciones entre reinicios del bot.
+
+Guarda el user_data de cada usuario (sesión de profesor, datos de una
+reseña u optativa a medio crear, estado del menú) y el paso en que está
+cada conversación persistente. Se apoya en un DiarioJSON: cada cambio es
+una línea compacta en el diario y de vez en cuando se compacta en una
+instantánea.
+
+python-telegram-bot llama a los update_* cada 'intervalo' segundos solo
+para los usuarios y conversaciones que se tocaron en ese tiempo, y una vez
+más al apagarse. Aquí solo se anotan los que cambiaron de verdad, y todo lo
+anotado en una misma ronda sale en una sola escritura por el almacén. Un
+cierre abrupto pierde como mucho los últimos 'intervalo' segundos.
+"""
+
+import asyncio
+import copy
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import DiarioJSON, compactar_en_fondo
+
+
+def clave_sesion(registro):
+    if "u" in registro:
+        return ("u", registro["u"])
+    return ("c", registro["c"], tuple(registro["k"]))
+
+
+class PersistenciaSesiones(BasePersistence):
+    """
+    Parámetros:
+      - ruta_instantanea, ruta_diario: archivos del DiarioJSON
+      - almacen: AlmacenAsincrono por el que pasan las escrituras
+      - intervalo: segundos entre dos rondas de guardado
+    """
+
+    def __init__(self, ruta_instantanea, ruta_diario, almacen, intervalo=5, umbral_compactacion=500):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=intervalo,
+        )
+        self.diario = DiarioJSON(ruta_instantanea, ruta_diario, clave_sesion, umbral_compactacion, indent=None)
+        self.almacen = almacen
+        # Lo último que se escribió: usuario → datos, conversación → {clave: estado}
+        self._usuarios = None
+        self._conversaciones = {}
+        self._pendientes = []
+        # La compactación en curso, para esperarla al apagar
+        self._compactacion = None
+
+    async def _cargar(self):
+        if self._usuarios is not None:
+            return
+        self._usuarios = {}
+        for registro in await self.almacen.ejecutar(self.diario.cargar):
+            if "u" in registro:
+                if registro["d"] is not None:
+                    self._usuarios[registro["u"]] = registro["d"]
+            elif registro["s"] is not None:
+                self._conversaciones.setdefault(registro["c"], {})[tuple(registro["k"])] = registro["s"]
+
+    def registros_vigentes(self):
+        registros = [{"u": usuario, "d": datos} for usuario, datos in self._usuarios.items()]
+        for nombre, estados in self._conversaciones.items():
+            registros += [{"c": nombre, "k": list(clave), "s": estado} for clave, estado in estados.items()]
+        return registros
+
+    async def _anotar(self, registro):
+        self._pendientes.append(registro)
+        if len(self._pendientes) > 1:
+            return  # Ya hay una escritura en camino: este registro sale con ella
+        # Cede el turno para que el resto de la ronda de guardado anote lo suyo
+        await asyncio.sleep(0)
+        lote, self._pendientes = self._pendientes, []
+        await self.almacen.ejecutar(self.diario.anexar_lote, lote)
+        if self.diario.reservar_compactacion():
+            generacion = await self.almacen.ejecutar(self.diario.rotar)
+            copias = copy.deepcopy(self.registros_vigentes())
+            self._compactacion = asyncio.create_task(compactar_en_fondo(self.diario, copias, generacion))
+
+    # ---------- Datos de usuario ----------
+
+    async def get_user_data(self):
+        await self._cargar()
+        return copy.deepcopy(self._usuarios)
+
+    async def update_user_data(self, user_id, data):
+        data = data or None
+        if self._usuarios.get(user_id) == data:
+            return
+        if data is None:
+            del self._usuarios[user_id]
+        else:
+            self._usuarios[user_id] = data
+        await self._anotar({"u": user_id, "d": data})
+
+    async def drop_user_data(self, user_id):
+        if self._usuarios.pop(user_id, None) is not None:
+            await self._anotar({"u": user_id, "d": None})
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    # ---------- Conversaciones ----------
+
+    async def get_conversations(self, name):
+        await self._cargar()
+        return dict(self._conversaciones.get(name, {}))
+
+    async def update_conversation(self, name, key, new_state):
+        estados = self._conversaciones.setdefault(name, {})
+        if estados.get(key) == new_state:
+            return
+        if new_state is None:
+            del estados[key]
+        else:
+            estados[key] = new_state
+        await self._anotar({"c": name, "k": list(key), "s": new_state})
+
+    # ---------- Lo que no se guarda ----------
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        lote, self._pendientes = self._pendientes, []
+        if lote:
+            await self.almacen.ejecutar(self.diario.anexar_lote, lote)
+        if self._compactacion is not None:
+            await self._compactacion
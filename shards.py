@@ -0,0 +1,264 @@
+"""
+Fragmentos de datos: un padrón, catálogo, reseñas e índice de búsqueda
+independientes por facultad y semestre.
+
+El fragmento principal es la carpeta data de siempre y está siempre cargado.
+Los demás viven en data/fragmentos/<nombre>/ con los mismos archivos, se
+cargan la primera vez que alguien los usa y se descargan de memoria cuando
+pasan un tiempo sin uso. Como todas las lecturas y escrituras pasan por el
+hilo único del almacén, una recarga siempre ve las escrituras anteriores.
+
+Cada update se procesa dentro de GestorFragmentos.usar(), que fija el
+fragmento en curso en una variable de contexto. Las tareas que se crean
+desde el handler heredan ese contexto, así que el código de los handlers
+puede seguir usando nombres globales (padron, catalogo...) a través de
+VistaFragmento sin pasar el fragmento de mano en mano.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import os
+import re
+import time
+
+from archive import ArchivoSemestres
+from indexes import Catalogo, ContadorPlazas, ListaEspera, Padron
+from reviews import IndiceResenas, clave_resena
+from search_engine import IndiceBusqueda
+from storage import DiarioJSON
+
+NOMBRE_PRINCIPAL = "principal"
+PATRON_NOMBRE = re.compile(r"[\w-]{1,40}")
+
+
+class FragmentoNoDisponible(Exception):
+    """El fragmento pedido no se pudo cargar. El update no se procesa con otro en su lugar."""
+
+
+class Fragmento:
+    """
+    Datos en memoria de un fragmento. Los archivos se llaman igual que en el
+    fragmento principal, pero dentro de 'carpeta' (ver ruta()).
+    """
+
+    def __init__(self, nombre, carpeta, ruta_resenas, ruta_diario_resenas, pesos_busqueda=(0.5, 0.0)):
+        self.nombre = nombre
+        self.carpeta = carpeta
+        self.padron = Padron()
+        self.catalogo = Catalogo()
+        self.libro_plazas = ContadorPlazas()
+        self.lista_espera = ListaEspera()
+        self.indice_resenas = IndiceResenas()
+        self.diario_resenas = DiarioJSON(self.ruta(ruta_resenas), self.ruta(ruta_diario_resenas), clave_resena)
+        self.indice_busqueda = IndiceBusqueda(*pesos_busqueda)
+        # Semestres cerrados: particiones comprimidas y resumen de sus reseñas (ver archive)
+        self.archivo = ArchivoSemestres(self.ruta("archivo"))
+        self.busqueda_lista = asyncio.Event()
+        # Preferencias de los estudiantes: (nombre, grupo) → optativas en orden
+        self.preferencias = {}
+        # Mensajes ya renderizados: las versiones del catálogo de cada fragmento son independientes
+        self.mensajes_catalogo = {}
+        self.tarjetas_optativas = {}
+        self.paginas_resenas = {}
+        self.cerrojo_asignacion = asyncio.Lock()
+        # Updates que lo están usando y último momento en que se usó (para descargarlo)
+        self.en_uso = 0
+        self.ultimo_uso = time.monotonic()
+
+    def ruta(self, archivo):
+        return os.path.join(self.carpeta, os.path.basename(archivo))
+
+    def ocupado(self):
+        """True si descargarlo ahora podría perder trabajo en curso."""
+        return self.en_uso > 0 or self.cerrojo_asignacion.locked() or self.diario_resenas.compactando
+
+
+class GestorFragmentos:
+    """
+    Parámetros:
+      - principal: Fragmento de la carpeta data, cargado al arrancar
+      - carpeta_base: carpeta que contiene un subdirectorio por fragmento
+      - nuevo: función (nombre, carpeta) → Fragmento vacío
+      - cargar: función bloqueante que llena un Fragmento desde sus archivos;
+        corre en el hilo del almacén
+      - al_cargar: función opcional que se llama en el bucle con cada
+        fragmento recién cargado (por ejemplo, para ajustar su índice de búsqueda)
+      - inactividad: segundos sin uso tras los que se descarga un fragmento
+    """
+
+    def __init__(self, principal, carpeta_base, nuevo, cargar, almacen, al_cargar=None, inactividad=900, intervalo=60):
+        self.principal = principal
+        self.carpeta_base = carpeta_base
+        self.nuevo = nuevo
+        self.cargar = cargar
+        self.almacen = almacen
+        self.al_cargar = al_cargar
+        self.inactividad = inactividad
+        self.intervalo = intervalo
+        self.cargas = 0
+        self.descargas = 0
+        self._cargados = {principal.nombre: principal}
+        self._cargando = {}
+        self._actual = contextvars.ContextVar("fragmento", default=None)
+        self._tarea = None
+
+    def actual(self):
+        """Fragmento del update en curso (el principal fuera de un update)."""
+        return self._actual.get() or self.principal
+
+    def cargados(self):
+        return list(self._cargados)
+
+    def carpeta_de(self, nombre):
+        if nombre == self.principal.nombre:
+            return self.principal.carpeta
+        return os.path.join(self.carpeta_base, nombre)
+
+    def _listar(self):
+        if not os.path.isdir(self.carpeta_base):
+            return []
+        return sorted(n for n in os.listdir(self.carpeta_base) if os.path.isdir(os.path.join(self.carpeta_base, n)))
+
+    async def disponibles(self):
+        """Nombres de todos los fragmentos, cargados o no, empezando por el principal."""
+        return [self.principal.nombre] + await self.almacen.ejecutar(self._listar)
+
+    async def existe(self, nombre):
+        if nombre in self._cargados:
+            return True
+        return bool(PATRON_NOMBRE.fullmatch(nombre)) and await self.almacen.ejecutar(os.path.isdir, self.carpeta_de(nombre))
+
+    async def crear(self, nombre):
+        """Crea la carpeta de un fragmento vacío. Lanza ValueError si el nombre no es válido."""
+        if not PATRON_NOMBRE.fullmatch(nombre) or nombre == self.principal.nombre:
+            raise ValueError("El nombre solo puede tener letras, números, '_' y '-' (hasta 40 caracteres).")
+        await self.almacen.ejecutar(lambda: os.makedirs(self.carpeta_de(nombre), exist_ok=True))
+
+    async def obtener(self, nombre):
+        """
+        Devuelve el fragmento, cargándolo si hace falta. Varios updates que lo
+        piden a la vez esperan a la misma carga. Lanza ValueError si no existe.
+        """
+        fragmento = self._cargados.get(nombre)
+        if fragmento is not None:
+            return fragmento
+        tarea = self._cargando.get(nombre)
+        if tarea is None:
+            tarea = asyncio.ensure_future(self._cargar(nombre))
+            self._cargando[nombre] = tarea
+            tarea.add_done_callback(lambda _: self._cargando.pop(nombre, None))
+        return await asyncio.shield(tarea)
+
+    async def _cargar(self, nombre):
+        if not await self.existe(nombre):
+            raise ValueError(f"No existe el fragmento '{nombre}'.")
+        inicio = time.perf_counter()
+        fragmento = self.nuevo(nombre, self.carpeta_de(nombre))
+        await self.almacen.ejecutar(self.cargar, fragmento)
+        self._cargados[nombre] = fragmento
+        self.cargas += 1
+        print(f"🗂️ Fragmento '{nombre}' cargado en {time.perf_counter() - inicio:.2f} s ({len(fragmento.padron)} estudiantes)")
+        if self.al_cargar is not None:
+            self.al_cargar(fragmento)
+        return fragmento
+
+    @contextlib.asynccontextmanager
+    async def usar(self, nombre=None):
+        """
+        Procesa lo que haya dentro con el fragmento dado como fragmento en
+        curso. Si no se puede cargar lanza FragmentoNoDisponible: usar otro
+        en su lugar haría que los cambios del usuario caigan en datos ajenos.
+        """
+        fragmento = self.principal
+        if nombre and nombre != self.principal.nombre:
+            try:
+                fragmento = await self.obtener(nombre)
+            except (OSError, ValueError) as e:
+                raise FragmentoNoDisponible(f"No se pudo cargar '{nombre}': {e}") from e
+        fragmento.en_uso += 1
+        token = self._actual.set(fragmento)
+        try:
+            yield fragmento
+        finally:
+            self._actual.reset(token)
+            fragmento.en_uso -= 1
+            fragmento.ultimo_uso = time.monotonic()
+
+    def descargar_inactivos(self):
+        """Quita de memoria los fragmentos sin uso reciente. Devuelve sus nombres."""
+        limite = time.monotonic() - self.inactividad
+        descargados = [
+            nombre for nombre, fragmento in self._cargados.items()
+            if fragmento is not self.principal and fragmento.ultimo_uso < limite and not fragmento.ocupado()
+        ]
+        for nombre in descargados:
+            del self._cargados[nombre]
+        self.descargas += len(descargados)
+        return descargados
+
+    async def iniciar(self):
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._descargar_periodicamente())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    async def _descargar_periodicamente(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            for nombre in self.descargar_inactivos():
+                print(f"🗂️ Fragmento '{nombre}' descargado por inactividad")
+
+
+class VistaFragmento:
+    """
+    Acceso a un atributo del fragmento en curso como si fuera un objeto
+    global: VistaFragmento(gestor, "padron") se comporta como el Padron del
+    fragmento del update que se está procesando.
+    """
+
+    __slots__ = ("_gestor", "_atributo")
+
+    def __init__(self, gestor, atributo):
+        self._gestor = gestor
+        self._atributo = atributo
+
+    def _objeto(self):
+        return getattr(self._gestor.actual(), self._atributo)
+
+    def __getattr__(self, nombre):
+        return getattr(self._objeto(), nombre)
+
+    def __iter__(self):
+        return iter(self._objeto())
+
+    def __len__(self):
+        return len(self._objeto())
+
+    def __bool__(self):
+        return bool(self._objeto())
+
+    def __contains__(self, clave):
+        return clave in self._objeto()
+
+    def __getitem__(self, clave):
+        return self._objeto()[clave]
+
+    def __setitem__(self, clave, valor):
+        self._objeto()[clave] = valor
+
+    def __delitem__(self, clave):
+        del self._objeto()[clave]
+
+    async def __aenter__(self):
+        return await self._objeto().__aenter__()
+
+    async def __aexit__(self, *excepcion):
+        return await self._objeto().__aexit__(*excepcion)
@@ -0,0 +1,60 @@
+"""
+Planillas CSV/TSV del padrón para importar y exportar cohortes completas.
+
+Se leen y escriben en UTF-8 con BOM, que es lo que Excel y LibreOffice
+reconocen sin preguntar. Las funciones trabajan fila a fila y no tocan los
+índices del bot, así que pueden correr en el hilo del almacén.
+"""
+
+import csv
+import io
+
+COLUMNAS = ("nombre", "grupo", "optativa", "lista_espera")
+
+
+def delimitador_de(nombre_archivo, contenido):
+    """Tabulador para .tsv; para .csv, ';' si la primera línea tiene más ';' que ',' (Excel en español)."""
+    if nombre_archivo.lower().endswith(".tsv"):
+        return "\t"
+    primera = contenido[:contenido.find(b"\n")] if b"\n" in contenido else contenido
+    return ";" if primera.count(b";") > primera.count(b",") else ","
+
+
+def leer_planilla(contenido, delimitador):
+    """
+    Recorre las filas de la planilla y devuelve (número de fila, nombre, grupo,
+    optativa). Si la primera fila tiene una columna 'nombre' se toma como
+    encabezado; si no, las columnas son nombre, grupo y optativa en ese orden.
+    Lanza ValueError si el archivo no es texto UTF-8 o falta la columna 'grupo'.
+    """
+    flujo = io.TextIOWrapper(io.BytesIO(contenido), encoding="utf-8-sig", newline="")
+    indices = (0, 1, 2)
+    try:
+        for numero, fila in enumerate(csv.reader(flujo, delimiter=delimitador), 1):
+            celdas = [celda.strip() for celda in fila]
+            if numero == 1 and "nombre" in (celda.lower() for celda in celdas):
+                encabezado = [celda.lower() for celda in celdas]
+                indices = tuple(encabezado.index(c) if c in encabezado else None for c in COLUMNAS[:3])
+                if indices[1] is None:
+                    raise ValueError("La planilla no tiene la columna 'grupo'.")
+                continue
+            if not any(celdas):
+                continue
+            yield (numero,) + tuple(
+                celdas[i] if i is not None and i < len(celdas) else "" for i in indices
+            )
+    except csv.Error as e:
+        raise ValueError(f"La planilla no es válida: {e}")
+
+
+def escribir_planilla(filas, delimitador):
+    """Genera la planilla a partir de un iterable de filas (ver COLUMNAS) y devuelve sus bytes."""
+    salida = io.BytesIO()
+    flujo = io.TextIOWrapper(salida, encoding="utf-8-sig", newline="")
+    escritor = csv.writer(flujo, delimiter=delimitador)
+    escritor.writerow(COLUMNAS)
+    escritor.writerows(filas)
+    flujo.flush()
+    contenido = salida.getvalue()
+    flujo.detach()
+    return contenido
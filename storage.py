@@ -0,0 +1,285 @@
+"""
+Persistencia de los datos del bot en disco.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from records import Registro, como_json
+
+
+def escribir_json_atomico(ruta, datos, indent=4):
+    """Escribe un JSON en un archivo temporal y lo renombra, para no dejar archivos a medias."""
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(datos, f, indent=indent, ensure_ascii=False, default=como_json)
+    os.replace(temporal, ruta)
+
+
+def escribir_texto_atomico(ruta, texto):
+    """Como escribir_json_atomico, para archivos de texto (crea la carpeta si hace falta)."""
+    carpeta = os.path.dirname(ruta)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        f.write(texto)
+    os.replace(temporal, ruta)
+
+
+def leer_json(ruta, defecto=None):
+    """Lee un JSON; si el archivo no existe o está vacío devuelve 'defecto'."""
+    if not os.path.exists(ruta) or os.stat(ruta).st_size == 0:
+        return defecto
+    with open(ruta, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iterar_lista_json(flujo, tam_bloque=1 << 16):
+    """
+    Recorre una lista JSON leyendo el flujo de texto por bloques y devuelve
+    sus elementos uno a uno, sin decodificar el documento de una vez. Lanza
+    ValueError si el contenido no es una lista JSON bien formada.
+    """
+    decodificador = json.JSONDecoder()
+    texto = flujo.read(tam_bloque).lstrip("\ufeff")
+    pos = 0
+    agotado = False
+
+    def siguiente_caracter():
+        # Salta espacios leyendo más si hace falta; devuelve '' al final del flujo
+        nonlocal texto, pos, agotado
+        while True:
+            while pos < len(texto) and texto[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(texto) or agotado:
+                return texto[pos:pos + 1]
+            bloque = flujo.read(tam_bloque)
+            agotado = not bloque
+            texto, pos = texto[pos:] + bloque, 0
+
+    if siguiente_caracter() != "[":
+        raise ValueError("Se esperaba una lista JSON.")
+    pos += 1
+    if siguiente_caracter() == "]":
+        return
+    while True:
+        siguiente_caracter()
+        while True:
+            try:
+                elemento, fin = decodificador.raw_decode(texto, pos)
+            except json.JSONDecodeError:
+                if agotado:
+                    raise
+                fin = None
+            # Un valor que llega justo al final del bloque puede estar cortado (p. ej. un número)
+            if fin is not None and (fin < len(texto) or agotado):
+                break
+            bloque = flujo.read(tam_bloque)
+            agotado = not bloque
+            texto, pos = texto[pos:] + bloque, 0
+        pos = fin
+        yield elemento
+        separador = siguiente_caracter()
+        pos += 1
+        if separador == "]":
+            if siguiente_caracter():
+                raise ValueError("Contenido extra después de la lista JSON.")
+            return
+        if separador != ",":
+            raise ValueError("Se esperaba ',' o ']' entre los elementos de la lista.")
+
+
+def leer_bytes(ruta):
+    """Contenido binario del archivo, o None si no existe."""
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, "rb") as f:
+        return f.read()
+
+
+class AlmacenAsincrono:
+    """
+    Acceso a disco awaitable para los handlers.
+
+    Todas las operaciones de archivo se ejecutan en un hilo dedicado, nunca
+    en el hilo del bucle de eventos. Con un solo hilo las escrituras se
+    aplican en el mismo orden en que se pidieron, así que la última
+    escritura de un archivo siempre es la que queda.
+    """
+
+    def __init__(self, max_hilos=1):
+        self._hilos = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="almacen")
+
+    async def ejecutar(self, funcion, *args):
+        """Ejecuta una función bloqueante en el hilo del almacén y espera su resultado."""
+        return await asyncio.get_running_loop().run_in_executor(self._hilos, funcion, *args)
+
+    async def leer_json(self, ruta, defecto=None):
+        return await self.ejecutar(leer_json, ruta, defecto)
+
+    async def leer_bytes(self, ruta):
+        return await self.ejecutar(leer_bytes, ruta)
+
+    async def escribir_json(self, ruta, datos, indent=4):
+        # Copia superficial de los registros: el bucle puede seguir modificándolos
+        # mientras el hilo los serializa
+        if isinstance(datos, list):
+            datos = [
+                r.como_dict() if isinstance(r, Registro) else dict(r) if isinstance(r, dict) else r
+                for r in datos
+            ]
+        await self.ejecutar(escribir_json_atomico, ruta, datos, indent)
+
+    def cerrar(self):
+        """Espera a que terminen las escrituras pendientes."""
+        self._hilos.shutdown(wait=True)
+
+
+class DiarioJSON:
+    """
+    Diario de solo anexado con instantánea compactada.
+
+    Cada cambio se agrega como una línea JSON al diario, en tiempo constante
+    sin importar cuántos registros haya. Al cargar se aplica la instantánea
+    y luego el diario, y para cada clave gana la última escritura.
+
+    La compactación se hace en dos pasos. rotar() renombra el diario actual
+    (rápido, en el hilo del bot) y compactar() escribe la nueva instantánea
+    y borra el diario rotado; este segundo paso puede ir en otro hilo porque
+    solo toca archivos que el bot ya no usa.
+    """
+
+    def __init__(self, ruta_instantanea, ruta_diario, clave, umbral_compactacion=500, indent=4):
+        self.ruta_instantanea = ruta_instantanea
+        self.ruta_diario = ruta_diario
+        self.ruta_rotado = ruta_diario + ".old"
+        self.clave = clave
+        self.umbral_compactacion = umbral_compactacion
+        self.indent = indent  # Sangría de la instantánea (None para el formato compacto)
+        self.pendientes = 0
+        self.compactando = False
+        # Protege la instantánea frente a un reinicio durante una compactación en otro hilo
+        self._cerrojo = threading.Lock()
+        self._generacion = 0
+
+    def _leer_instantanea(self):
+        return leer_json(self.ruta_instantanea, [])
+
+    def _leer_diario(self, ruta):
+        if not os.path.exists(ruta):
+            return []
+        registros = []
+        with open(ruta, "r", encoding="utf-8") as f:
+            for linea in f:
+                linea = linea.strip()
+                if not linea:
+                    continue
+                try:
+                    registros.append(json.loads(linea))
+                except json.JSONDecodeError:
+                    break  # Última línea incompleta por un cierre abrupto
+        return registros
+
+    def cargar(self):
+        """Devuelve los registros vigentes: instantánea + diario, ganando la última escritura."""
+        vigentes = {}
+        for registro in self._leer_instantanea():
+            vigentes[self.clave(registro)] = registro
+        rotado = self._leer_diario(self.ruta_rotado)
+        diario = self._leer_diario(self.ruta_diario)
+        for registro in rotado + diario:
+            clave = self.clave(registro)
+            vigentes.pop(clave, None)  # La reescritura pasa al final, como en la lista original
+            vigentes[clave] = registro
+        self.pendientes = len(diario)
+
+        registros = list(vigentes.values())
+        if rotado:
+            # Una compactación quedó a medias: se termina ahora
+            escribir_json_atomico(self.ruta_instantanea, registros, self.indent)
+            os.remove(self.ruta_rotado)
+        return registros
+
+    def anexar(self, registro):
+        with open(self.ruta_diario, "a", encoding="utf-8") as f:
+            f.write(json.dumps(registro, ensure_ascii=False, default=como_json) + "\n")
+        self.pendientes += 1
+
+    def anexar_lote(self, registros):
+        """Como anexar, con una sola escritura para varios registros."""
+        if not registros:
+            return
+        with open(self.ruta_diario, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False, separators=(",", ":"), default=como_json) + "\n" for r in registros))
+        self.pendientes += len(registros)
+
+    def necesita_compactar(self):
+        return not self.compactando and self.pendientes >= self.umbral_compactacion
+
+    def reservar_compactacion(self):
+        """
+        Comprueba y marca en un solo paso que hay que compactar, para que dos
+        anexados concurrentes no roten el diario dos veces.
+        """
+        if not self.necesita_compactar():
+            return False
+        self.compactando = True
+        return True
+
+    def rotar(self):
+        """
+        Aparta el diario actual para compactarlo; las nuevas escrituras van a
+        un diario vacío. Devuelve la generación que hay que pasar a compactar().
+        """
+        self.compactando = True
+        if os.path.exists(self.ruta_diario):
+            if os.path.exists(self.ruta_rotado):
+                # Una compactación anterior falló: el diario se suma al rotado en vez de pisarlo
+                with open(self.ruta_rotado, "a", encoding="utf-8") as destino, \
+                        open(self.ruta_diario, "r", encoding="utf-8") as origen:
+                    shutil.copyfileobj(origen, destino)
+                os.remove(self.ruta_diario)
+            else:
+                os.replace(self.ruta_diario, self.ruta_rotado)
+        self.pendientes = 0
+        return self._generacion
+
+    def compactar(self, registros, generacion):
+        """Escribe la instantánea con los registros vigentes al momento de rotar."""
+        try:
+            with self._cerrojo:
+                if generacion != self._generacion:
+                    return  # Hubo un reinicio mientras tanto
+                escribir_json_atomico(self.ruta_instantanea, registros, self.indent)
+                if os.path.exists(self.ruta_rotado):
+                    os.remove(self.ruta_rotado)
+        finally:
+            self.compactando = False
+
+    def reiniciar(self, registros):
+        """Reemplaza todo el contenido (instantánea nueva y diario vacío)."""
+        with self._cerrojo:
+            self._generacion += 1
+            escribir_json_atomico(self.ruta_instantanea, registros, self.indent)
+            for ruta in (self.ruta_diario, self.ruta_rotado):
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+        self.pendientes = 0
+
+
+async def compactar_en_fondo(diario, registros, generacion):
+    """
+    Corre diario.compactar() en otro hilo e informa si falla. 'registros'
+    tiene que ser una copia: el bucle sigue modificando los originales.
+    Si falla, el diario rotado queda en disco y la próxima compactación
+    (o el próximo arranque) lo vuelve a incluir.
+    """
+    try:
+        await asyncio.to_thread(diario.compactar, registros, generacion)
+    except Exception as e:
+        print(f"⚠️ No se pudo compactar {diario.ruta_instantanea}:", e)
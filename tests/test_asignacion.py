@@ -0,0 +1,90 @@
+"""
+Asignación automática: el flujo de costo mínimo de assignment_solver frente
+a una búsqueda exhaustiva en casos chicos, y la garantía de que quien ya
+tiene plaza no la pierde.
+"""
+
+import itertools
+import random
+import unittest
+
+from assignment_solver import resolver_asignacion
+
+
+def exhaustiva(preferencias, plazas, actuales):
+    """Mejor asignación por fuerza bruta: (titulares sin plaza, sin plaza, suma de posiciones)."""
+    claves = list(preferencias)
+    opciones = [
+        list(dict.fromkeys([*preferencias[c], *([actuales[c]] if c in actuales else [])])) + [None]
+        for c in claves
+    ]
+    mejor = None
+    for eleccion in itertools.product(*opciones):
+        ocupadas = {}
+        for optativa in eleccion:
+            if optativa is not None:
+                ocupadas[optativa] = ocupadas.get(optativa, 0) + 1
+        if any(plazas[o] != -1 and n > plazas[o] for o, n in ocupadas.items()):
+            continue
+        costo = (
+            sum(1 for c, o in zip(claves, eleccion) if o is None and c in actuales),
+            sum(1 for o in eleccion if o is None),
+            sum(op.index(o) for op, o in zip(opciones, eleccion) if o is not None),
+        )
+        if mejor is None or costo < mejor:
+            mejor = costo
+    return mejor
+
+
+def costo_de(resultado, preferencias, actuales):
+    posiciones = 0
+    for clave, optativa in resultado.items():
+        if optativa is not None:
+            lista = list(dict.fromkeys([*preferencias[clave], *([actuales[clave]] if clave in actuales else [])]))
+            posiciones += lista.index(optativa)
+    return (
+        sum(1 for c, o in resultado.items() if o is None and c in actuales),
+        sum(1 for o in resultado.values() if o is None),
+        posiciones,
+    )
+
+
+class ResolverAsignacion(unittest.TestCase):
+
+    def test_empate_conserva_la_plaza_del_titular(self):
+        preferencias = {("B", "1"): ["X"], ("A", "1"): ["X"]}
+        resultado = resolver_asignacion(preferencias, {"X": 1}, {("A", "1"): "X"})
+        self.assertEqual(resultado, {("B", "1"): None, ("A", "1"): "X"})
+
+    def test_sin_lugar_en_la_opcion_mejor_se_queda_donde_estaba(self):
+        resultado = resolver_asignacion({"A": ["Y", "X"], "B": ["X"]}, {"X": 1, "Y": 0}, {"A": "X"})
+        self.assertEqual(resultado, {"A": "X", "B": None})
+
+    def test_el_titular_cambia_a_una_opcion_mejor_y_libera_su_plaza(self):
+        resultado = resolver_asignacion({"A": ["Y", "X"], "B": ["X"]}, {"X": 1, "Y": 1}, {"A": "X"})
+        self.assertEqual(resultado, {"A": "Y", "B": "X"})
+
+    def test_optativa_actual_fuera_de_la_lista(self):
+        resultado = resolver_asignacion({"A": ["Y"], "B": ["X"]}, {"X": 1, "Y": 0}, {"A": "X"})
+        self.assertEqual(resultado, {"A": "X", "B": None})
+
+    def test_igual_que_la_busqueda_exhaustiva(self):
+        azar = random.Random(7)
+        optativas = ["X", "Y", "Z"]
+        for _ in range(300):
+            claves = [f"E{i}" for i in range(azar.randint(1, 5))]
+            preferencias = {c: azar.sample(optativas, azar.randint(0, 3)) for c in claves}
+            actuales = {c: azar.choice(optativas) for c in claves if azar.random() < 0.4}
+            # La plaza de cada titular está contada en las plazas libres
+            plazas = {o: azar.choice([-1, 0, 1, 2]) for o in optativas}
+            for optativa in actuales.values():
+                if plazas[optativa] != -1:
+                    plazas[optativa] += 1
+            resultado = resolver_asignacion(preferencias, plazas, actuales)
+            with self.subTest(preferencias=preferencias, plazas=plazas, actuales=actuales):
+                self.assertTrue(all(resultado[c] is not None for c in actuales))
+                self.assertEqual(costo_de(resultado, preferencias, actuales), exhaustiva(preferencias, plazas, actuales))
+
+
+if __name__ == "__main__":
+    unittest.main()
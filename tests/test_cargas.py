@@ -0,0 +1,110 @@
+"""
+Archivos subidos por los profesores: aplicar_estudiantes y aplicar_optativas
+solo aplican las diferencias y dejan el libro de plazas, las listas de espera
+y la versión del catálogo coherentes con el resultado.
+"""
+
+import tempfile
+import unittest
+from unittest import mock
+
+import main
+
+
+def optativa(nombre, plazas):
+    return {"nombre": nombre, "profesor": "P", "plazas": plazas, "relacionadas": [], "descripcion": ""}
+
+
+class AplicarCargas(unittest.TestCase):
+    """Trabaja sobre un fragmento vacío en una carpeta temporal."""
+
+    def setUp(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        self.fragmento = main.nuevo_fragmento("prueba", carpeta.name)
+        principal, main.fragmentos.principal = main.fragmentos.principal, self.fragmento
+        self.addCleanup(setattr, main.fragmentos, "principal", principal)
+        # El reajuste del índice de búsqueda es una tarea en segundo plano: aquí solo se cuenta
+        parche = mock.patch.object(main, "reindexar_busqueda")
+        self.reindexar = parche.start()
+        self.addCleanup(parche.stop)
+
+        self.catalogo = self.fragmento.catalogo
+        self.padron = self.fragmento.padron
+        self.plazas = self.fragmento.libro_plazas
+        self.espera = self.fragmento.lista_espera
+        self.catalogo.reconstruir([optativa("X", 2), optativa("Y", 1), optativa("Z", -1)])
+        for nombre, elegida in (("A", "X"), ("B", "X"), ("C", "Y"), ("D", "")):
+            self.padron.agregar(nombre, "C1", elegida)
+        self.plazas.reconstruir(self.catalogo, self.padron)
+        self.espera.agregar(self.padron.obtener("D", "C1"), "Y")
+
+    def inscritos(self, nombre):
+        return sorted(est["nombre"] for est in self.padron.de_optativa(nombre))
+
+    def test_estudiantes_altas_bajas_y_cambios(self):
+        version = self.catalogo.version
+        nuevos = [
+            {"nombre": "A", "grupo": "C1", "optativa": "X"},
+            {"nombre": "C", "grupo": "C1", "optativa": "X"},
+            {"nombre": "D", "grupo": "C1", "optativa": ""},
+            {"nombre": "E", "grupo": "C1", "optativa": "Z"},
+            {"nombre": "E", "grupo": "C1", "optativa": "Y"},  # Repetido: vale el primero
+        ]
+        self.assertEqual(main.aplicar_estudiantes(nuevos), (1, 1, 1))
+
+        self.assertIsNone(self.padron.obtener("B", "C1"))
+        self.assertEqual(self.inscritos("X"), ["A", "C"])
+        self.assertEqual(self.inscritos("Y"), [])
+        self.assertEqual(self.inscritos("Z"), ["E"])
+        self.assertEqual((self.plazas.ocupadas("X"), self.plazas.disponibles("X")), (2, 0))
+        self.assertEqual((self.plazas.ocupadas("Y"), self.plazas.disponibles("Y")), (0, 1))
+        self.assertEqual((self.plazas.ocupadas("Z"), self.plazas.disponibles("Z")), (1, -1))
+        # D sigue esperando su plaza en Y: la promoción la hace manejar_archivo después
+        self.assertEqual(self.espera.en_espera("Y"), 1)
+        self.assertEqual(self.catalogo.version, version)
+        self.reindexar.assert_not_called()
+
+    def test_optativas_altas_bajas_y_cambios(self):
+        version = self.catalogo.version
+        version_z = self.catalogo.version_de("Z")
+        nuevas = [optativa("X", 3), optativa("Z", -1), optativa("W", 1)]
+        self.assertEqual(main.aplicar_optativas(nuevas), (1, 1, 1, 1))
+
+        self.assertEqual(sorted(opt["nombre"] for opt in self.catalogo), ["W", "X", "Z"])
+        self.assertGreater(self.catalogo.version, version)
+        self.assertEqual(self.catalogo.version_de("Z"), version_z)  # Sin cambios: no se vuelve a agregar
+        self.assertEqual((self.plazas.capacidad("X"), self.plazas.ocupadas("X"), self.plazas.disponibles("X")), (3, 2, 1))
+        self.assertEqual((self.plazas.capacidad("W"), self.plazas.disponibles("W")), (1, 1))
+        self.assertIsNone(self.plazas.capacidad("Y"))
+        self.assertEqual(self.padron.obtener("C", "C1")["optativa"], "")
+        self.assertNotIn("espera", self.padron.obtener("D", "C1"))
+        self.reindexar.assert_called_once()
+
+    def test_optativas_sin_cambios(self):
+        version = self.catalogo.version
+        nuevas = [optativa("X", 2), optativa("Y", 1), optativa("Z", -1)]
+        self.assertEqual(main.aplicar_optativas(nuevas), (0, 0, 0, 0))
+        self.assertEqual(self.catalogo.version, version)
+        self.reindexar.assert_not_called()
+
+    def test_quitar_una_optativa_con_inscritos(self):
+        self.espera.agregar(self.padron.obtener("C", "C1"), "X")
+        self.assertEqual(main.aplicar_optativas([optativa("Y", 1), optativa("Z", -1)]), (0, 1, 0, 2))
+
+        self.assertEqual(self.inscritos("X"), [])
+        self.assertEqual(self.padron.obtener("A", "C1")["optativa"], "")
+        self.assertEqual(self.padron.cantidad_en("X"), 0)
+        self.assertIsNone(self.plazas.capacidad("X"))
+        self.assertFalse(self.plazas.hay_plaza("X"))
+        self.assertEqual(self.espera.en_espera("X"), 0)
+        self.assertNotIn("espera", self.padron.obtener("C", "C1"))
+        self.assertEqual(self.padron.obtener("C", "C1")["optativa"], "Y")  # Los demás no se tocan
+
+        # Si vuelve a subirse, empieza sin la ocupación de antes
+        main.aplicar_optativas([optativa("X", 2), optativa("Y", 1), optativa("Z", -1)])
+        self.assertEqual((self.plazas.ocupadas("X"), self.plazas.disponibles("X")), (0, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
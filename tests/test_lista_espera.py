@@ -0,0 +1,119 @@
+"""
+Listas de espera: orden de promoción (prioridad y luego orden de solicitud)
+y descarte perezoso de las solicitudes retiradas o reemplazadas.
+"""
+
+import tempfile
+import unittest
+
+import main
+from indexes import ListaEspera, Padron
+
+
+class OrdenYDescarte(unittest.TestCase):
+
+    def setUp(self):
+        self.padron = Padron()
+        self.espera = ListaEspera()
+        self.e0, self.e1, self.e2, self.e3 = (self.padron.agregar(f"E{i}", "C1") for i in range(4))
+
+    def sacar_todos(self, optativa):
+        nombres = []
+        while (est := self.espera.siguiente(optativa)) is not None:
+            nombres.append(est["nombre"])
+        return nombres
+
+    def test_orden_de_solicitud(self):
+        for est in (self.e2, self.e0, self.e3, self.e1):
+            self.espera.agregar(est, "X")
+        self.assertEqual(self.espera.en_espera("X"), 4)
+        self.assertEqual(self.sacar_todos("X"), ["E2", "E0", "E3", "E1"])
+        self.assertEqual(self.espera.en_espera("X"), 0)
+        self.assertNotIn("espera", self.e2)
+
+    def test_la_prioridad_va_antes_que_la_fecha(self):
+        self.espera.agregar(self.e0, "X")
+        self.espera.agregar(self.e1, "X", prioridad=-1)
+        self.espera.agregar(self.e2, "X")
+        self.assertEqual(self.sacar_todos("X"), ["E1", "E0", "E2"])
+
+    def test_las_solicitudes_retiradas_se_saltan(self):
+        for est in (self.e0, self.e1, self.e2):
+            self.espera.agregar(est, "X")
+        self.espera.quitar(self.e0)
+        self.espera.quitar(self.e2)
+        self.assertEqual(self.espera.en_espera("X"), 1)
+        self.assertEqual(self.espera.optativas(), ["X"])
+        self.assertEqual(self.sacar_todos("X"), ["E1"])
+        self.assertEqual(self.espera.optativas(), [])
+
+    def test_una_solicitud_nueva_reemplaza_la_anterior(self):
+        for est in (self.e0, self.e1, self.e2):
+            self.espera.agregar(est, "X")
+        self.espera.agregar(self.e0, "Y")
+        self.espera.agregar(self.e1, "X")  # Vuelve a pedir la misma: pasa al final
+        self.assertEqual(self.espera.en_espera("X"), 2)
+        self.assertEqual(self.sacar_todos("X"), ["E2", "E1"])
+        self.assertEqual(self.sacar_todos("Y"), ["E0"])
+
+    def test_reconstruir_desde_el_padron(self):
+        self.e0["espera"] = {"optativa": "X", "prioridad": 0, "solicitud": "2024-01-03T10:00:00"}
+        self.e1["espera"] = {"optativa": "X", "prioridad": 0, "solicitud": "2024-01-01T10:00:00"}
+        self.e3["espera"] = {"optativa": "X", "prioridad": 0, "solicitud": "2024-01-02T10:00:00"}
+        self.espera.reconstruir(self.padron)
+        self.assertEqual(self.sacar_todos("X"), ["E1", "E3", "E0"])
+
+    def test_descartar_optativa(self):
+        for est in (self.e0, self.e1):
+            self.espera.agregar(est, "X")
+        self.espera.agregar(self.e2, "Y")
+        self.espera.quitar(self.e0)
+        self.assertEqual([est["nombre"] for est in self.espera.descartar_optativa("X")], ["E1"])
+        self.assertNotIn("espera", self.e1)
+        self.assertEqual(self.espera.en_espera("X"), 0)
+        self.assertIsNone(self.espera.siguiente("X"))
+        self.assertEqual(self.sacar_todos("Y"), ["E2"])
+
+
+class PromocionAlLiberarPlaza(unittest.TestCase):
+    """promover_lista_espera de main sobre un fragmento vacío en una carpeta temporal."""
+
+    def setUp(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        self.fragmento = main.nuevo_fragmento("prueba", carpeta.name)
+        principal, main.fragmentos.principal = main.fragmentos.principal, self.fragmento
+        self.addCleanup(setattr, main.fragmentos, "principal", principal)
+
+        self.fragmento.catalogo.reconstruir([
+            {"nombre": "X", "profesor": "P", "plazas": 1, "relacionadas": [], "descripcion": ""},
+        ])
+        padron = self.fragmento.padron
+        self.titular = padron.agregar("E0", "C1", "X")
+        self.primero = padron.agregar("E1", "C1")
+        self.segundo = padron.agregar("E2", "C1")
+        self.fragmento.libro_plazas.reconstruir(self.fragmento.catalogo, padron)
+        self.fragmento.lista_espera.agregar(self.primero, "X")
+        self.fragmento.lista_espera.agregar(self.segundo, "X")
+
+    def test_la_plaza_liberada_pasa_al_primero_en_espera(self):
+        promovidos = []
+        main.eliminar_estudiante("E0", "C1", promovidos)
+        self.assertEqual(promovidos, [(self.primero, "X")])
+        self.assertEqual(self.primero["optativa"], "X")
+        self.assertNotIn("espera", self.primero)
+        self.assertEqual(self.fragmento.libro_plazas.disponibles("X"), 0)
+        self.assertEqual(self.fragmento.lista_espera.en_espera("X"), 1)
+
+        promovidos = []
+        main.asignar_estudiante(self.primero, "", promovidos)
+        self.assertEqual(promovidos, [(self.segundo, "X")])
+        self.assertEqual(self.fragmento.lista_espera.en_espera("X"), 0)
+
+    def test_sin_plaza_libre_nadie_sale_de_la_espera(self):
+        self.assertEqual(main.promover_lista_espera("X", []), [])
+        self.assertEqual(self.fragmento.lista_espera.en_espera("X"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
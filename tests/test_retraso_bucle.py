@@ -0,0 +1,130 @@
+"""
+El bucle de eventos no debe bloquearse mientras se guarda el padrón ni
+mientras se reajusta el índice de búsqueda: ambos trabajos corren en otro
+hilo. Una corrutina sonda corre a la par y MonitorBucle mide el retraso.
+
+    python -m pytest tests
+    python -m unittest discover tests
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import time
+import unittest
+
+from monitor import MonitorBucle
+from records import Estudiante, Optativa, Resena
+from search_engine import IndiceBusqueda, precargar
+from storage import AlmacenAsincrono
+
+# Retraso máximo tolerado. Un reajuste o un guardado hechos en el bucle lo superan holgadamente.
+RETRASO_MAXIMO = 0.1
+INTERVALO_SONDA = 0.005
+
+PALABRAS = ("álgebra", "datos", "redes", "grafos", "estadística", "compiladores", "optimización",
+            "probabilidad", "visión", "lenguajes", "modelos", "simulación", "criptografía", "bases")
+
+
+def catalogo(cantidad, azar):
+    return [
+        Optativa(
+            nombre=f"Optativa {i}", profesor=f"Profesor {i % 20}", plazas=30, relacionadas=[],
+            descripcion=" ".join(azar.choices(PALABRAS, k=200)) + f" tema{i}",
+        )
+        for i in range(cantidad)
+    ]
+
+
+def resenas(optativas, cantidad, azar):
+    return [
+        Resena(
+            nombre=f"Estudiante {i}", grupo="C311", usuario_telegram=f"u{i}",
+            optativa=azar.choice(optativas)["nombre"], puntuacion=azar.randint(1, 5),
+            comentario=" ".join(azar.choices(PALABRAS, k=30)) + f" palabra{i}",
+        )
+        for i in range(cantidad)
+    ]
+
+
+async def sondear(hasta):
+    """Corrutina sonda: se despierta cada pocos milisegundos y devuelve el mayor atraso observado."""
+    peor = 0.0
+    while not hasta.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(INTERVALO_SONDA)
+        peor = max(peor, time.perf_counter() - inicio - INTERVALO_SONDA)
+    return peor
+
+
+async def medir(trabajo):
+    """Corre 'trabajo' con la sonda y el monitor a la par. Devuelve (atraso de la sonda, percentiles)."""
+    monitor = MonitorBucle(intervalo=0.01, umbral=RETRASO_MAXIMO)
+    await monitor.iniciar()
+    terminado = asyncio.Event()
+    sonda = asyncio.create_task(sondear(terminado))
+    try:
+        await trabajo()
+    finally:
+        terminado.set()
+        peor = await sonda
+        await monitor.detener()
+    return peor, monitor.percentiles()
+
+
+class RetrasoBucle(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        precargar()
+        azar = random.Random(1)
+        cls.optativas = catalogo(400, azar)
+        cls.resenas = resenas(cls.optativas, 20000, azar)
+        cls.estudiantes = [
+            Estudiante(nombre=f"Estudiante {i}", grupo=f"C{i % 40}", optativa=f"Optativa {i % 400}")
+            for i in range(50000)
+        ]
+
+    def comprobar(self, peor, percentiles):
+        self.assertGreater(percentiles["muestras"], 0)
+        self.assertLess(percentiles["max"], RETRASO_MAXIMO, percentiles)
+        self.assertLess(peor, RETRASO_MAXIMO)
+
+    def test_reajuste_completo(self):
+        indice = IndiceBusqueda(0.5, 0.1)
+
+        async def reajustar():
+            await indice.reajustar(lambda: (self.optativas, self.resenas))
+
+        self.comprobar(*asyncio.run(medir(reajustar)))
+        self.assertEqual(len(indice.optativas), len(self.optativas))
+        self.assertTrue(indice.buscar("grafos"))
+
+    def test_reajuste_de_comentarios(self):
+        indice = IndiceBusqueda(0.5, 0.1)
+        indice.reconstruir(self.optativas, self.resenas)
+        nueva = Resena(self.resenas[0], comentario="palabrainedita")
+        self.assertTrue(indice.actualizar_resenas(nueva["optativa"], [nueva]))
+
+        async def reajustar():
+            # Las consultas siguen respondiendo con el ajuste anterior mientras tanto
+            tarea = indice.reajustar()
+            self.assertTrue(indice.buscar("grafos"))
+            await tarea
+
+        self.comprobar(*asyncio.run(medir(reajustar)))
+        self.assertIn("palabrainedita", indice._vectorizer_resenas.vocabulary_)
+
+    def test_guardado(self):
+        async def guardar():
+            almacen = AlmacenAsincrono()
+            with tempfile.TemporaryDirectory() as carpeta:
+                await almacen.escribir_json(os.path.join(carpeta, "estudiantes.json"), self.estudiantes)
+            almacen.cerrar()
+
+        self.comprobar(*asyncio.run(medir(guardar)))
+
+
+if __name__ == "__main__":
+    unittest.main()
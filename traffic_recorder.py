@@ -0,0 +1,220 @@
+"""
+Grabación anonimizada del tráfico de updates para reproducirlo después
+(ver replay.py).
+
+Cada update se guarda como una línea JSON en un diario comprimido con gzip:
+el instante relativo al inicio, el chat y el usuario reemplazados por un
+hash con sal, el tipo de update y el texto anonimizado. Del texto solo se
+conservan tal cual los comandos, los botones del menú, las palabras del
+catálogo (que es público) y los números cortos; el resto de las palabras se
+reemplaza por un hash. Una línea que identifica a un estudiante del padrón
+("Nombre Apellidos Grupo") se guarda como una referencia con hash, que el
+reproductor resuelve contra su copia de los datos. De los archivos subidos
+solo se guarda la extensión.
+
+Los mensajes de un usuario que está dando credenciales (la contraseña del
+login, o la lista de profesores con sus claves) no se guardan: el bot
+indica ese estado con la función 'credenciales' y el mensaje queda como un
+registro de tipo "credencial" sin texto.
+
+La sal de los hashes no va en la grabación sino en un archivo aparte
+(<grabación>.sal). Sin ella los hashes de palabras, chats y usuarios no se
+pueden comprobar por fuerza bruta; con ella y el padrón se resuelven las
+referencias a estudiantes, así que ese archivo debe tratarse con el mismo
+cuidado que la carpeta data y no compartirse junto con la grabación.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+from telegram import Update
+
+VERSION_FORMATO = 2
+PREFIJO_ESTUDIANTE = "@est:"
+_TOKEN = re.compile(r"(!?)([^\s*]+)(\**)")
+_PUNTUACION = ".,;:¿?¡!()\"'"
+
+
+def hash_corto(sal, valor, digitos=8):
+    return hashlib.blake2s(str(valor).encode("utf-8"), key=sal, digest_size=digitos // 2).hexdigest()
+
+
+def id_anonimo(sal, valor):
+    """Entero positivo estable para un chat o usuario."""
+    return int(hash_corto(sal, valor), 16) + 1
+
+
+class GrabadorUpdates:
+    """
+    Parámetros:
+      - ruta: archivo .jsonl.gz donde se agregan los updates
+      - catalogo, padron: índices del bot, para el vocabulario público y las referencias a estudiantes
+      - textos_fijos: textos que se guardan sin cambios (botones del menú)
+      - rol: función usuario_id → rol en el momento del update ("superadmin", "profesor" o None)
+      - credenciales: función usuario_id → True si el próximo mensaje del usuario
+        puede contener una contraseña; ese mensaje no se graba
+      - almacen: AlmacenAsincrono con el que se escribe el diario fuera del bucle
+    """
+
+    def __init__(self, ruta, catalogo, padron, textos_fijos=(), rol=None, almacen=None,
+                 max_pendientes=200, intervalo_volcado=10, credenciales=None):
+        self.ruta = ruta
+        self.catalogo = catalogo
+        self.padron = padron
+        self.textos_fijos = set(textos_fijos)
+        self.rol = rol
+        self.credenciales = credenciales
+        self.almacen = almacen
+        self.max_pendientes = max_pendientes
+        self.intervalo_volcado = intervalo_volcado
+        self.sal = os.urandom(16)
+        self.inicio = time.monotonic()
+        self._ultimo_volcado = self.inicio
+        self.grabados = 0
+        self._sal_guardada = False
+        self._pendientes = [json.dumps({
+            "formato": VERSION_FORMATO,
+            "inicio": datetime.now().isoformat(),
+        })]
+        self._vocabulario = None
+        self._version_vocabulario = None
+
+    # ---------- Anonimización ----------
+
+    def vocabulario(self):
+        if self._version_vocabulario != self.catalogo.version:
+            palabras = set()
+            for opt in self.catalogo:
+                texto = " ".join([opt["nombre"], opt["profesor"], opt.get("descripcion", "")] + opt.get("relacionadas", []))
+                palabras.update(p.strip(_PUNTUACION) for p in texto.lower().split())
+            self._vocabulario = palabras
+            self._version_vocabulario = self.catalogo.version
+        return self._vocabulario
+
+    def _anonimizar_linea(self, linea):
+        partes = linea.split()
+        if len(partes) >= 4 and self.padron.obtener(" ".join(partes[:-1]), partes[-1]):
+            return PREFIJO_ESTUDIANTE + hash_corto(self.sal, " ".join(partes))
+
+        vocabulario = self.vocabulario()
+        prefijo = ""
+        if linea.lstrip().startswith("-"):
+            prefijo, linea = "-", linea.lstrip()[1:]
+
+        def reemplazar(m):
+            negacion, palabra, estrellas = m.groups()
+            limpia = palabra.lower().strip(_PUNTUACION)
+            if limpia in vocabulario or (palabra.isdigit() and len(palabra) <= 3):
+                return m.group(0)
+            return f"{negacion}w{hash_corto(self.sal, limpia, 6)}{estrellas}"
+        return prefijo + _TOKEN.sub(reemplazar, linea)
+
+    def anonimizar(self, texto):
+        if texto in self.textos_fijos:
+            return texto
+        if texto.startswith("/"):
+            return texto.split()[0]  # Solo el comando, sin argumentos
+        return "\n".join(self._anonimizar_linea(linea) for linea in texto.split("\n"))
+
+    # ---------- Grabación ----------
+
+    def registrar(self, update, llegada=None):
+        """
+        Anota un update ('llegada' es su instante de llegada según time.monotonic).
+        Es barato: la escritura a disco va por lotes.
+        """
+        if not isinstance(update, Update):
+            return
+        registro = {"t": round((llegada or time.monotonic()) - self.inicio, 3)}
+        if update.effective_chat:
+            registro["c"] = id_anonimo(self.sal, update.effective_chat.id)
+        if update.effective_user:
+            registro["u"] = id_anonimo(self.sal, update.effective_user.id)
+            if self.rol:
+                rol = self.rol(update.effective_user.id)
+                if rol:
+                    registro["r"] = rol
+
+        if update.callback_query:
+            registro["k"] = "callback"
+            registro["d"] = update.callback_query.data
+        elif update.message and update.message.document:
+            registro["k"] = "documento"
+            registro["n"] = os.path.splitext(update.message.document.file_name or "")[1].lower()
+        elif (update.message and update.message.text is not None and update.effective_user
+              and self.credenciales and self.credenciales(update.effective_user.id)):
+            registro["k"] = "credencial"
+        elif update.message and update.message.text is not None:
+            registro["k"] = "texto"
+            registro["x"] = self.anonimizar(update.message.text)
+        else:
+            registro["k"] = "otro"
+
+        self._pendientes.append(json.dumps(registro, ensure_ascii=False))
+        self.grabados += 1
+
+    def necesita_volcar(self):
+        return (
+            len(self._pendientes) >= self.max_pendientes
+            or (self._pendientes and time.monotonic() - self._ultimo_volcado >= self.intervalo_volcado)
+        )
+
+    def _escribir(self, lineas):
+        carpeta = os.path.dirname(self.ruta)
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+        if not self._sal_guardada:
+            # Solo legible por el dueño; se crea antes que la grabación
+            descriptor = os.open(ruta_sal(self.ruta), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+                f.write(self.sal.hex())
+            self._sal_guardada = True
+        # Cada volcado agrega un miembro gzip nuevo; gzip.open los lee todos seguidos
+        with gzip.open(self.ruta, "at", encoding="utf-8") as f:
+            f.write("\n".join(lineas) + "\n")
+
+    async def volcar(self):
+        if not self._pendientes:
+            return
+        lineas, self._pendientes = self._pendientes, []
+        self._ultimo_volcado = time.monotonic()
+        if self.almacen is not None:
+            await self.almacen.ejecutar(self._escribir, lineas)
+        else:
+            self._escribir(lineas)
+
+
+def ruta_sal(ruta):
+    return ruta + ".sal"
+
+
+def leer_sal(ruta):
+    """Sal de una grabación (bytes), o None si su archivo .sal no está disponible."""
+    try:
+        with open(ruta_sal(ruta), "r", encoding="utf-8") as f:
+            return bytes.fromhex(f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def leer_grabacion(ruta):
+    """Devuelve (cabecera, lista de registros) de un diario grabado."""
+    with gzip.open(ruta, "rt", encoding="utf-8") as f:
+        lineas = [linea for linea in f if linea.strip()]
+    if not lineas:
+        raise ValueError("La grabación está vacía.")
+    cabecera = json.loads(lineas[0])
+    if cabecera.get("formato") != VERSION_FORMATO:
+        raise ValueError(f"Formato de grabación no soportado: {cabecera.get('formato')}")
+    registros = []
+    for linea in lineas[1:]:
+        try:
+            registros.append(json.loads(linea))
+        except json.JSONDecodeError:
+            break  # Último lote incompleto por un cierre abrupto
+    return cabecera, registros
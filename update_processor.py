@@ -0,0 +1,112 @@
+"""
+Procesamiento concurrente de updates con orden por chat.
+
+Los updates de chats distintos se atienden en paralelo (hasta un número
+fijo de trabajadores), pero los de un mismo chat se procesan uno detrás de
+otro y en el orden de llegada. Así las conversaciones (login, /rev, crear
+optativa...) nunca ven dos pasos a la vez, y un estudiante con una búsqueda
+lenta no frena al resto.
+
+Sobre el estado compartido: todos los handlers corren en el mismo bucle de
+eventos, por lo que cualquier modificación de los índices en memoria o de
+usuarios_logueados que no tenga un await en medio es atómica frente a los
+demás handlers y no necesita cerrojo. Solo las operaciones que ceden el
+control a mitad de una modificación (por ejemplo, resolver la asignación en
+otro hilo) deben tomar un cerrojo propio y revalidar los datos al volver.
+"""
+
+import asyncio
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ProcesadorPorChat(BaseUpdateProcessor):
+    """
+    Parámetros:
+      - max_trabajadores: handlers ejecutándose a la vez
+      - max_en_espera: updates aceptados a la vez, incluidos los que esperan
+        su turno en su chat (lo limita la clase base)
+      - al_recibir: función opcional (update, instante de llegada según
+        time.monotonic) que se llama cuando al update le toca su turno en su
+        chat, antes de procesarlo. Para entonces los updates anteriores del
+        mismo chat ya terminaron, así que ve el estado que dejaron (por
+        ejemplo, para grabar el tráfico sabiendo si se espera una contraseña)
+      - contexto: función opcional que recibe el update y devuelve un gestor de
+        contexto asíncrono dentro del cual se procesa (por ejemplo, para elegir
+        el fragmento de datos del usuario)
+      - sin_contexto: función async opcional (update, error) que se llama en
+        lugar de procesar el update cuando no se pudo entrar al contexto. Sin
+        ella, el error se propaga
+    """
+
+    def __init__(self, max_trabajadores=8, max_en_espera=256, al_recibir=None, contexto=None, sin_contexto=None):
+        super().__init__(max(max_en_espera, max_trabajadores))
+        self.max_trabajadores = max_trabajadores
+        self.al_recibir = al_recibir
+        self.contexto = contexto
+        self.sin_contexto = sin_contexto
+        self._trabajadores = asyncio.Semaphore(max_trabajadores)
+        # chat → [cerrojo, updates que lo usan]; se borra cuando nadie lo usa
+        self._chats = {}
+
+    @staticmethod
+    def _clave(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return ("usuario", update.effective_user.id)
+        return None
+
+    def en_espera(self):
+        """Updates aceptados que todavía no terminaron (en curso o esperando turno)."""
+        return sum(usos for _, usos in self._chats.values())
+
+    async def do_process_update(self, update, coroutine):
+        llegada = time.monotonic()
+        if self.contexto is not None:
+            coroutine = self._en_contexto(update, coroutine)
+        clave = self._clave(update)
+        if clave is None:
+            if self.al_recibir is not None:
+                self.al_recibir(update, llegada)
+            async with self._trabajadores:
+                await coroutine
+            return
+
+        entrada = self._chats.setdefault(clave, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                if self.al_recibir is not None:
+                    self.al_recibir(update, llegada)
+                async with self._trabajadores:
+                    await coroutine
+        finally:
+            entrada[1] -= 1
+            if not entrada[1]:
+                del self._chats[clave]
+
+    async def _en_contexto(self, update, coroutine):
+        dentro = False
+        try:
+            async with self.contexto(update):
+                dentro = True
+                await coroutine
+        except Exception as e:
+            if dentro:
+                raise
+            # El update no se procesa: se cierra la corrutina para que no quede pendiente
+            coroutine.close()
+            if self.sin_contexto is None:
+                raise
+            await self.sin_contexto(update, e)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass